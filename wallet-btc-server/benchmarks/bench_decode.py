@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+''' utility.decode_transaction_batch against the decoding paths it replaced, over a stand-in ElectrumX;
+    run from wallet-btc-server: python -m benchmarks.bench_decode '''
+
+from gevent import monkey
+monkey.patch_all()
+import os
+import json
+import time
+import struct
+import socket
+import gevent
+from http_server import config
+from http_server import address
+from http_server import raw_transaction
+from benchmarks.stand_in import StandInElectrumx
+
+TIP_HEIGHT = 800000
+PARENT_COUNT = 60
+CHILD_COUNT = 50
+INPUT_COUNT = 3
+LATENCY = 0.002
+
+
+def get_header(height):
+    return (struct.pack('<I', height) * 20).hex()
+
+
+def make_transaction(inputs, value_list):
+    ''' legacy transaction spending inputs [(txid, vout)], one p2pkh output per value '''
+    raw = struct.pack('<I', 1) + bytes([len(inputs)])
+    for txid, vout in inputs:
+        raw += bytes.fromhex(txid)[::-1] + struct.pack('<I', vout) + b'\x00' + b'\xff' * 4
+    raw += bytes([len(value_list)])
+    for value in value_list:
+        raw += struct.pack('<Q', value) + b'\x19\x76\xa9\x14' + os.urandom(20) + b'\x88\xac'
+    return (raw + b'\x00' * 4).hex()
+
+
+class Chain:
+    ''' CHILD_COUNT transactions of INPUT_COUNT inputs each, spending outputs of PARENT_COUNT shared parents '''
+
+    def __init__(self):
+        self.transaction = {}
+        parent_txid = []
+        for _ in range(PARENT_COUNT):
+            parent_txid.append(self.add(make_transaction([(os.urandom(32).hex(), 0)], [100000] * 4), TIP_HEIGHT - 1000))
+        self.child_txid = []
+        for index in range(CHILD_COUNT):
+            inputs = [(parent_txid[(index * INPUT_COUNT + one_input) % PARENT_COUNT], one_input) for one_input in range(INPUT_COUNT)]
+            self.child_txid.append(self.add(make_transaction(inputs, [140000, 150000]), TIP_HEIGHT - 100))
+
+    def add(self, raw_hex, height):
+        txid = raw_transaction.deserialize(raw_hex)['txid']
+        self.transaction[txid] = (raw_hex, height)
+        return txid
+
+    def get_transaction(self, params):
+        raw_hex, height = self.transaction[params['tx_hash']]
+        if not params.get('verbose'):
+            return raw_hex
+        transaction = raw_transaction.deserialize(raw_hex)
+        transaction['blockhash'] = address.double_sha256(bytes.fromhex(get_header(height)))[::-1].hex()
+        transaction['confirmations'] = TIP_HEIGHT - height + 1
+        transaction['blocktime'] = transaction['time'] = 1600000000
+        return transaction
+
+    def get_handlers(self):
+        return {'blockchain.transaction.get': self.get_transaction,
+                'blockchain.headers.subscribe': lambda params: {'height': TIP_HEIGHT, 'hex': get_header(TIP_HEIGHT)},
+                'blockchain.block.header': lambda params: get_header(params['height']),
+                'server.ping': lambda params: None}
+
+
+def old_tcp_call(request_json):
+    ''' electrumx_tcp.tcp_call before the connection pool: a new connection per request, recv(1024) into a str '''
+    electrumx_socket = socket.create_connection((config.config['host_electrumx'], config.config['port_electrumx']))
+    electrumx_socket.sendall((request_json + "\n").encode())
+    recv_data = ''
+    while True:
+        page_data = electrumx_socket.recv(1024).decode()
+        recv_data += page_data
+        if page_data.find("\n") != -1:
+            break
+    electrumx_socket.close()
+    return recv_data.split("\n", 1)[0]
+
+
+def old_get_transaction_batch(txid_batch):
+    one_request = [{"jsonrpc": "2.0", "method": "blockchain.transaction.get", "params": {'tx_hash': txid, 'verbose': True}, "id": index}
+                   for index, txid in enumerate(txid_batch)]
+    return json.loads(old_tcp_call(json.dumps(one_request, ensure_ascii=False)))
+
+
+def old_get_info(transaction, input_transaction_dict, utility):
+    ''' the info every old path assembled by hand '''
+    inputs = []
+    input_value_sum = 0
+    for one_txid_vout in utility.get_input_list_txid_vout(transaction):
+        one_address, one_value = utility.get_index_output_address_value(input_transaction_dict[one_txid_vout['txid']], one_txid_vout['vout'])
+        inputs.append({"from_address": one_address, "from_txid": one_txid_vout['txid'], "vin_index": one_txid_vout['vout'], "value": one_value})
+        input_value_sum += one_value
+    outputs = []
+    output_value_sum = 0
+    for index, one_output in enumerate(transaction['vout']):
+        one_address, one_value = utility.get_index_output_address_value(transaction, index)
+        outputs.append({'to_address': one_address, 'vout_index': index, 'value': one_value,
+                        'type': one_output['scriptPubKey']['type'], 'asm': one_output['scriptPubKey']['asm']})
+        output_value_sum += one_value
+    return {'txid': transaction['txid'], 'fee': input_value_sum - output_value_sum, 'inputs': inputs, 'outputs': outputs}
+
+
+def old_decode_one(txid, utility):
+    ''' /transaction/<txid> and utility.get_transaction_by_txid before: every previous transaction fetched one after another '''
+    transaction = old_get_transaction_batch([txid])[0]['result']
+    input_transaction_dict = {}
+    for one_txid_vout in utility.get_input_list_txid_vout(transaction):
+        input_transaction_dict[one_txid_vout['txid']] = old_get_transaction_batch([one_txid_vout['txid']])[0]['result']
+    return old_get_info(transaction, input_transaction_dict, utility)
+
+
+def old_decode_batch(txid_batch, utility):
+    ''' utility.get_transaction_by_txid_batch before: one primary batch, then previous transactions 20 at a time, page after page '''
+    transaction_list = [one_response['result'] for one_response in old_get_transaction_batch(txid_batch)]
+    input_txid = list(set([one_txid_vout['txid'] for one_transaction in transaction_list
+                           for one_txid_vout in utility.get_input_list_txid_vout(one_transaction)]))
+    input_transaction_dict = {}
+    for start in range(0, len(input_txid), 20):
+        for one_response in old_get_transaction_batch(input_txid[start:start + 20]):
+            input_transaction_dict[one_response['result']['txid']] = one_response['result']
+    return [old_get_info(one_transaction, input_transaction_dict, utility) for one_transaction in transaction_list]
+
+
+def reset_cache():
+    ''' a cold start: empty transaction caches and prevout index '''
+    from http_server import tx_cache, prevout_index
+    tx_cache.cache = None
+    tx_cache.decoded_cache = None
+    prevout_index.index = None
+
+
+def measure(stand_in, run):
+    stand_in.reset_counter()
+    start_time = time.perf_counter()
+    run()
+    return (time.perf_counter() - start_time) * 1000, stand_in.counter['request'], stand_in.counter['connection']
+
+
+def main():
+    chain = Chain()
+    stand_in = StandInElectrumx(chain.get_handlers(), LATENCY)
+    config.config['host_electrumx'] = '127.0.0.1'
+    config.config['port_electrumx'] = stand_in.port
+    config.config['transaction_cache_file'] = ''
+    from http_server import utility, rpc_call
+    # the tip subscription is up before anything is timed
+    rpc_call.get_tip_height()
+    gevent.sleep(0.2)
+    txid_list = chain.child_txid
+
+    rows = []
+    rows.append(('one by one, old serial prevouts', measure(stand_in, lambda: [old_decode_one(txid, utility) for txid in txid_list])))
+    reset_cache()
+    rows.append(('one by one, pipeline cold', measure(stand_in, lambda: [utility.decode_transaction_batch([txid]) for txid in txid_list])))
+    rows.append(('one by one, pipeline warm', measure(stand_in, lambda: [utility.decode_transaction_batch([txid]) for txid in txid_list])))
+    rows.append(('one batch, old paged prevouts', measure(stand_in, lambda: old_decode_batch(txid_list, utility))))
+    reset_cache()
+    rows.append(('one batch, pipeline cold', measure(stand_in, lambda: utility.decode_transaction_batch(txid_list))))
+    rows.append(('one batch, pipeline warm', measure(stand_in, lambda: utility.decode_transaction_batch(txid_list))))
+
+    print('%d transactions of %d inputs over %d parents, %d ms per upstream round trip' % (CHILD_COUNT, INPUT_COUNT, PARENT_COUNT, LATENCY * 1000))
+    print('%-34s %10s %18s %12s' % ('path', 'time', 'upstream requests', 'connections'))
+    for name, (elapsed, request_count, connection_count) in rows:
+        print('%-34s %7.1f ms %18d %12d' % (name, elapsed, request_count, connection_count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+''' electrumx_tcp.FrameReader against the recv(1024) / str loop tcp_call used before, over a socketpair;
+    run from wallet-btc-server: python -m benchmarks.bench_frame_reader '''
+
+import json
+import time
+import socket
+import threading
+from http_server import electrumx_tcp
+
+SIZES_MB = [1, 10, 50]
+REPEAT = 3
+
+
+def old_read(electrumx_socket):
+    ''' the loop of the old tcp_call '''
+    recv_data = ''
+    while True:
+        page_data = electrumx_socket.recv(1024).decode()
+        recv_data += page_data
+        if page_data.find("\n") != -1:
+            break
+    return recv_data.split("\n", 1)[0]
+
+
+def new_read(electrumx_socket):
+    return electrumx_tcp.FrameReader(electrumx_socket, 262144).read_frames()[0]
+
+
+def get_frame(size_mb):
+    ''' a batched listunspent answer of about size_mb megabytes '''
+    one_unspent = {'tx_hash': 'ab' * 32, 'tx_pos': 1, 'height': 700000, 'value': 100000}
+    one_size = len(json.dumps(one_unspent)) + 2
+    result = [one_unspent] * (size_mb * 1024 * 1024 // one_size)
+    return json.dumps({'jsonrpc': '2.0', 'result': result, 'id': 1}).encode() + b'\n'
+
+
+def measure(read, frame, parse):
+    ''' best of REPEAT, milliseconds from the first byte sent to the complete frame, and to its json when parse is set '''
+    best = None
+    for _ in range(REPEAT):
+        reader, writer = socket.socketpair()
+        sender = threading.Thread(target=writer.sendall, args=(frame,))
+        start_time = time.perf_counter()
+        sender.start()
+        one_frame = read(reader)
+        if parse:
+            json.loads(one_frame)
+        elapsed = (time.perf_counter() - start_time) * 1000
+        sender.join()
+        reader.close()
+        writer.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    print('frame   old recv loop   FrameReader   old + json.loads   FrameReader + json.loads')
+    for size_mb in SIZES_MB:
+        frame = get_frame(size_mb)
+        print('%3d MB  %10.1f ms  %9.1f ms  %14.1f ms  %22.1f ms' % (size_mb, measure(old_read, frame, False), measure(new_read, frame, False),
+                                                                    measure(old_read, frame, True), measure(new_read, frame, True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+''' history_index.History against the concatenate and sort assembly get_address_transactions used before, for one page;
+    run from wallet-btc-server: python -m benchmarks.bench_history_merge '''
+
+import time
+import random
+from operator import itemgetter
+from http_server import history_index
+
+ADDRESS_COUNT = 1000
+ENTRY_COUNT = 100
+# share of the entries that are a transaction of several of the wallet's addresses
+SHARED = 0.1
+MEMPOOL_COUNT = 2
+PAGE_SIZE = 20
+PAGES = [1, 50]
+REPEAT = 3
+
+
+def get_histories():
+    ''' scripthash -> electrumx history, ordered by height with the mempool last '''
+    random.seed(1)
+    histories = {}
+    shared = []
+    for address_index in range(ADDRESS_COUNT):
+        one_history = []
+        for entry_index in range(ENTRY_COUNT - MEMPOOL_COUNT):
+            if shared and random.random() < SHARED:
+                one_history.append(random.choice(shared))
+                continue
+            one_entry = {'tx_hash': '%08x%056x' % (address_index, entry_index), 'height': random.randint(600000, 800000)}
+            shared.append(one_entry)
+            one_history.append(one_entry)
+        for entry_index in range(MEMPOOL_COUNT):
+            one_history.append({'tx_hash': '%08x%056x' % (address_index, ENTRY_COUNT + entry_index), 'height': 0, 'fee': 1000})
+        one_history.sort(key=lambda one_entry: one_entry['height'] if one_entry['height'] > 0 else 1 << 62)
+        histories['%064x' % address_index] = one_history
+    return histories
+
+
+def decode(real_txid):
+    ''' stand-in for utility.get_transaction_by_txid_batch, the answers come back in another order '''
+    return [{'txid': one_txid} for one_txid in reversed(real_txid)]
+
+
+def old_page(histories, page):
+    ''' the old get_address_transactions: list + per address, a full sort, then a nested loop to put the page in order '''
+    all_transactions = []
+    for one_history in histories.values():
+        all_transactions = all_transactions + one_history
+    all_transactions.sort(key=itemgetter('height'), reverse=True)
+    index = len(all_transactions) - 1
+    while index >= 0 and all_transactions[index]['height'] == 0:
+        index = index - 1
+    if index >= 0:
+        all_transactions = all_transactions[index+1:] + all_transactions[0:index+1]
+    real_txid = [one_transaction['tx_hash'] for one_transaction in all_transactions[PAGE_SIZE * (page - 1):PAGE_SIZE * page]]
+    info_temp = decode(real_txid)
+    info = []
+    for one_txid in real_txid:
+        for one_info in info_temp:
+            if one_txid == one_info['txid']:
+                info.append(one_info)
+    return info
+
+
+def new_page(histories, page, one_history=None):
+    ''' heap merge read only as far as the page, deduplicated, reordered through a dict '''
+    if one_history is None:
+        one_history = history_index.History('')
+        one_history.scripthash_history = histories
+        one_history.rebuild()
+    real_transaction, _ = one_history.get_page(PAGE_SIZE * (page - 1), PAGE_SIZE)
+    real_txid = [one_transaction['tx_hash'] for one_transaction in real_transaction]
+    info_dict = {one_info['txid']: one_info for one_info in decode(real_txid)}
+    return [info_dict[one_txid] for one_txid in real_txid if one_txid in info_dict]
+
+
+def measure(run):
+    best = None
+    for _ in range(REPEAT):
+        start_time = time.perf_counter()
+        run()
+        elapsed = (time.perf_counter() - start_time) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    histories = get_histories()
+    entry_count = sum(len(one_history) for one_history in histories.values())
+    unique_count = len(set(one_entry['tx_hash'] for one_history in histories.values() for one_entry in one_history))
+    print('%d addresses, %d history entries, %d distinct transactions, page size %d, best of %d'
+          % (ADDRESS_COUNT, entry_count, unique_count, PAGE_SIZE, REPEAT))
+    print('page   old concatenate + sort   heap merge   heap merge, history kept')
+    for page in PAGES:
+        kept = history_index.History('')
+        kept.scripthash_history = histories
+        kept.rebuild()
+        new_page(histories, page, kept)
+        print('%4d  %20.1f ms  %8.1f ms  %21.2f ms' % (page, measure(lambda: old_page(histories, page)),
+                                                     measure(lambda: new_page(histories, page)),
+                                                     measure(lambda: new_page(histories, page, kept))))
+
+
+if __name__ == '__main__':
+    main()
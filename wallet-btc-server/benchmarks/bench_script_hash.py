@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+''' address -> scripthash of utility.get_script_hash against the big integer decoder it replaced, for one wallet request;
+    run from wallet-btc-server: python -m benchmarks.bench_script_hash '''
+
+import time
+import struct
+from hashlib import sha256
+from http_server import address
+from http_server import utility
+
+ADDRESS_COUNT = 500
+REQUEST_COUNT = 200
+
+Base58Alphabet = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def base58decode(data):
+    result = 0
+    for d in data:
+        charIndex = Base58Alphabet.find(d)
+        result = result * len(Base58Alphabet)
+        result = result + charIndex
+    decoded = hex(result)
+    return decoded
+
+
+def old_check_address(address):
+    ''' the old check_address, the alphabet only '''
+    for d in address:
+        charIndex = Base58Alphabet.find(d)
+        if -1 == charIndex:
+            return False
+    return True
+
+
+def old_get_script_hash(address):
+    hex_address = base58decode(address)
+    pub_key_hash = hex_address[2:len(hex_address) - 8]
+
+    if 0 != len(pub_key_hash) % 2:
+        pub_key_hash = '0' + pub_key_hash
+
+    script = "76a914" + pub_key_hash + "88ac"
+    temp = sha256(bytes.fromhex(script)).digest().hex()
+    result = ''
+    index = 0
+    lenght = len(temp)
+    while index < lenght:
+        result = temp[index:index+2] + result
+        index += 2
+    return result
+
+
+def old_request(address_batch):
+    ''' what an /address* request did: check every address, then the scripthash list '''
+    checked = [one_address for one_address in address_batch if old_check_address(one_address)]
+    return [old_get_script_hash(one_address) for one_address in checked]
+
+
+def new_request(address_batch):
+    checked = [one_address for one_address in address_batch if utility.check_address(one_address)]
+    return utility.get_address_list_and_dict_hash_list_by_address(checked)[0]
+
+
+def uncached_request(address_batch):
+    ''' the bytes decoder with the lru bypassed '''
+    get_script_hash = utility.get_script_hash.__wrapped__
+    checked = [one_address for one_address in address_batch if get_script_hash(one_address) is not None]
+    return [get_script_hash(one_address) for one_address in checked]
+
+
+def measure(run, address_batch):
+    ''' milliseconds per request, averaged over REQUEST_COUNT requests for the same wallet '''
+    start_time = time.perf_counter()
+    for _ in range(REQUEST_COUNT):
+        result = run(address_batch)
+    assert len(result) == len(address_batch)
+    return (time.perf_counter() - start_time) * 1000 / REQUEST_COUNT
+
+
+def main():
+    # the old decoder drops leading zero bytes of the hash, those addresses are left out so both agree
+    hash_list = [sha256(struct.pack('>I', index)).digest()[:20] for index in range(ADDRESS_COUNT * 2)]
+    address_batch = [address.script_to_address(b'\x76\xa9\x14' + one_hash + b'\x88\xac')[1][0]
+                     for one_hash in hash_list if one_hash[0] != 0][:ADDRESS_COUNT]
+    assert old_request(address_batch) == new_request(address_batch)
+    old_time = measure(old_request, address_batch)
+    uncached_time = measure(uncached_request, address_batch)
+    new_time = measure(new_request, address_batch)
+    print('%d p2pkh addresses per request, %d requests for the same wallet' % (ADDRESS_COUNT, REQUEST_COUNT))
+    print('old big integer decoder          %6.2f ms per request' % old_time)
+    print('bytes decoder, no cache          %6.2f ms per request' % uncached_time)
+    print('bytes decoder with the lru       %6.2f ms per request' % new_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+''' rpc_call.batch_call with single-flight against the same executor without it, many clients at once over a stand-in ElectrumX;
+    run from wallet-btc-server: python -m benchmarks.bench_single_flight '''
+
+from gevent import monkey
+monkey.patch_all()
+import time
+import random
+import hashlib
+import gevent
+from gevent.pool import Pool
+from http_server import config
+from benchmarks.stand_in import StandInElectrumx
+
+CLIENT_COUNT = 50
+ADDRESS_COUNT = 100
+HOT_ADDRESS_COUNT = 300
+LATENCY = 0.002
+# cpu electrumx spends on one request, it holds the process like the real one does
+REQUEST_TIME = 0.0001
+
+
+def get_balance(params):
+    end_time = time.perf_counter() + REQUEST_TIME
+    while time.perf_counter() < end_time:
+        pass
+    return {'confirmed': 100000, 'unconfirmed': 0}
+
+
+def plain_batch_call(method, params_list):
+    ''' rpc_call.batch_call without the single-flight table: every caller sends all of its requests '''
+    from http_server import electrumx_tcp
+    one_request = [{"jsonrpc": "2.0", "method": method, "params": params, "id": index} for index, params in enumerate(params_list)]
+    chunk_size = config.config['electrumx_batch_size']
+    chunks = [one_request[index:index + chunk_size] for index in range(0, len(one_request), chunk_size)]
+    result = []
+    for response in Pool(config.config['electrumx_batch_parallel']).imap_unordered(electrumx_tcp.request, chunks):
+        result.extend(response)
+    return sorted(result, key=lambda one_response: one_response['id'])
+
+
+def measure(stand_in, batch_call, address_lists):
+    ''' all clients start together, milliseconds until the last one has its answer '''
+    stand_in.reset_counter()
+    start_time = time.perf_counter()
+    clients = [gevent.spawn(batch_call, "blockchain.scripthash.get_balance", [{'scripthash': one_hash} for one_hash in one_list])
+               for one_list in address_lists]
+    gevent.joinall(clients, raise_error=True)
+    assert all(len(one_client.value) == len(one_list) for one_client, one_list in zip(clients, address_lists))
+    return (time.perf_counter() - start_time) * 1000, stand_in.counter['request']
+
+
+def main():
+    stand_in = StandInElectrumx({'blockchain.scripthash.get_balance': get_balance,
+                                 'server.ping': lambda params: None}, LATENCY)
+    config.config['host_electrumx'] = '127.0.0.1'
+    config.config['port_electrumx'] = stand_in.port
+    config.config['transaction_cache_file'] = ''
+    from http_server import rpc_call
+    random.seed(1)
+    hot_hash = [hashlib.sha256(str(index).encode()).hexdigest() for index in range(HOT_ADDRESS_COUNT)]
+    # the same watched addresses from every client, and overlapping wallets drawn from a hot set
+    same_lists = [hot_hash[:ADDRESS_COUNT]] * CLIENT_COUNT
+    overlap_lists = [random.sample(hot_hash, ADDRESS_COUNT) for _ in range(CLIENT_COUNT)]
+    # connections of the pool are open before anything is timed
+    plain_batch_call("server.ping", [{}])
+
+    print('%d clients with %d addresses each, %d ms per upstream round trip' % (CLIENT_COUNT, ADDRESS_COUNT, LATENCY * 1000))
+    print('%-28s %-16s %10s %18s' % ('clients ask for', 'path', 'time', 'upstream requests'))
+    for name, address_lists in (('the same addresses', same_lists), ('overlapping addresses', overlap_lists)):
+        for path, batch_call in (('no coalescing', plain_batch_call), ('single-flight', rpc_call.batch_call)):
+            elapsed, request_count = measure(stand_in, batch_call, address_lists)
+            print('%-28s %-16s %7.1f ms %18d' % (name, path, elapsed, request_count))
+
+
+if __name__ == '__main__':
+    main()
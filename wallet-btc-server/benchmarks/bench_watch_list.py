@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+''' notify.get_push_list over the WatchList index against the nested scan of every watched address it replaced;
+    run from wallet-btc-server: python -m benchmarks.bench_watch_list '''
+
+import time
+import random
+from http_server import notify
+from http_server import watch_list
+
+WATCHED_COUNT = 1000000
+TRANSACTION_COUNT = 5000
+# the nested scan costs hours on the whole burst, it is timed on these first transactions and scaled up
+OLD_TRANSACTION_COUNT = 10
+# share of inputs and outputs that pay a watched address
+WATCHED_SHARE = 0.01
+
+
+def get_address(index):
+    return '1%033d' % index
+
+
+def get_subscription_list():
+    return [{'name': get_address(index), 'cid': 'cid%d' % index, 'chain_type': 'BTC', 'chain_id': '0',
+             'language': 'en', 'platform': 'android'} for index in range(WATCHED_COUNT)]
+
+
+def get_burst():
+    ''' decoded transactions of two inputs and two outputs, as utility.get_transaction_info_batch returns them '''
+    random.seed(1)
+
+    def pick():
+        if random.random() < WATCHED_SHARE:
+            return get_address(random.randrange(WATCHED_COUNT))
+        return get_address(WATCHED_COUNT + random.randrange(WATCHED_COUNT))
+
+    burst = []
+    for index in range(TRANSACTION_COUNT):
+        txid = '%064x' % index
+        burst.append({'txid': txid,
+                      'inputs': [{'from_address': pick(), 'from_txid': txid, 'vin_index': vin} for vin in range(2)],
+                      'outputs': [{'to_address': pick(), 'vout_index': vout} for vout in range(2)]})
+    return burst
+
+
+def old_get_push_list(unconfirmed_transaction_info, notify_address):
+    ''' the loops of the old notify_new_unconfirmed_transaction '''
+    push_list = []
+    for one_transaction in unconfirmed_transaction_info:
+        for one_input in one_transaction['inputs']:
+            for one_address in notify_address:
+                if one_address['name'] == one_input['from_address']:
+                    push_list.append(notify.get_push_info(one_address, 2, str(2)+one_input['from_txid']+str(one_input['vin_index'])))
+        for one_output in one_transaction['outputs']:
+            for one_address in notify_address:
+                if one_address['name'] == one_output['to_address']:
+                    push_list.append(notify.get_push_info(one_address, 1, str(1)+one_transaction['txid']+str(one_output['vout_index'])))
+    return push_list
+
+
+def main():
+    subscription_list = get_subscription_list()
+    burst = get_burst()
+    print('%d watched addresses, a burst of %d transactions with 2 inputs and 2 outputs each' % (WATCHED_COUNT, TRANSACTION_COUNT))
+
+    start_time = time.perf_counter()
+    notify_watch_list = watch_list.WatchList()
+    notify_watch_list.rebuild(subscription_list)
+    print('index rebuild                    %10.1f ms' % ((time.perf_counter() - start_time) * 1000))
+
+    start_time = time.perf_counter()
+    push_list = notify.get_push_list(burst, notify_watch_list)
+    print('burst matched through the index  %10.1f ms, %d pushes' % ((time.perf_counter() - start_time) * 1000, len(push_list)))
+
+    start_time = time.perf_counter()
+    old_push_list = old_get_push_list(burst[:OLD_TRANSACTION_COUNT], subscription_list)
+    elapsed = (time.perf_counter() - start_time) * 1000
+    assert old_push_list == notify.get_push_list(burst[:OLD_TRANSACTION_COUNT], notify_watch_list)
+    print('burst matched by nested scan     %10.1f ms, scaled up from %d transactions taking %.1f ms'
+          % (elapsed * TRANSACTION_COUNT / OLD_TRANSACTION_COUNT, OLD_TRANSACTION_COUNT, elapsed))
+
+
+if __name__ == '__main__':
+    main()
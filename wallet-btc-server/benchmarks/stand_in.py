@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+''' a local ElectrumX stand-in for the benchmarks '''
+
+import json
+import gevent
+from gevent.lock import Semaphore
+from gevent.server import StreamServer
+
+
+class StandInElectrumx:
+    ''' newline framed json rpc over tcp, handlers[method](params) -> result; every request line, a batch included,
+        is answered after latency seconds, and the lines of one connection are answered concurrently '''
+
+    def __init__(self, handlers, latency):
+        self.handlers = handlers
+        self.latency = latency
+        self.counter = {'line': 0, 'request': 0, 'connection': 0}
+        self.server = StreamServer(('127.0.0.1', 0), self.handle)
+        self.server.start()
+        self.port = self.server.server_port
+
+    def answer(self, one_request):
+        self.counter['request'] += 1
+        handler = self.handlers.get(one_request['method'])
+        if handler is None:
+            return {'jsonrpc': '2.0', 'error': {'code': -32601, 'message': 'unknown method'}, 'id': one_request['id']}
+        return {'jsonrpc': '2.0', 'result': handler(one_request['params']), 'id': one_request['id']}
+
+    def answer_line(self, electrumx_socket, send_lock, line):
+        self.counter['line'] += 1
+        one_request = json.loads(line)
+        gevent.sleep(self.latency)
+        if isinstance(one_request, list):
+            response = [self.answer(one_item) for one_item in one_request]
+        else:
+            response = self.answer(one_request)
+        with send_lock:
+            electrumx_socket.sendall(json.dumps(response).encode() + b'\n')
+
+    def handle(self, electrumx_socket, _):
+        self.counter['connection'] += 1
+        send_lock = Semaphore()
+        for line in electrumx_socket.makefile('rb'):
+            gevent.spawn(self.answer_line, electrumx_socket, send_lock, line)
+
+    def reset_counter(self):
+        for key in self.counter:
+            self.counter[key] = 0
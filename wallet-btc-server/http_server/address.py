@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+from hashlib import sha256
+import hashlib
+
+
+Base58Alphabet = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+Bech32Alphabet = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+Base58Index = {one_char: index for index, one_char in enumerate(Base58Alphabet)}
+
+# mainnet
+P2PKH_VERSION = 0x00
+P2SH_VERSION = 0x05
+SEGWIT_HRP = 'bc'
+
+BECH32_CONST = 1
+BECH32M_CONST = 0x2bc830a3
+
+
+def double_sha256(data):
+    return sha256(sha256(data).digest()).digest()
+
+
+def hash160(data):
+    return hashlib.new('ripemd160', sha256(data).digest()).digest()
+
+
+def base58encode(data):
+    number = int.from_bytes(data, 'big')
+    result = []
+    while number > 0:
+        number, remainder = divmod(number, 58)
+        result.append(Base58Alphabet[remainder])
+    # every leading zero byte is one leading '1'
+    for one_byte in data:
+        if 0 != one_byte:
+            break
+        result.append(Base58Alphabet[0])
+    return ''.join(reversed(result))
+
+
+def base58check_encode(version, payload):
+    data = bytes([version]) + payload
+    return base58encode(data + double_sha256(data)[:4])
+
+
+def base58decode(text):
+    ''' -> bytes, None when some character is not base58 '''
+    number = 0
+    for one_char in text:
+        value = Base58Index.get(one_char)
+        if value is None:
+            return None
+        number = number * 58 + value
+    # every leading '1' is one leading zero byte
+    zero_count = len(text) - len(text.lstrip(Base58Alphabet[0]))
+    return bytes(zero_count) + number.to_bytes((number.bit_length() + 7) // 8, 'big')
+
+
+def base58check_data(text):
+    ''' -> bytes without the checksum, None when it is not base58 or the checksum does not match '''
+    data = base58decode(text)
+    if data is None or len(data) < 5 or double_sha256(data[:-4])[:4] != data[-4:]:
+        return None
+    return data[:-4]
+
+
+def base58check_decode(text):
+    ''' -> (version, payload), None when it is not base58check '''
+    data = base58check_data(text)
+    if data is None:
+        return None
+    return data[0], data[1:]
+
+
+def get_script_hash(script):
+    ''' electrumx scripthash: sha256 of the output script, byte reversed '''
+    return sha256(script).digest()[::-1].hex()
+
+
+def bech32_polymod(values):
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for index in range(5):
+            checksum ^= generator[index] if ((top >> index) & 1) else 0
+    return checksum
+
+
+def bech32_hrp_expand(hrp):
+    return [ord(one_char) >> 5 for one_char in hrp] + [0] + [ord(one_char) & 31 for one_char in hrp]
+
+
+def convert_bits(data, from_bits, to_bits, pad=True):
+    accumulator = 0
+    bits = 0
+    result = []
+    max_value = (1 << to_bits) - 1
+    for value in data:
+        if value < 0 or (value >> from_bits):
+            return None
+        accumulator = (accumulator << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((accumulator >> bits) & max_value)
+    if pad:
+        if bits:
+            result.append((accumulator << (to_bits - bits)) & max_value)
+    elif bits >= from_bits or ((accumulator << (to_bits - bits)) & max_value):
+        return None
+    return result
+
+
+def segwit_encode(hrp, witness_version, program):
+    ''' bech32 for witness v0, bech32m for v1 and later (bip173, bip350) '''
+    data = [witness_version] + convert_bits(program, 8, 5)
+    const = BECH32_CONST if 0 == witness_version else BECH32M_CONST
+    polymod = bech32_polymod(bech32_hrp_expand(hrp) + data + [0, 0, 0, 0, 0, 0]) ^ const
+    checksum = [(polymod >> 5 * (5 - index)) & 31 for index in range(6)]
+    return hrp + '1' + ''.join([Bech32Alphabet[value] for value in data + checksum])
+
+
+def segwit_decode(hrp, address):
+    ''' -> (witness version, program), None when it is not a valid segwit address of hrp (bip173, bip350) '''
+    if address.lower() != address and address.upper() != address:
+        return None
+    address = address.lower()
+    position = address.rfind('1')
+    if position < 1 or position + 7 > len(address) or len(address) > 90 or address[:position] != hrp:
+        return None
+    data = [Bech32Alphabet.find(one_char) for one_char in address[position + 1:]]
+    if -1 in data or len(data) < 7:
+        return None
+    const = bech32_polymod(bech32_hrp_expand(hrp) + data)
+    witness_version = data[0]
+    if const != (BECH32_CONST if 0 == witness_version else BECH32M_CONST):
+        return None
+    program = convert_bits(data[1:-6], 5, 8, False)
+    if program is None or len(program) < 2 or len(program) > 40 or witness_version > 16:
+        return None
+    if 0 == witness_version and len(program) not in (20, 32):
+        return None
+    return witness_version, bytes(program)
+
+
+def address_to_script(address):
+    ''' output script paying to a p2pkh, p2sh or segwit (p2wpkh, p2wsh, p2tr and later versions) address,
+        None when the address is not valid '''
+    if address[:len(SEGWIT_HRP) + 1].lower() == SEGWIT_HRP + '1':
+        decoded = segwit_decode(SEGWIT_HRP, address)
+        if decoded is None:
+            return None
+        witness_version, program = decoded
+        return bytes([witness_version + 0x50 if witness_version else 0, len(program)]) + program
+
+    decoded = base58check_decode(address)
+    if decoded is None:
+        return None
+    version, payload = decoded
+    if 20 != len(payload):
+        return None
+    if P2PKH_VERSION == version:
+        return b'\x76\xa9\x14' + payload + b'\x88\xac'
+    if P2SH_VERSION == version:
+        return b'\xa9\x14' + payload + b'\x87'
+    return None
+
+
+def script_to_address(script):
+    ''' standard output script -> (bitcoind script type, address list) '''
+    length = len(script)
+    if 25 == length and script[0] == 0x76 and script[1] == 0xa9 and script[2] == 0x14 and script[23] == 0x88 and script[24] == 0xac:
+        return 'pubkeyhash', [base58check_encode(P2PKH_VERSION, script[3:23])]
+    if 23 == length and script[0] == 0xa9 and script[1] == 0x14 and script[22] == 0x87:
+        return 'scripthash', [base58check_encode(P2SH_VERSION, script[2:22])]
+    if 22 == length and script[0] == 0x00 and script[1] == 0x14:
+        return 'witness_v0_keyhash', [segwit_encode(SEGWIT_HRP, 0, script[2:])]
+    if 34 == length and script[0] == 0x00 and script[1] == 0x20:
+        return 'witness_v0_scripthash', [segwit_encode(SEGWIT_HRP, 0, script[2:])]
+    if 34 == length and script[0] == 0x51 and script[1] == 0x20:
+        return 'witness_v1_taproot', [segwit_encode(SEGWIT_HRP, 1, script[2:])]
+    if 4 <= length <= 42 and 0x51 <= script[0] <= 0x60 and script[1] + 2 == length:
+        return 'witness_unknown', [segwit_encode(SEGWIT_HRP, script[0] - 0x50, script[2:])]
+    if (35 == length and script[0] == 0x21 and script[34] == 0xac) or (67 == length and script[0] == 0x41 and script[66] == 0xac):
+        return 'pubkey', [base58check_encode(P2PKH_VERSION, hash160(script[1:-1]))]
+    if length > 0 and script[0] == 0x6a:
+        return 'nulldata', []
+    if length >= 37 and 0x51 <= script[0] <= 0x60 and script[-1] == 0xae and 0x51 <= script[-2] <= 0x60:
+        addresses = []
+        position = 1
+        while position < length - 2 and script[position] in (0x21, 0x41):
+            size = script[position]
+            addresses.append(base58check_encode(P2PKH_VERSION, hash160(script[position + 1:position + 1 + size])))
+            position += 1 + size
+        if position == length - 2 and len(addresses) == script[-2] - 0x50:
+            return 'multisig', addresses
+    return 'nonstandard', []
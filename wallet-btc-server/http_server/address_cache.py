@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import socket
+import gevent
+from gevent.pool import Pool
+from collections import OrderedDict
+from .log import logger
+from . import config
+from . import electrumx_tcp
+
+
+SUBSCRIBE_METHOD = "blockchain.scripthash.subscribe"
+UNSUBSCRIBE_METHOD = "blockchain.scripthash.unsubscribe"
+
+
+class AddressState:
+    ''' status hash electrumx reported for a scripthash and the results fetched while it held, size is their json length '''
+    __slots__ = ('status', 'generation', 'result', 'size')
+
+    def __init__(self, status):
+        self.status = status
+        self.generation = 0
+        self.result = {}
+        self.size = 0
+
+
+class AddressCache:
+    ''' scripthash -> AddressState for subscribed scripthashes; a status notification drops the cached results,
+        so whatever is cached is as fresh as electrumx. subscriptions and cached bytes are capped, the least recently used goes first '''
+
+    def __init__(self, host, port, timeout, recv_buffer_size, max_subscriptions, memory_bytes, ping_interval):
+        self.pid = os.getpid()
+        self.max_subscriptions = max_subscriptions
+        self.memory_bytes = memory_bytes
+        self.used_bytes = 0
+        self.entries = OrderedDict()
+        # scripthashes whose subscription is in flight
+        self.subscribing = set()
+        self.connection = electrumx_tcp.ElectrumxConnection(host, port, timeout, recv_buffer_size,
+                                                            self.on_notification, self.on_close)
+        self.counter = {'hit': 0, 'miss': 0, 'subscribe': 0, 'invalidation': 0, 'eviction': 0, 'reset': 0}
+        if ping_interval > 0:
+            gevent.spawn(self.keepalive_loop, ping_interval)
+
+    def on_notification(self, method, params):
+        if SUBSCRIBE_METHOD != method or len(params) < 2:
+            return
+        one_state = self.entries.get(params[0])
+        if one_state is None or one_state.status == params[1]:
+            return
+        one_state.status = params[1]
+        one_state.generation += 1
+        one_state.result = {}
+        self.used_bytes -= one_state.size
+        one_state.size = 0
+        self.counter['invalidation'] += 1
+
+    def on_close(self):
+        # the subscriptions died with the socket, nothing cached can be trusted any more
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.counter['reset'] += 1
+
+    def keepalive_loop(self, ping_interval):
+        while True:
+            gevent.sleep(ping_interval)
+            if not self.connection.is_connected():
+                continue
+            one_response = self.connection.call({"jsonrpc": "2.0", "method": "server.ping", "params": [], "id": 0})
+            if one_response is None or 'error' in one_response:
+                logger.error("address cache keepalive failed, reconnect")
+                electrumx_socket = self.connection.electrumx_socket
+                if electrumx_socket is not None:
+                    self.connection.close(electrumx_socket)
+
+    def subscribe_chunk(self, chunk):
+        one_request = [{"jsonrpc": "2.0", "method": SUBSCRIBE_METHOD, "params": {'scripthash': one_scripthash}, "id": chunk_index}
+                       for chunk_index, one_scripthash in enumerate(chunk)]
+        response = self.connection.call(one_request)
+        if not isinstance(response, list):
+            return
+        for one_response in response:
+            if 'error' in one_response or one_response.get('id') not in range(len(chunk)):
+                continue
+            self.entries[chunk[one_response['id']]] = AddressState(one_response['result'])
+            self.counter['subscribe'] += 1
+
+    def subscribe(self, scripthash_list):
+        ''' subscribe scripthash_list, electrumx_batch_size chunks in flight together on the one socket '''
+        try:
+            self.connection.connect()
+            chunk_size = config.config['electrumx_batch_size']
+            chunks = [scripthash_list[index:index + chunk_size] for index in range(0, len(scripthash_list), chunk_size)]
+            Pool(config.config['electrumx_batch_parallel']).map(self.subscribe_chunk, chunks)
+        except socket.error:
+            logger.error("address cache connect failed " + self.connection.host + ":" + str(self.connection.port))
+        finally:
+            self.subscribing.difference_update(scripthash_list)
+        self.evict()
+
+    def evict(self):
+        evicted = []
+        while len(self.entries) > self.max_subscriptions or (self.used_bytes > self.memory_bytes and self.entries):
+            one_scripthash, one_state = self.entries.popitem(last=False)
+            self.used_bytes -= one_state.size
+            evicted.append(one_scripthash)
+            self.counter['eviction'] += 1
+        if 0 != len(evicted):
+            gevent.spawn(self.connection.call, [{"jsonrpc": "2.0", "method": UNSUBSCRIBE_METHOD, "params": {'scripthash': one_scripthash}, "id": index}
+                                                for index, one_scripthash in enumerate(evicted)])
+
+    def get_batch(self, method, scripthash_list, fetch):
+        ''' batch_call shaped responses of method for scripthash_list, fetch(missing scripthash list) is only asked for
+            results not cached under the current status '''
+        result = [None]*len(scripthash_list)
+        missing_index = []
+        for index, one_scripthash in enumerate(scripthash_list):
+            one_state = self.entries.get(one_scripthash)
+            if one_state is not None and method in one_state.result:
+                self.entries.move_to_end(one_scripthash)
+                result[index] = {"jsonrpc": "2.0", "result": one_state.result[method], "id": index}
+                self.counter['hit'] += 1
+            else:
+                missing_index.append(index)
+                self.counter['miss'] += 1
+        if 0 == len(missing_index):
+            return result
+
+        missing = [scripthash_list[index] for index in missing_index]
+        if self.max_subscriptions > 0:
+            # subscribed in the background; a result fetched before its subscription is in place is not kept,
+            # the next request finds the subscription and caches
+            new_scripthash = [one_scripthash for one_scripthash in dict.fromkeys(missing)
+                              if one_scripthash not in self.entries and one_scripthash not in self.subscribing]
+            if 0 != len(new_scripthash):
+                self.subscribing.update(new_scripthash)
+                gevent.spawn(self.subscribe, new_scripthash)
+        # a notification arriving while the fetch runs makes its result unsafe to keep
+        generation = {}
+        for one_scripthash in missing:
+            if one_scripthash in self.entries:
+                generation[one_scripthash] = self.entries[one_scripthash].generation
+
+        for one_response in fetch(missing):
+            index = missing_index[one_response['id']]
+            one_response['id'] = index
+            result[index] = one_response
+            one_scripthash = scripthash_list[index]
+            one_state = self.entries.get(one_scripthash)
+            if 'error' in one_response or one_state is None or one_state.generation != generation.get(one_scripthash):
+                continue
+            if method in one_state.result:
+                continue
+            size = len(json.dumps(one_response['result']))
+            one_state.result[method] = one_response['result']
+            one_state.size += size
+            self.used_bytes += size
+        self.evict()
+        return [one_response for one_response in result if one_response is not None]
+
+    def get_counter(self):
+        result = dict(self.counter)
+        result['entries'] = len(self.entries)
+        result['memory_bytes'] = self.used_bytes
+        return result
+
+
+cache = None
+
+def get_cache():
+    ''' created lazily so every forked process subscribes on its own socket '''
+    global cache
+    if cache is None or cache.pid != os.getpid():
+        cache = AddressCache(config.config['host_electrumx'],
+                             config.config['port_electrumx'],
+                             config.config['electrumx_timeout'],
+                             config.config['electrumx_recv_buffer_size'],
+                             config.config['address_cache_max_subscriptions'],
+                             config.config['address_cache_memory_bytes'],
+                             config.config['electrumx_ping_interval'])
+    return cache
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import json
+from .log import logger
+from . import rpc_call
+from . import utility
+from . import history_index
+from . import tip_tracker
+
+
+def encode_token(history, mempool_txid):
+    return history_index.encode_opaque({'key': history.key, 'height': history.tip_height, 'hash': history.tip_hash, 'mempool': mempool_txid})
+
+
+def decode_token(token, history):
+    ''' (height, block hash, mempool txid list) of a token made for this address set, None otherwise '''
+    data = history_index.decode_opaque(token)
+    try:
+        if data['key'] != history.key:
+            return None
+        return int(data['height']), data['hash'], list(data['mempool'])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def is_block_hash(height, block_hash):
+    ''' is block_hash still the block at height, false after a reorg '''
+    tip_height, tip_hash = rpc_call.get_tip()
+    if height > tip_height:
+        # another worker may have seen a newer tip
+        tip_height, tip_hash = rpc_call.get_tip(0)
+    if height == tip_height:
+        return block_hash == tip_hash
+    if height > tip_height:
+        return False
+    one_response = rpc_call.get_block_header(height)
+    if 'error' in one_response:
+        logger.error("is_block_hash get_block_header error, " + json.dumps(one_response))
+        return False
+    return block_hash == tip_tracker.get_header_hash(one_response['result'])
+
+
+def get_history_entry(one_transaction):
+    return {'txid': one_transaction['tx_hash'], 'height': one_transaction['height']}
+
+
+def get_unspent_list(address_list, address_dict, txid_set=None):
+    ''' unspents of address_list, only those created by txid_set when given; None when some address failed '''
+    result = []
+    for one_response in rpc_call.get_address_unspent_batch(address_list):
+        if 'error' in one_response:
+            logger.error("get_unspent_list one response has error, " + json.dumps(one_response))
+            return None
+        for one_unspent in one_response['result']:
+            if txid_set is not None and one_unspent['tx_hash'] not in txid_set:
+                continue
+            result.append({'address': address_dict[address_list[one_response['id']]], 'txid': one_unspent['tx_hash'],
+                           'vout_index': one_unspent['tx_pos'], 'value': one_unspent['value'], 'height': one_unspent['height']})
+    return result
+
+
+def get_full_sync(history, address_list, address_dict):
+    unspent = get_unspent_list(address_list, address_dict)
+    if unspent is None:
+        return None
+    all_history = history.get_since(0)
+    mempool_txid = [one_transaction['tx_hash'] for one_transaction in all_history if one_transaction['height'] <= 0]
+    return {
+        'full': True,
+        'token': encode_token(history, mempool_txid),
+        'history': [get_history_entry(one_transaction) for one_transaction in all_history],
+        'unspents': {'added': unspent, 'removed': []}
+    }
+
+
+def get_sync(address_list, address_dict, token):
+    ''' history and unspent changes of an address set since token, None when electrumx failed.
+        without a usable token, after a reorg below the token height or when a mempool transaction of the token
+        vanished unconfirmed, everything is sent again with full set; otherwise history holds transactions that are
+        new or got confirmed since, and unspents the outputs they created and the outputs they spent '''
+    history = history_index.get_index().get(address_list)
+    if not history.complete:
+        return None
+
+    one_token = None
+    if token:
+        one_token = decode_token(token, history)
+    if one_token is None:
+        return get_full_sync(history, address_list, address_dict)
+    height, block_hash, old_mempool_txid = one_token
+    if not is_block_hash(height, block_hash):
+        logger.info("get_sync reorg below height " + str(height) + ", full sync")
+        return get_full_sync(history, address_list, address_dict)
+
+    new_history = history.get_since(height)
+    new_txid = set([one_transaction['tx_hash'] for one_transaction in new_history])
+    if height > history.tip_height or 0 != len(set(old_mempool_txid) - new_txid):
+        # the token may come from a worker with a fresher history than the cached one
+        history = history_index.get_index().get(address_list, 0)
+        if not history.complete:
+            return None
+        new_history = history.get_since(height)
+        new_txid = set([one_transaction['tx_hash'] for one_transaction in new_history])
+    old_mempool_txid = set(old_mempool_txid)
+    if 0 != len(old_mempool_txid - new_txid):
+        logger.info("get_sync mempool transaction dropped, full sync")
+        return get_full_sync(history, address_list, address_dict)
+
+    mempool_txid = [one_transaction['tx_hash'] for one_transaction in new_history if one_transaction['height'] <= 0]
+    # what the token already holds and is still unconfirmed is no change
+    new_history = [one_transaction for one_transaction in new_history
+                   if one_transaction['height'] > 0 or one_transaction['tx_hash'] not in old_mempool_txid]
+    new_txid = set([one_transaction['tx_hash'] for one_transaction in new_history])
+    result = {
+        'full': False,
+        'token': encode_token(history, mempool_txid),
+        'history': [get_history_entry(one_transaction) for one_transaction in new_history],
+        'unspents': {'added': [], 'removed': []}
+    }
+    if 0 == len(new_history):
+        return result
+
+    # only addresses touched by the new transactions can have different unspents
+    changed_address_list = []
+    for scripthash, one_history in history.scripthash_history.items():
+        for one_transaction in reversed(one_history):
+            if 0 < one_transaction['height'] <= height:
+                break
+            if one_transaction['tx_hash'] in new_txid:
+                changed_address_list.append(scripthash)
+                break
+    added = get_unspent_list(changed_address_list, address_dict, new_txid)
+    if added is None:
+        return None
+
+    removed = []
+    address_set = set(address_dict.values())
+    # the inputs of a token mempool transaction that got confirmed were reported as removed already
+    for one_response in utility.decode_transaction_batch(list(new_txid - old_mempool_txid)):
+        if 'error' in one_response:
+            logger.error("get_sync decode error, " + json.dumps(one_response))
+            return None
+        for one_input in one_response['result']['inputs']:
+            if one_input['from_address'] in address_set:
+                removed.append({'address': one_input['from_address'], 'txid': one_input['from_txid'], 'vout_index': one_input['vin_index']})
+    result['unspents'] = {'added': added, 'removed': removed}
+    return result
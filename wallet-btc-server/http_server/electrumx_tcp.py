@@ -1,30 +1,260 @@
 #!/usr/bin/env python3
 import socket
-import time
+import json
+import os
+import itertools
+import gevent
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+from .log import logger
 from . import error_info
 from . import config
 
-def tcp_call(request_json):
-    try:
-        send_info = request_json + "\n"
-        electrumx_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)	
-        electrumx_socket.connect((config.config['host_electrumx'], config.config['port_electrumx']))
-        electrumx_socket.sendall(send_info.encode())
-    except socket.error:
-        return {'error': {'code': error_info.SOCKET_ERROR, 'message': error_info.error_message[error_info.SOCKET_ERROR]}}
-    recv_data = ''
-    page_data = ''
-    while True:
+
+def socket_error_response():
+    return {'error': {'code': error_info.SOCKET_ERROR, 'message': error_info.error_message[error_info.SOCKET_ERROR]}}
+
+
+class FrameReader:
+    ''' newline framed reader, bytes collect in one bytearray and a frame is only cut out once it is complete '''
+
+    def __init__(self, electrumx_socket, recv_buffer_size):
+        self.electrumx_socket = electrumx_socket
+        self.recv_buffer = memoryview(bytearray(recv_buffer_size))
+        self.frame_buffer = bytearray()
+        self.scanned = 0
+
+    def read_frames(self):
+        ''' block until at least one frame is complete, return the complete frames or [] on eof '''
+        # only the bytes received since the last call are scanned for the separator
+        position = self.frame_buffer.find(b"\n", self.scanned)
+        while -1 == position:
+            self.scanned = len(self.frame_buffer)
+            size = self.electrumx_socket.recv_into(self.recv_buffer)
+            if 0 == size:
+                return []
+            self.frame_buffer += self.recv_buffer[:size]
+            position = self.frame_buffer.find(b"\n", self.scanned)
+
+        # the usual case is exactly one frame filling the buffer, hand it over without a copy
+        if position == len(self.frame_buffer) - 1:
+            one_frame = self.frame_buffer
+            del one_frame[-1:]
+            self.frame_buffer = bytearray()
+            self.scanned = 0
+            return [one_frame]
+
+        frames = []
+        start = 0
+        with memoryview(self.frame_buffer) as frame_view:
+            while -1 != position:
+                frames.append(frame_view[start:position].tobytes())
+                start = position + 1
+                position = self.frame_buffer.find(b"\n", start)
+        del self.frame_buffer[:start]
+        self.scanned = len(self.frame_buffer)
+        return frames
+
+
+class ElectrumxConnection:
+    ''' one long-lived electrumx socket, many json rpc requests in flight, responses matched by id '''
+
+    def __init__(self, host, port, timeout, recv_buffer_size, notification_handler=None, close_handler=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.recv_buffer_size = recv_buffer_size
+        # subscriptions live on one socket: notification_handler(method, params) gets what the server pushes,
+        # close_handler() is told when the socket and its subscriptions are gone
+        self.notification_handler = notification_handler
+        self.close_handler = close_handler
+        self.electrumx_socket = None
+        self.pending = {}
+        self.wire_id = itertools.count(1)
+        self.send_lock = Semaphore()
+        self.connect_lock = Semaphore()
+
+    def is_connected(self):
+        return self.electrumx_socket is not None
+
+    def connect(self):
+        with self.connect_lock:
+            if self.electrumx_socket is not None:
+                return
+            electrumx_socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            electrumx_socket.settimeout(None)
+            electrumx_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.electrumx_socket = electrumx_socket
+            gevent.spawn(self.read_loop, electrumx_socket)
+
+    def close(self, electrumx_socket):
+        ''' drop the socket and fail every request still waiting on it '''
+        if electrumx_socket is not self.electrumx_socket:
+            return
+        self.electrumx_socket = None
         try:
-            page_data = electrumx_socket.recv(1024).decode()
-            recv_data += page_data
-            if page_data.find("\n")!=-1:
-                break
-        except:
-            return {'error': {'code': error_info.SOCKET_ERROR, 'message': error_info.error_message[error_info.SOCKET_ERROR]}}
-    electrumx_socket.close()
-    all_recv = recv_data.split("\n", 1)
-    return all_recv[0]
+            electrumx_socket.close()
+        except socket.error:
+            pass
+
+        pending = self.pending
+        self.pending = {}
+        for one_result in pending.values():
+            one_result.set(None)
+        if self.close_handler is not None:
+            self.close_handler()
+
+    def read_loop(self, electrumx_socket):
+        reader = FrameReader(electrumx_socket, self.recv_buffer_size)
+        while True:
+            try:
+                frames = reader.read_frames()
+            except socket.error:
+                frames = []
+            if 0 == len(frames):
+                logger.error("electrumx connection closed by " + self.host + ":" + str(self.port))
+                self.close(electrumx_socket)
+                return
+
+            for one_frame in frames:
+                self.dispatch(one_frame)
+
+    def dispatch(self, frame):
+        if 0 == len(frame):
+            return
+        try:
+            one_response = json.loads(frame)
+        except ValueError:
+            logger.error("electrumx connection receive invalid json")
+            return
+
+        # a notification has a method and no id
+        if isinstance(one_response, dict) and 'method' in one_response and one_response.get('id') is None:
+            if self.notification_handler is not None:
+                self.notification_handler(one_response['method'], one_response.get('params', []))
+            return
+
+        # batch response, any member id identifies the batch
+        members = one_response if isinstance(one_response, list) else [one_response]
+        for one_member in members:
+            if not isinstance(one_member, dict):
+                continue
+            one_result = self.pending.pop(one_member.get('id'), None)
+            if one_result is not None:
+                one_result.set(one_response)
+                return
+
+    def call(self, one_request):
+        ''' send one request or batch, rewrite ids to be unique on this socket and restore them on the response '''
+        if isinstance(one_request, list) and 0 == len(one_request):
+            return []
+
+        id_map = {}
+        if isinstance(one_request, list):
+            wire_request = []
+            for one_member in one_request:
+                one_wire_id = next(self.wire_id)
+                id_map[one_wire_id] = one_member.get('id')
+                wire_request.append(dict(one_member, id=one_wire_id))
+        else:
+            one_wire_id = next(self.wire_id)
+            id_map[one_wire_id] = one_request.get('id')
+            wire_request = dict(one_request, id=one_wire_id)
+
+        electrumx_socket = self.electrumx_socket
+        if electrumx_socket is None:
+            return None
+        one_result = AsyncResult()
+        key = next(iter(id_map))
+        self.pending[key] = one_result
+        try:
+            with self.send_lock:
+                electrumx_socket.sendall(json.dumps(wire_request, ensure_ascii=False).encode() + b"\n")
+        except socket.error:
+            self.pending.pop(key, None)
+            self.close(electrumx_socket)
+            return None
+
+        try:
+            one_response = one_result.get(timeout=self.timeout)
+        except gevent.Timeout:
+            self.pending.pop(key, None)
+            logger.error("electrumx request timeout: " + str(wire_request)[:200])
+            return socket_error_response()
+        if one_response is None:
+            return None
+
+        members = one_response if isinstance(one_response, list) else [one_response]
+        for one_member in members:
+            if isinstance(one_member, dict) and one_member.get('id') in id_map:
+                one_member['id'] = id_map[one_member['id']]
+        return one_response
+
+
+class ElectrumxPool:
+    ''' fixed number of persistent connections, requests spread round robin '''
+
+    def __init__(self, host, port, size, timeout, ping_interval, recv_buffer_size):
+        self.pid = os.getpid()
+        self.connections = [ElectrumxConnection(host, port, timeout, recv_buffer_size) for _ in range(max(1, size))]
+        self.next_index = itertools.count()
+        self.ping_interval = ping_interval
+        if ping_interval > 0:
+            gevent.spawn(self.health_check_loop)
+
+    def get_connection(self):
+        return self.connections[next(self.next_index) % len(self.connections)]
+
+    def call(self, one_request):
+        connection = self.get_connection()
+        # a second try covers a socket the server closed while idle
+        for _ in range(2):
+            try:
+                connection.connect()
+            except socket.error:
+                logger.error("electrumx connect failed " + connection.host + ":" + str(connection.port))
+                return socket_error_response()
+            one_response = connection.call(one_request)
+            if one_response is not None:
+                return one_response
+        return socket_error_response()
+
+    def health_check_loop(self):
+        while True:
+            gevent.sleep(self.ping_interval)
+            for connection in self.connections:
+                if not connection.is_connected():
+                    continue
+                one_response = connection.call({"jsonrpc": "2.0", "method": "server.ping", "params": [], "id": 0})
+                if one_response is None or 'error' in one_response:
+                    logger.error("electrumx health check failed, reconnect " + connection.host + ":" + str(connection.port))
+                    electrumx_socket = connection.electrumx_socket
+                    if electrumx_socket is not None:
+                        connection.close(electrumx_socket)
+
+
+pool = None
+
+def get_pool():
+    ''' the pool is created lazily so every forked process owns its own sockets '''
+    global pool
+    if pool is None or pool.pid != os.getpid():
+        pool = ElectrumxPool(config.config['host_electrumx'],
+                             config.config['port_electrumx'],
+                             config.config['electrumx_pool_size'],
+                             config.config['electrumx_timeout'],
+                             config.config['electrumx_ping_interval'],
+                             config.config['electrumx_recv_buffer_size'])
+    return pool
+
+
+def request(one_request):
+    ''' send a json rpc request (dict) or batch (list) and return the decoded response '''
+    return get_pool().call(one_request)
+
+
+def tcp_call(request_json):
+    return json.dumps(request(json.loads(request_json)), ensure_ascii=False)
 
 
 # class json rpc request object
@@ -50,4 +280,4 @@ class jsonRpcResponse:
         self.jsonrpc = "2.0"
         self.result = {}
         self.error = jsonRpcErrpr()
-        self.id = 1
\ No newline at end of file
+        self.id = 1
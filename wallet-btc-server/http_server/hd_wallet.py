@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import hmac
+import hashlib
+import gevent
+from hashlib import sha256
+from collections import OrderedDict
+from . import address
+from . import config
+
+
+# secp256k1
+FIELD_PRIME = 0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffefffffc2f
+CURVE_ORDER = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+GENERATOR = (0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
+             0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8)
+
+# extended public key version -> script type of its addresses
+XPUB_VERSION = {
+    bytes.fromhex('0488b21e'): 'pkh',
+    bytes.fromhex('049d7cb2'): 'sh-wpkh',
+    bytes.fromhex('04b24746'): 'wpkh',
+}
+DESCRIPTOR_TYPE = {'pkh': 'pkh', 'wpkh': 'wpkh', 'sh(wpkh': 'sh-wpkh', 'tr': 'tr'}
+
+# bip380 descriptor checksum
+DESCRIPTOR_INPUT_CHARSET = "0123456789()[],'/*abcdefgh@:$%{}IJKLMNOPQRSTUVWXYZ&+-.;<=>?!^_|~ijklmnopqrstuvwxyzABCDEFGH`#\"\\ "
+DESCRIPTOR_CHECKSUM_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+DESCRIPTOR_GENERATOR = [0xf5dee51989, 0xa9fdca3312, 0x1bab10e32d, 0x3706b1677a, 0x644d626ffd]
+
+
+def point_double(point):
+    ''' jacobian coordinates, None is the point at infinity '''
+    if point is None:
+        return None
+    x, y, z = point
+    if 0 == y:
+        return None
+    y_square = y * y % FIELD_PRIME
+    s = 4 * x * y_square % FIELD_PRIME
+    m = 3 * x * x % FIELD_PRIME
+    new_x = (m * m - 2 * s) % FIELD_PRIME
+    return new_x, (m * (s - new_x) - 8 * y_square * y_square) % FIELD_PRIME, 2 * y * z % FIELD_PRIME
+
+
+def point_add(point, affine):
+    ''' jacobian point plus affine point '''
+    if point is None:
+        return (affine[0], affine[1], 1)
+    x, y, z = point
+    z_square = z * z % FIELD_PRIME
+    u = affine[0] * z_square % FIELD_PRIME
+    s = affine[1] * z_square * z % FIELD_PRIME
+    if u == x:
+        if s != y:
+            return None
+        return point_double(point)
+    h = (u - x) % FIELD_PRIME
+    r = (s - y) % FIELD_PRIME
+    h_square = h * h % FIELD_PRIME
+    h_cube = h_square * h % FIELD_PRIME
+    new_x = (r * r - h_cube - 2 * x * h_square) % FIELD_PRIME
+    return new_x, (r * (x * h_square - new_x) - y * h_cube) % FIELD_PRIME, h * z % FIELD_PRIME
+
+
+def to_affine(point):
+    x, y, z = point
+    z_inverse = pow(z, FIELD_PRIME - 2, FIELD_PRIME)
+    z_inverse_square = z_inverse * z_inverse % FIELD_PRIME
+    return x * z_inverse_square % FIELD_PRIME, y * z_inverse_square * z_inverse % FIELD_PRIME
+
+
+generator_table = []
+
+def get_generator_table():
+    ''' 2^i * G for every bit, so a multiple of G is only additions '''
+    if 0 == len(generator_table):
+        point = (GENERATOR[0], GENERATOR[1], 1)
+        for _ in range(256):
+            generator_table.append(to_affine(point))
+            point = point_double(point)
+    return generator_table
+
+
+def generator_multiply(scalar):
+    result = None
+    for one_point in get_generator_table():
+        if 0 == scalar:
+            break
+        if scalar & 1:
+            result = point_add(result, one_point)
+        scalar >>= 1
+    return result
+
+
+def compress(point):
+    return bytes([2 + (point[1] & 1)]) + point[0].to_bytes(32, 'big')
+
+
+def decompress(data):
+    if 33 != len(data) or data[0] not in (2, 3):
+        raise ValueError("invalid public key")
+    x = int.from_bytes(data[1:], 'big')
+    y_square = (pow(x, 3, FIELD_PRIME) + 7) % FIELD_PRIME
+    y = pow(y_square, (FIELD_PRIME + 1) // 4, FIELD_PRIME)
+    if y * y % FIELD_PRIME != y_square:
+        raise ValueError("invalid public key")
+    if (y & 1) != (data[0] & 1):
+        y = FIELD_PRIME - y
+    return x, y
+
+
+def tagged_hash(tag, data):
+    tag_hash = sha256(tag.encode()).digest()
+    return sha256(tag_hash + tag_hash + data).digest()
+
+
+class PublicNode:
+    ''' bip32 public key and chain code, only non hardened children can be derived '''
+    __slots__ = ('point', 'chain_code')
+
+    def __init__(self, point, chain_code):
+        self.point = point
+        self.chain_code = chain_code
+
+    def child(self, index):
+        if index >= 0x80000000:
+            raise ValueError("hardened derivation needs the private key")
+        digest = hmac.new(self.chain_code, compress(self.point) + index.to_bytes(4, 'big'), hashlib.sha512).digest()
+        tweak = int.from_bytes(digest[:32], 'big')
+        if tweak >= CURVE_ORDER:
+            raise ValueError("invalid child " + str(index))
+        child_point = point_add(generator_multiply(tweak), self.point)
+        if child_point is None:
+            raise ValueError("invalid child " + str(index))
+        return PublicNode(to_affine(child_point), digest[32:])
+
+
+def parse_xpub(text):
+    ''' -> (script type of the version, PublicNode) '''
+    data = address.base58check_data(text)
+    if data is None or 78 != len(data) or data[:4] not in XPUB_VERSION:
+        raise ValueError("invalid extended public key")
+    return XPUB_VERSION[data[:4]], PublicNode(decompress(data[45:78]), data[13:45])
+
+
+def script_from_public_key(script_type, point):
+    public_key = compress(point)
+    if 'pkh' == script_type:
+        return b'\x76\xa9\x14' + address.hash160(public_key) + b'\x88\xac'
+    if 'wpkh' == script_type:
+        return b'\x00\x14' + address.hash160(public_key)
+    if 'sh-wpkh' == script_type:
+        return b'\xa9\x14' + address.hash160(b'\x00\x14' + address.hash160(public_key)) + b'\x87'
+    # tr: bip86 key path only output, the internal key with an even y tweaked by its own x
+    if point[1] & 1:
+        point = (point[0], FIELD_PRIME - point[1])
+    tweak = int.from_bytes(tagged_hash("TapTweak", point[0].to_bytes(32, 'big')), 'big')
+    output_point = to_affine(point_add(generator_multiply(tweak), point))
+    return b'\x51\x20' + output_point[0].to_bytes(32, 'big')
+
+
+def parse_path(path):
+    if '' == path:
+        return []
+    result = []
+    for one_step in path.split('/'):
+        if not one_step.isdigit():
+            raise ValueError("only non hardened derivation steps are possible: " + one_step)
+        result.append(int(one_step))
+    return result
+
+
+def get_descriptor_checksum(text):
+    ''' the 8 characters after the # of a descriptor, None when text has a character no descriptor can have '''
+    symbols = []
+    groups = []
+    for one_char in text:
+        value = DESCRIPTOR_INPUT_CHARSET.find(one_char)
+        if value < 0:
+            return None
+        symbols.append(value & 31)
+        groups.append(value >> 5)
+        if 3 == len(groups):
+            symbols.append(groups[0] * 9 + groups[1] * 3 + groups[2])
+            groups = []
+    if 1 == len(groups):
+        symbols.append(groups[0])
+    elif 2 == len(groups):
+        symbols.append(groups[0] * 3 + groups[1])
+
+    checksum = 1
+    for value in symbols + [0] * 8:
+        top = checksum >> 35
+        checksum = (checksum & 0x7ffffffff) << 5 ^ value
+        for index in range(5):
+            if (top >> index) & 1:
+                checksum ^= DESCRIPTOR_GENERATOR[index]
+    checksum ^= 1
+    return ''.join([DESCRIPTOR_CHECKSUM_CHARSET[(checksum >> (5 * (7 - index))) & 31] for index in range(8)])
+
+
+def parse_descriptor(text):
+    ''' xpub, ypub, zpub or a pkh / wpkh / sh(wpkh) / tr descriptor over an xpub
+        -> (script type, xpub, [(chain name, path prefix list)]) '''
+    text = text.strip()
+    if '(' not in text:
+        script_type, _ = parse_xpub(text)
+        return script_type, text, [('0', [0]), ('1', [1])]
+
+    text, _, checksum = text.partition('#')
+    if checksum and checksum != get_descriptor_checksum(text):
+        raise ValueError("descriptor checksum mismatch")
+    match = re.match(r'^(pkh|wpkh|sh\(wpkh|tr)\((?:\[[0-9a-fA-F]{8}(?:/[0-9]+[hH\']?)*\])?([1-9A-HJ-NP-Za-km-z]+)((?:/[0-9]+)*)/(?:<([0-9]+);([0-9]+)>/)?\*\)\)?$', text)
+    if match is None or (match.group(1) == 'sh(wpkh') != text.endswith('))'):
+        raise ValueError("unsupported descriptor")
+    parse_xpub(match.group(2))
+    prefix = parse_path(match.group(3).lstrip('/'))
+    if match.group(4) is None:
+        chains = [('/'.join([str(one_step) for one_step in prefix]), prefix)]
+    else:
+        chains = []
+        for one_step in (int(match.group(4)), int(match.group(5))):
+            chains.append(('/'.join([str(step) for step in prefix + [one_step]]), prefix + [one_step]))
+    return DESCRIPTOR_TYPE[match.group(1)], match.group(2), chains
+
+
+class DerivedChain:
+    ''' addresses of one chain in derivation order, extended on demand '''
+
+    def __init__(self, script_type, node):
+        self.script_type = script_type
+        self.node = node
+        self.address = []
+        self.script_hash = []
+
+    def get_range(self, start, end):
+        ''' [(address, scripthash)] for indexes start..end-1; every address takes a millisecond or two of pure python,
+            so the worker yields after each one instead of stalling every other request '''
+        while len(self.address) < end:
+            script = script_from_public_key(self.script_type, self.node.child(len(self.address)).point)
+            self.address.append(address.script_to_address(script)[1][0])
+            self.script_hash.append(address.get_script_hash(script))
+            gevent.idle()
+        return list(zip(self.address[start:end], self.script_hash[start:end]))
+
+
+class DerivationCache:
+    ''' (script type, xpub, path) -> DerivedChain, pure python derivation costs a couple of milliseconds per address;
+        capped by chains and by derived addresses, the least recently used chain goes first '''
+
+    def __init__(self, max_chains, max_addresses):
+        self.pid = os.getpid()
+        self.max_chains = max_chains
+        self.max_addresses = max_addresses
+        self.entries = OrderedDict()
+        self.counter = {'hit': 0, 'miss': 0, 'eviction': 0}
+
+    def get(self, script_type, xpub, path):
+        key = (script_type, xpub, tuple(path))
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.counter['hit'] += 1
+            return self.entries[key]
+        self.counter['miss'] += 1
+        _, node = parse_xpub(xpub)
+        for one_step in path:
+            node = node.child(one_step)
+        one_chain = DerivedChain(script_type, node)
+        self.entries[key] = one_chain
+        self.evict()
+        return one_chain
+
+    def get_address_count(self):
+        return sum([len(one_chain.address) for one_chain in self.entries.values()])
+
+    def evict(self):
+        # chains grow after they are handed out, so the address count is checked whenever a chain is added
+        while len(self.entries) > 1 and (len(self.entries) > self.max_chains or self.get_address_count() > self.max_addresses):
+            self.entries.popitem(last=False)
+            self.counter['eviction'] += 1
+
+    def get_counter(self):
+        result = dict(self.counter)
+        result['entries'] = len(self.entries)
+        result['addresses'] = self.get_address_count()
+        return result
+
+
+cache = None
+
+def get_cache():
+    global cache
+    if cache is None or cache.pid != os.getpid():
+        cache = DerivationCache(config.config['hd_cache_max_chains'], config.config['hd_cache_max_addresses'])
+    return cache
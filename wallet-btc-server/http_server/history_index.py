@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import json
+import base64
+import heapq
+from hashlib import sha256
+from collections import OrderedDict
+from .log import logger
+from . import config
+from . import rpc_call
+from . import tip_tracker
+
+
+# mempool entries (height 0 or -1) come before every confirmed height
+MEMPOOL_ORDER = 1 << 62
+
+
+def get_sort_key(one_history):
+    height = one_history['height']
+    if height <= 0:
+        return -MEMPOOL_ORDER
+    return -height
+
+
+def get_key(scripthash_list):
+    return sha256(','.join(scripthash_list).encode()).hexdigest()[:32]
+
+
+def encode_opaque(data):
+    text = json.dumps(data, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(text).decode().rstrip('=')
+
+
+def decode_opaque(text):
+    ''' None if it is not one of ours '''
+    try:
+        data = json.loads(base64.urlsafe_b64decode(text + '=' * (-len(text) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    return data
+
+
+def encode_cursor(key, offset, txid):
+    return encode_opaque({'key': key, 'offset': offset, 'txid': txid})
+
+
+def decode_cursor(cursor):
+    ''' opaque cursor -> (key, offset, txid), None if it is not one of ours '''
+    data = decode_opaque(cursor)
+    try:
+        return data['key'], int(data['offset']), data['txid']
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+class History:
+    ''' merged history of one address set, newest first, materialized only as far as pages have asked for '''
+
+    def __init__(self, key):
+        self.key = key
+        self.update_time = 0
+        self.complete = False
+        self.tip_height = 0
+        self.tip_hash = ''
+        self.scripthash_history = {}
+        self.rebuild()
+
+    def rebuild(self):
+        # electrumx histories are ordered by height with the mempool last, read backwards they are newest first
+        self.merge = heapq.merge(*[reversed(one_history) for one_history in self.scripthash_history.values()], key=get_sort_key)
+        self.history = []
+        self.position = {}
+
+    def fill(self, length, txid=None):
+        ''' merge until length entries (or txid) are materialized; a transaction of several addresses is kept once '''
+        while len(self.history) < length or (txid is not None and txid not in self.position):
+            one_transaction = next(self.merge, None)
+            if one_transaction is None:
+                return
+            if one_transaction['tx_hash'] in self.position:
+                continue
+            self.position[one_transaction['tx_hash']] = len(self.history)
+            self.history.append(one_transaction)
+
+    def get_page(self, start, size):
+        ''' (entries of [start, start + size), whether more follow) '''
+        self.fill(start + size + 1)
+        return self.history[start:start + size], start + size < len(self.history)
+
+    def get_since(self, height):
+        ''' mempool entries and entries above height, they lead the newest first order '''
+        index = 0
+        while True:
+            self.fill(index + 1)
+            if index >= len(self.history) or 0 < self.history[index]['height'] <= height:
+                return self.history[:index]
+            index += 1
+
+    def get_offset(self, offset, txid):
+        ''' the entry after txid survives new transactions being prepended, the raw offset is the fallback '''
+        self.fill(offset, txid)
+        if txid in self.position:
+            return self.position[txid] + 1
+        return offset
+
+
+class HistoryIndex:
+    ''' address set -> History, refreshed at most once per ttl; a refresh only re-merges when some address changed '''
+
+    def __init__(self, ttl, max_entries):
+        self.pid = os.getpid()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counter = {'hit': 0, 'refresh': 0, 'rebuild': 0, 'eviction': 0}
+        tip_tracker.get_tracker().add_hook(self.on_new_block)
+
+    def on_new_block(self, height, block_hash):
+        # mempool entries move into the block, no history is fresh any more
+        for one_history in self.entries.values():
+            one_history.update_time = 0
+
+    def get(self, scripthash_list, max_age=None):
+        if max_age is None:
+            max_age = self.ttl
+        scripthash_list = sorted(set(scripthash_list))
+        key = get_key(scripthash_list)
+        one_history = self.entries.get(key)
+        if one_history is None:
+            one_history = History(key)
+            self.entries[key] = one_history
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counter['eviction'] += 1
+        self.entries.move_to_end(key)
+
+        if time.time() - one_history.update_time < max_age:
+            self.counter['hit'] += 1
+            return one_history
+        self.refresh(one_history, scripthash_list)
+        return one_history
+
+    def refresh(self, one_history, scripthash_list):
+        self.counter['refresh'] += 1
+        # taken before the fetch, so the history holds at least everything up to this tip
+        tip_height, tip_hash = rpc_call.get_tip()
+        changed = False
+        complete = True
+        for one_response in rpc_call.get_address_history_batch(scripthash_list):
+            if 'error' in one_response:
+                logger.error("history index refresh one response has error, " + json.dumps(one_response))
+                complete = False
+                continue
+            scripthash = scripthash_list[one_response['id']]
+            if one_history.scripthash_history.get(scripthash) != one_response['result']:
+                one_history.scripthash_history[scripthash] = one_response['result']
+                changed = True
+        if len(one_history.scripthash_history) != len(scripthash_list):
+            complete = False
+        if changed:
+            one_history.rebuild()
+            self.counter['rebuild'] += 1
+        # an incomplete history is served once and fetched again next time
+        one_history.complete = complete
+        one_history.update_time = time.time() if complete else 0
+        one_history.tip_height = tip_height
+        one_history.tip_hash = tip_hash
+
+    def get_counter(self):
+        result = dict(self.counter)
+        result['entries'] = len(self.entries)
+        return result
+
+
+index = None
+
+def get_index():
+    global index
+    if index is None or index.pid != os.getpid():
+        index = HistoryIndex(config.config['history_index_ttl'], config.config['history_index_max_entries'])
+    return index
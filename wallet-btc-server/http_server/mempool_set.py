@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import os
+from .log import logger
+
+
+class MempoolSet:
+    ''' mempool txids as 32 byte keys, far smaller than the hex strings; snapshotted to disk so that
+        after a restart only transactions that really arrived meanwhile count as new '''
+
+    def __init__(self, snapshot_file):
+        self.snapshot_file = snapshot_file
+        self.txids = set()
+        # keys added one by one since the running poll asked for the mempool, its answer may predate them
+        self.arrived = set()
+        self.dirty = False
+        self.load()
+
+    def __len__(self):
+        return len(self.txids)
+
+    def load(self):
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return
+        try:
+            with open(self.snapshot_file, 'rb') as snapshot:
+                data = snapshot.read()
+        except OSError as e:
+            logger.error("mempool snapshot read " + self.snapshot_file + " failed: " + str(e))
+            return
+        self.txids = set([data[index:index + 32] for index in range(0, len(data) - len(data) % 32, 32)])
+        logger.info("mempool snapshot loaded, transactions: " + str(len(self.txids)))
+
+    def save(self):
+        ''' the whole set, 32 bytes per txid, replaced atomically '''
+        if not self.snapshot_file or not self.dirty:
+            return
+        temp_file = self.snapshot_file + '.tmp'
+        try:
+            with open(temp_file, 'wb') as snapshot:
+                snapshot.write(b''.join(self.txids))
+            os.replace(temp_file, self.snapshot_file)
+        except OSError as e:
+            logger.error("mempool snapshot write " + self.snapshot_file + " failed: " + str(e))
+            return
+        self.dirty = False
+
+    def begin(self):
+        ''' called before asking for the whole mempool '''
+        self.arrived = set()
+
+    def diff(self, txid_list):
+        ''' hex txids of the whole mempool -> (its set, hex txids not seen before); nothing changes until update '''
+        new_txids = set([bytes.fromhex(txid) for txid in txid_list])
+        return new_txids, [txid.hex() for txid in new_txids - self.txids]
+
+    def update(self, new_txids):
+        new_txids |= self.arrived
+        if new_txids != self.txids:
+            self.txids = new_txids
+            self.dirty = True
+
+    def add(self, txid):
+        ''' one arriving transaction, true when it is new '''
+        key = bytes.fromhex(txid)
+        if key in self.txids:
+            return False
+        self.txids.add(key)
+        self.arrived.add(key)
+        self.dirty = True
+        return True
@@ -3,24 +3,47 @@
 import gevent
 from gevent import monkey
 monkey.patch_all()
+from gevent.queue import Queue, Empty
+from gevent.lock import Semaphore
+from gevent.pool import Pool
+from collections import OrderedDict
+import time
 import requests
 from datetime import datetime
 from apscheduler.schedulers.blocking import BlockingScheduler
 import json
 from . import config
 from . import utility
+from . import watch_list
+from . import mempool_set
+from . import zmq_listener
+from . import raw_transaction
 from .log import logger
 
-all_unconfirmed_transaction = []
+all_unconfirmed_transaction = mempool_set.MempoolSet(config.config['mempool_snapshot_file'])
+notify_watch_list = watch_list.WatchList()
+notify_address_state = {'etag': '', 'last_modified': '', 'loaded': False}
+# rawtx and sequence messages pushed by bitcoind over zmq, in the order they were published
+arrived_zmq_message = Queue()
+# transactions announced by rawtx whose mempool acceptance has not been announced yet
+pending_raw_transaction = OrderedDict()
+poll_lock = Semaphore()
 
 def get_notify_address():
-    '''get address from notify hub'''
+    '''get address from notify hub, the list is None when the hub reports no change since the last download'''
 
     try:
-        # requset 
+        # requset, conditional on what was downloaded last time
         url = config.config['notify_server_address'] + "/v1/cids"
         payload={"chain_type":"BTC", "chain_id":"mainnet"}
-        response = requests.get(url, params=payload)
+        headers = {}
+        if notify_address_state['etag']:
+            headers['If-None-Match'] = notify_address_state['etag']
+        if notify_address_state['last_modified']:
+            headers['If-Modified-Since'] = notify_address_state['last_modified']
+        response = requests.get(url, params=payload, headers=headers)
+        if 304 == response.status_code:
+            return True, None
         if 200 != response.status_code:
             logger.error("get_notify_address response status is not 200, code: " + str(response.status_code))
             return False, []
@@ -34,13 +57,28 @@ def get_notify_address():
         logger.error("get_notify_address has an exception")
         return False, []
 
-
+    notify_address_state['etag'] = response.headers.get('ETag', '')
+    notify_address_state['last_modified'] = response.headers.get('Last-Modified', '')
     return True, result["data"]["addresses"]
 
 
+def refresh_notify_address():
+    ''' keep the local watch list in step with the notify hub, on its own schedule '''
+    isOk, notify_address = get_notify_address()
+    if not isOk:
+        return False
+    if notify_address is not None:
+        notify_watch_list.rebuild(notify_address)
+        logger.info("refresh_notify_address addresses: " + str(len(notify_watch_list)))
+    notify_address_state['loaded'] = True
+    return True
+
+
 def get_unconfirmed_transaction_and_notify():
     ''' get different unconfirmed transaction and push info to notify hub'''
 
+    # transactions arriving over zmq meanwhile are not in the answer, they are kept
+    all_unconfirmed_transaction.begin()
     try:
         # get all unconfirmed transaction
         payload = {"jsonrpc": "2.0", "method": "getrawmempool", "params": {}, "id": 1}
@@ -59,65 +97,81 @@ def get_unconfirmed_transaction_and_notify():
         logger.error("get_unconfirmed_transaction_and_notify has an exception")
         return
 
-    new_unconfirmed_transaction = one_response['result']
-    global all_unconfirmed_transaction
-    diff_unconfirmed_transaction = list(set(new_unconfirmed_transaction).difference(set(all_unconfirmed_transaction)))
+    arrival_time = time.time()
+    new_unconfirmed_transaction, diff_unconfirmed_transaction = all_unconfirmed_transaction.diff(one_response['result'])
 
-     # get notify address
-    isOk, notify_address = get_notify_address()
-    if not isOk:
-        return 
-    
-    # set new transactions
-    all_unconfirmed_transaction = new_unconfirmed_transaction
     if 0 == len(diff_unconfirmed_transaction):
+        all_unconfirmed_transaction.update(new_unconfirmed_transaction)
+        return
+
+    # the watch list is refreshed by its own job, only the very first one is waited for here
+    if not notify_address_state['loaded'] and not refresh_notify_address():
         return
 
-    if 0 == len(notify_address):
+    # set new transactions
+    all_unconfirmed_transaction.update(new_unconfirmed_transaction)
+    if 0 == len(notify_watch_list):
         return
 
     # new task
-    gevent.spawn(notify_new_unconfirmed_transaction, diff_unconfirmed_transaction, notify_address)
+    gevent.spawn(notify_new_unconfirmed_transaction, diff_unconfirmed_transaction, notify_watch_list, arrival_time)
 
 
-def notify_new_unconfirmed_transaction(diff_unconfirmed_transaction, notify_address):
-    # get transaction info
-    unconfirmed_transaction_info = []
-    for one_diff_txid in diff_unconfirmed_transaction:
-        isTrue, one_deff_transaction_info = utility.get_transaction_by_txid(one_diff_txid)
-        if isTrue:
-            unconfirmed_transaction_info.append(one_deff_transaction_info)
+def reconcile_unconfirmed_transaction():
+    ''' polls are asked for by the schedule, by new blocks and by zmq gaps; one at a time is enough '''
+    if poll_lock.locked():
+        return
+    with poll_lock:
+        get_unconfirmed_transaction_and_notify()
 
-    # notify
+
+def get_push_info(one_address, msg_type, msg_id):
+    return {'chain_type':one_address['chain_type'],
+            'chain_id': one_address['chain_id'],
+            'msg_type':msg_type,
+            'cid': one_address['cid'],
+            'msg_id': msg_id,
+            'language': one_address['language'],
+            'token_name': 'BTC',
+            'name': one_address['name'],
+            'platform': one_address['platform']}
+
+
+def get_push_list(unconfirmed_transaction_info, notify_watch_list):
     push_list = []
     for one_transaction in unconfirmed_transaction_info:
         # inputs
         for one_input in one_transaction['inputs']:
-            for one_address in notify_address:
-                if one_address['name'] == one_input['from_address']:
-                    push_list.append({'chain_type':one_address['chain_type'],
-                    'chain_id': one_address['chain_id'],
-                    'msg_type':2,
-                    'cid': one_address['cid'],
-                    'msg_id': str(2)+one_input['from_txid']+str(one_input['vin_index']),
-                    'language': one_address['language'],
-                    'token_name': 'BTC',
-                    'name': one_address['name'],
-                    'platform': one_address['platform']})
+            for one_address in notify_watch_list.get(one_input['from_address']):
+                push_list.append(get_push_info(one_address, 2, str(2)+one_input['from_txid']+str(one_input['vin_index'])))
 
         # outputs
         for one_output in one_transaction['outputs']:
-            for one_address in notify_address:
-                if one_address['name'] == one_output['to_address']:
-                    push_list.append({'chain_type':one_address['chain_type'],
-                    'chain_id': one_address['chain_id'],
-                    'msg_type':1,
-                    'cid': one_address['cid'],
-                    'msg_id': str(1)+one_transaction['txid']+str(one_output['vout_index']),
-                    'language': one_address['language'],
-                    'token_name': 'BTC',
-                    'name': one_address['name'],
-                    'platform': one_address['platform']})
+            for one_address in notify_watch_list.get(one_output['to_address']):
+                push_list.append(get_push_info(one_address, 1, str(1)+one_transaction['txid']+str(one_output['vout_index'])))
+    return push_list
+
+
+def decode_unconfirmed_transaction(txid_batch):
+    unconfirmed_transaction_info = []
+    for one_response in utility.decode_transaction_batch(txid_batch):
+        if 'result' in one_response:
+            unconfirmed_transaction_info.append(one_response['result'])
+    return unconfirmed_transaction_info
+
+
+def notify_new_unconfirmed_transaction(diff_unconfirmed_transaction, notify_watch_list, arrival_time):
+    ''' a burst is decoded in notify_decode_batch_size chunks, notify_decode_parallel at a time, each pushed when it is done;
+        previous transactions shared across chunks are fetched once, by the prevout index and single flight '''
+    chunk_size = config.config['notify_decode_batch_size']
+    chunks = [diff_unconfirmed_transaction[index:index + chunk_size] for index in range(0, len(diff_unconfirmed_transaction), chunk_size)]
+    for unconfirmed_transaction_info in Pool(config.config['notify_decode_parallel']).imap_unordered(decode_unconfirmed_transaction, chunks):
+        push_unconfirmed_transaction_info(unconfirmed_transaction_info, notify_watch_list, arrival_time)
+
+
+def push_unconfirmed_transaction_info(unconfirmed_transaction_info, notify_watch_list, arrival_time):
+    # notify
+    push_list = get_push_list(unconfirmed_transaction_info, notify_watch_list)
 
     # send notify
     if 0 == len(push_list):
@@ -125,23 +179,103 @@ def notify_new_unconfirmed_transaction(diff_unconfirmed_transaction, notify_addr
 
     url = config.config['notify_server_address'] + "/v1/push"
     payload = {'push_list': push_list}
-    response = requests.post(url, data=json.dumps(payload))
-    if 200 != response.status_code:
-        logger.error("notify info: " + json.dumps(push_list))
-        logger.error("notify_new_unconfirmed_transaction push info response status is not 200, code: " + str(response.status_code))
+    try:
+        response = requests.post(url, data=json.dumps(payload))
+        if 200 != response.status_code:
+            logger.error("notify info: " + json.dumps(push_list))
+            logger.error("notify_new_unconfirmed_transaction push info response status is not 200, code: " + str(response.status_code))
+            return
 
-    # result info
-    result = response.json()
+        # result info
+        result = response.json()
+    except:
+        logger.error("notify info: " + json.dumps(push_list))
+        logger.error("notify_new_unconfirmed_transaction push info has an exception")
+        return
     if 0 != result['errno']:
         logger.error("notify info: " + json.dumps(push_list))
         logger.error("notify_new_unconfirmed_transaction push info error, error number: " + str(result['errno']) + " , error message: " + result['errmsg'])
     logger.info("notify info: " + json.dumps(push_list))
-    logger.info("get_unconfirmed_transaction_and_notify success!!!")
+    logger.info("get_unconfirmed_transaction_and_notify success!!! transactions: " + str(len(unconfirmed_transaction_info))
+                + ", pushes: " + str(len(push_list)) + ", " + str(int((time.time() - arrival_time) * 1000)) + " ms after arrival")
+
+
+def on_zmq_message(topic, body):
+    arrived_zmq_message.put((topic, body))
+
+
+def push_arrived_transaction(transaction_batch, arrival_time):
+    if 0 == len(transaction_batch) or 0 == len(notify_watch_list):
+        return
+    try:
+        unconfirmed_transaction_info = utility.get_transaction_info_batch(transaction_batch)
+        push_unconfirmed_transaction_info(unconfirmed_transaction_info, notify_watch_list, arrival_time)
+    except Exception as e:
+        logger.error("notify_arrived_transaction failed: " + str(e))
+
+
+def notify_arrived_transaction():
+    ''' decode what bitcoind pushed over zmq locally and match it right away; a burst is taken as one batch.
+        rawtx also announces every transaction of a connected block, so a transaction is only news once the sequence
+        topic reports its mempool acceptance; a block is reconciled in line, after everything published before it '''
+    while True:
+        message_batch = [arrived_zmq_message.get()]
+        arrival_time = time.time()
+        try:
+            while True:
+                message_batch.append(arrived_zmq_message.get_nowait())
+        except Empty:
+            pass
+
+        # without a watch list nothing is marked as seen, the next poll picks these up
+        if not notify_address_state['loaded'] and not refresh_notify_address():
+            continue
+
+        transaction_batch = []
+        for topic, body in message_batch:
+            if 'rawtx' == topic:
+                try:
+                    one_transaction = raw_transaction.deserialize(body.hex())
+                except (ValueError, IndexError) as e:
+                    logger.error("notify_arrived_transaction deserialize failed: " + str(e))
+                    continue
+                pending_raw_transaction[one_transaction['txid']] = one_transaction
+                # an acceptance directly follows its rawtx, whatever waits longer belongs to a block
+                while len(pending_raw_transaction) > config.config['zmq_pending_max_transactions']:
+                    pending_raw_transaction.popitem(last=False)
+                continue
+            # sequence: a 32 byte hash, a label, and for A and R the mempool sequence number
+            label = body[32:33]
+            if b'A' == label:
+                one_transaction = pending_raw_transaction.pop(body[:32].hex(), None)
+                if one_transaction is not None and all_unconfirmed_transaction.add(one_transaction['txid']):
+                    transaction_batch.append(one_transaction)
+            elif label in (b'C', b'D'):
+                # the rawtx still pending were published for this block, they never were unconfirmed
+                pending_raw_transaction.clear()
+                gevent.spawn(reconcile_unconfirmed_transaction)
+        push_arrived_transaction(transaction_batch, arrival_time)
+
+
+def start_zmq():
+    ''' event driven ingestion when bitcoind publishes over zmq, polling then only reconciles '''
+    if not config.config['zmq_address']:
+        return False
+    handlers = {'rawtx': on_zmq_message, 'sequence': on_zmq_message}
+    if zmq_listener.start(config.config['zmq_address'], handlers, reconcile_unconfirmed_transaction) is None:
+        return False
+    gevent.spawn(notify_arrived_transaction)
+    return True
 
 
 def timer_task():
     ''' all time task '''
 
+    interval = config.config['unconfirmed_transaction_interval']
+    if start_zmq():
+        interval = config.config['zmq_reconcile_interval']
     scheduler = BlockingScheduler()
-    scheduler.add_job(get_unconfirmed_transaction_and_notify, 'interval', seconds=config.config['unconfirmed_transaction_interval'])
+    scheduler.add_job(reconcile_unconfirmed_transaction, 'interval', seconds=interval)
+    scheduler.add_job(refresh_notify_address, 'interval', seconds=config.config['notify_address_interval'])
+    scheduler.add_job(all_unconfirmed_transaction.save, 'interval', seconds=config.config['mempool_snapshot_interval'])
     scheduler.start()
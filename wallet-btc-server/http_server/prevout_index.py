@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from collections import OrderedDict
+from . import config
+
+
+class Prevout:
+    ''' what an input needs from the output it spends, nothing else '''
+    __slots__ = ('type', 'address', 'value')
+
+    def __init__(self, type, address, value):
+        self.type = type
+        self.address = address
+        self.value = value
+
+
+def get_key(txid, vout):
+    # 36 bytes instead of a (str, int) tuple
+    return bytes.fromhex(txid) + vout.to_bytes(4, 'little')
+
+
+class PrevoutIndex:
+    ''' (txid, vout) -> Prevout, filled by every decoded transaction; outputs are immutable so entries never go stale '''
+
+    def __init__(self, max_entries):
+        self.pid = os.getpid()
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counter = {'hit': 0, 'miss': 0, 'eviction': 0}
+
+    def get(self, txid, vout):
+        key = get_key(txid, vout)
+        one_prevout = self.entries.get(key)
+        if one_prevout is None:
+            self.counter['miss'] += 1
+        else:
+            # outputs of a popular funding transaction are spent again and again, they stay
+            self.entries.move_to_end(key)
+            self.counter['hit'] += 1
+        return one_prevout
+
+    def put(self, txid, vout, type, address, value):
+        key = get_key(txid, vout)
+        if key in self.entries:
+            return
+        # the least recently used entries go first
+        while len(self.entries) >= self.max_entries and self.entries:
+            self.entries.popitem(last=False)
+            self.counter['eviction'] += 1
+        self.entries[key] = Prevout(sys.intern(type), address, value)
+
+    def get_counter(self):
+        result = dict(self.counter)
+        result['entries'] = len(self.entries)
+        return result
+
+
+index = None
+
+def get_index():
+    global index
+    if index is None or index.pid != os.getpid():
+        index = PrevoutIndex(config.config['prevout_index_max_entries'])
+    return index
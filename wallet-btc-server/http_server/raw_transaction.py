@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+from . import address
+
+
+OPCODE_NAMES = {
+    0x4f: 'OP_1NEGATE', 0x50: 'OP_RESERVED', 0x61: 'OP_NOP', 0x62: 'OP_VER', 0x63: 'OP_IF', 0x64: 'OP_NOTIF',
+    0x65: 'OP_VERIF', 0x66: 'OP_VERNOTIF', 0x67: 'OP_ELSE', 0x68: 'OP_ENDIF', 0x69: 'OP_VERIFY', 0x6a: 'OP_RETURN',
+    0x6b: 'OP_TOALTSTACK', 0x6c: 'OP_FROMALTSTACK', 0x6d: 'OP_2DROP', 0x6e: 'OP_2DUP', 0x6f: 'OP_3DUP',
+    0x70: 'OP_2OVER', 0x71: 'OP_2ROT', 0x72: 'OP_2SWAP', 0x73: 'OP_IFDUP', 0x74: 'OP_DEPTH', 0x75: 'OP_DROP',
+    0x76: 'OP_DUP', 0x77: 'OP_NIP', 0x78: 'OP_OVER', 0x79: 'OP_PICK', 0x7a: 'OP_ROLL', 0x7b: 'OP_ROT',
+    0x7c: 'OP_SWAP', 0x7d: 'OP_TUCK', 0x7e: 'OP_CAT', 0x7f: 'OP_SUBSTR', 0x80: 'OP_LEFT', 0x81: 'OP_RIGHT',
+    0x82: 'OP_SIZE', 0x83: 'OP_INVERT', 0x84: 'OP_AND', 0x85: 'OP_OR', 0x86: 'OP_XOR', 0x87: 'OP_EQUAL',
+    0x88: 'OP_EQUALVERIFY', 0x89: 'OP_RESERVED1', 0x8a: 'OP_RESERVED2', 0x8b: 'OP_1ADD', 0x8c: 'OP_1SUB',
+    0x8d: 'OP_2MUL', 0x8e: 'OP_2DIV', 0x8f: 'OP_NEGATE', 0x90: 'OP_ABS', 0x91: 'OP_NOT', 0x92: 'OP_0NOTEQUAL',
+    0x93: 'OP_ADD', 0x94: 'OP_SUB', 0x95: 'OP_MUL', 0x96: 'OP_DIV', 0x97: 'OP_MOD', 0x98: 'OP_LSHIFT',
+    0x99: 'OP_RSHIFT', 0x9a: 'OP_BOOLAND', 0x9b: 'OP_BOOLOR', 0x9c: 'OP_NUMEQUAL', 0x9d: 'OP_NUMEQUALVERIFY',
+    0x9e: 'OP_NUMNOTEQUAL', 0x9f: 'OP_LESSTHAN', 0xa0: 'OP_GREATERTHAN', 0xa1: 'OP_LESSTHANOREQUAL',
+    0xa2: 'OP_GREATERTHANOREQUAL', 0xa3: 'OP_MIN', 0xa4: 'OP_MAX', 0xa5: 'OP_WITHIN', 0xa6: 'OP_RIPEMD160',
+    0xa7: 'OP_SHA1', 0xa8: 'OP_SHA256', 0xa9: 'OP_HASH160', 0xaa: 'OP_HASH256', 0xab: 'OP_CODESEPARATOR',
+    0xac: 'OP_CHECKSIG', 0xad: 'OP_CHECKSIGVERIFY', 0xae: 'OP_CHECKMULTISIG', 0xaf: 'OP_CHECKMULTISIGVERIFY',
+    0xb0: 'OP_NOP1', 0xb1: 'OP_CHECKLOCKTIMEVERIFY', 0xb2: 'OP_CHECKSEQUENCEVERIFY', 0xb3: 'OP_NOP4',
+    0xb4: 'OP_NOP5', 0xb5: 'OP_NOP6', 0xb6: 'OP_NOP7', 0xb7: 'OP_NOP8', 0xb8: 'OP_NOP9', 0xb9: 'OP_NOP10',
+    0xba: 'OP_CHECKSIGADD',
+}
+
+
+class TransactionReader:
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, size):
+        if self.position + size > len(self.data):
+            raise ValueError("raw transaction is truncated")
+        result = self.data[self.position:self.position + size]
+        self.position += size
+        return result
+
+    def read_int(self, size):
+        return int.from_bytes(self.read(size), 'little')
+
+    def read_varint(self):
+        first = self.read_int(1)
+        if first < 0xfd:
+            return first
+        return self.read_int({0xfd: 2, 0xfe: 4, 0xff: 8}[first])
+
+
+def script_to_asm(script):
+    ''' same text as bitcoind ScriptToAsmStr, pushes of up to 4 bytes are shown as numbers '''
+    result = []
+    position = 0
+    length = len(script)
+    while position < length:
+        opcode = script[position]
+        position += 1
+        if 0 == opcode:
+            result.append('0')
+        elif opcode <= 0x4e:
+            if opcode < 0x4c:
+                size = opcode
+            else:
+                size_length = {0x4c: 1, 0x4d: 2, 0x4e: 4}[opcode]
+                if position + size_length > length:
+                    result.append('[error]')
+                    break
+                size = int.from_bytes(script[position:position + size_length], 'little')
+                position += size_length
+            if position + size > length:
+                result.append('[error]')
+                break
+            data = script[position:position + size]
+            position += size
+            if size <= 4:
+                result.append(str(script_number(data)))
+            else:
+                result.append(data.hex())
+        elif 0x51 <= opcode <= 0x60:
+            result.append(str(opcode - 0x50))
+        else:
+            result.append(OPCODE_NAMES.get(opcode, 'OP_UNKNOWN'))
+    return ' '.join(result)
+
+
+def script_number(data):
+    if 0 == len(data):
+        return 0
+    result = int.from_bytes(data, 'little')
+    if data[-1] & 0x80:
+        return -(result & ~(0x80 << (8 * (len(data) - 1))))
+    return result
+
+
+def deserialize(raw_hex):
+    ''' legacy or segwit raw transaction -> dict shaped like the verbose bitcoind result, values also as integer satoshi '''
+    data = bytes.fromhex(raw_hex)
+    reader = TransactionReader(data)
+    version = reader.read_int(4)
+
+    segwit = data[4:6] == b'\x00\x01'
+    if segwit:
+        reader.read(2)
+    body_start = reader.position
+
+    vin = []
+    input_count = reader.read_varint()
+    for _ in range(input_count):
+        prev_hash = reader.read(32)
+        prev_index = reader.read_int(4)
+        script_sig = reader.read(reader.read_varint())
+        sequence = reader.read_int(4)
+        if prev_hash == b'\x00' * 32 and 0xffffffff == prev_index:
+            vin.append({'coinbase': script_sig.hex(), 'sequence': sequence})
+        else:
+            vin.append({'txid': prev_hash[::-1].hex(), 'vout': prev_index,
+                        'scriptSig': {'asm': script_to_asm(script_sig), 'hex': script_sig.hex()},
+                        'sequence': sequence})
+
+    vout = []
+    output_count = reader.read_varint()
+    for index in range(output_count):
+        value = reader.read_int(8)
+        script_pub_key = reader.read(reader.read_varint())
+        script_type, addresses = address.script_to_address(script_pub_key)
+        one_script = {'asm': script_to_asm(script_pub_key), 'hex': script_pub_key.hex(), 'type': script_type}
+        if 0 != len(addresses):
+            one_script['addresses'] = addresses
+        vout.append({'value': value / 100000000, 'value_satoshi': value, 'n': index, 'scriptPubKey': one_script})
+    body_end = reader.position
+
+    if segwit:
+        for one_input in vin:
+            one_input['txinwitness'] = [reader.read(reader.read_varint()).hex() for _ in range(reader.read_varint())]
+    locktime = reader.read_int(4)
+    if reader.position != len(data):
+        raise ValueError("raw transaction has trailing data")
+
+    # txid never covers the witness
+    stripped = data[:4] + data[body_start:body_end] + data[-4:]
+    stripped_size = len(stripped)
+    return {
+        'txid': address.double_sha256(stripped)[::-1].hex(),
+        'hash': address.double_sha256(data)[::-1].hex(),
+        'version': version,
+        'size': len(data),
+        'vsize': (stripped_size * 3 + len(data) + 3) // 4,
+        'locktime': locktime,
+        'vin': vin,
+        'vout': vout,
+        'hex': raw_hex
+    }
@@ -1,85 +1,212 @@
 #!/usr/bin/env python3
 
 from . import electrumx_tcp
+from . import tx_cache
+from . import address_cache
+from . import raw_transaction
+from . import tip_tracker
+from . import error_info
 from . import config
 from .log import logger
 import json
+import time
 import requests
-
-def get_transaction_by_txid(txid):
-    one_request = {"jsonrpc": "2.0", "method": "blockchain.transaction.get", "params": {'tx_hash':txid, 'verbose': True}, "id": 1}
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
-
-def get_transaction_by_txid_batch(txid_batch):
+from gevent.pool import Pool
+from gevent.event import AsyncResult
+
+tip = {'height': 0, 'hash': '', 'time': 0}
+
+def tip_request(id):
+    return {"jsonrpc": "2.0", "method": "blockchain.headers.subscribe", "params": {}, "id": id}
+
+def update_tip(one_response):
+    if 'result' in one_response and 'height' in one_response['result']:
+        tip['height'] = one_response['result']['height']
+        tip['hash'] = tip_tracker.get_header_hash(one_response['result']['hex'])
+        tip['time'] = time.time()
+
+def get_tip(max_age=None):
+    ''' (height, block hash) of the tip; from the live header subscription, else asked for when older than max_age '''
+    tracker = tip_tracker.get_tracker()
+    if tracker.live:
+        return tracker.height, tracker.hash
+    if max_age is None:
+        max_age = config.config['tip_height_ttl']
+    if time.time() - tip['time'] > max_age:
+        update_tip(electrumx_tcp.request(tip_request(1)))
+    return tip['height'], tip['hash']
+
+def get_tip_height(max_age=None):
+    return get_tip(max_age)[0]
+
+# method and params -> AsyncResult of the request in flight upstream
+single_flight = {}
+single_flight_counter = {'upstream': 0, 'coalesced': 0}
+
+def batch_call(method, params_list):
+    ''' one request per params, sent as electrumx_batch_size chunks in parallel over the connection pool;
+        responses come back in order with id = index, a chunk that fails as a whole is retried.
+        a request identical to one already in flight, from this or any other caller, waits for that one instead '''
     one_request = []
+    own_key = {}
+    waiting = []
+    index = 0
+    for params in params_list:
+        key = method + json.dumps(params, sort_keys=True)
+        if key in single_flight:
+            waiting.append((index, single_flight[key]))
+            single_flight_counter['coalesced'] += 1
+        else:
+            single_flight[key] = AsyncResult()
+            own_key[index] = key
+            one_request.append({"jsonrpc": "2.0", "method": method, "params": params, "id": index})
+            single_flight_counter['upstream'] += 1
+        index += 1
+
+    chunk_size = config.config['electrumx_batch_size']
+    chunks = [one_request[index:index + chunk_size] for index in range(0, len(one_request), chunk_size)]
+
+    def call_chunk(chunk):
+        retries = config.config['electrumx_batch_retries']
+        while True:
+            response = electrumx_tcp.request(chunk)
+            if isinstance(response, list):
+                return response
+            if retries <= 0:
+                logger.error("batch_call " + method + " chunk failed: " + json.dumps(response, ensure_ascii=False))
+                return [{"jsonrpc": "2.0", "error": response.get('error'), "id": one_member['id']} for one_member in chunk]
+            retries -= 1
+
+    result = [None]*len(params_list)
+    try:
+        for response in Pool(config.config['electrumx_batch_parallel']).imap_unordered(call_chunk, chunks):
+            for one_response in response:
+                if isinstance(one_response, dict) and one_response.get('id') in own_key:
+                    result[one_response['id']] = one_response
+    finally:
+        # callers mutate their response, everyone waiting gets a copy
+        for index, key in own_key.items():
+            one_response = result[index]
+            if one_response is None:
+                one_response = dict(electrumx_tcp.socket_error_response(), jsonrpc="2.0", id=index)
+            single_flight.pop(key).set(dict(one_response))
+
+    for index, one_result in waiting:
+        result[index] = dict(one_result.get(), id=index)
+    return [one_response for one_response in result if one_response is not None]
+
+def call(method, params, id):
+    ''' single request through the batch executor, so it shares in-flight requests too '''
+    one_response = batch_call(method, [params])[0]
+    one_response['id'] = id
+    return one_response
+
+def put_confirmed_transaction(cache, transaction_batch):
+    ''' cache transactions at least transaction_cache_min_confirmations deep; confirmations come from bitcoind and the tip from
+        electrumx, which can lag a block behind, so the height is only trusted when that block header carries the blockhash '''
+    min_confirmations = config.config['transaction_cache_min_confirmations']
+    transaction_batch = [one_transaction for one_transaction in transaction_batch
+                         if one_transaction.get('confirmations', 0) >= min_confirmations and one_transaction.get('blockhash')]
+    if 0 == len(transaction_batch):
+        return
+    tip_height = get_tip_height(0)
+    # the tip lagging bitcoind by one block is the usual case, so the next height is tried too
+    height_list = sorted(set([height for one_transaction in transaction_batch
+                              for height in (tip_height - one_transaction['confirmations'] + 1, tip_height - one_transaction['confirmations'] + 2)]))
+    block_height = {}
+    for one_response in batch_call("blockchain.block.header", [{'height': height} for height in height_list]):
+        if 'result' in one_response:
+            block_height[tip_tracker.get_header_hash(one_response['result'])] = height_list[one_response['id']]
+    for one_transaction in transaction_batch:
+        height = block_height.get(one_transaction['blockhash'])
+        if height is not None:
+            cache.put(one_transaction, height)
+
+def get_transaction_by_txid_list(txid_batch, verbose=True):
+    ''' confirmed transactions come from the cache, the rest are fetched through the batch executor '''
+    tip_height = get_tip_height()
+    cache = tx_cache.get_cache()
+    result = [None]*len(txid_batch)
+    missing_index = []
     index = 0
     for txid in txid_batch:
-        one_request.append({"jsonrpc": "2.0", "method": "blockchain.transaction.get", "params": {'tx_hash':txid, 'verbose': True}, "id": index})
+        transaction = cache.get(txid, tip_height)
+        if transaction is None:
+            missing_index.append(index)
+        else:
+            result[index] = {"jsonrpc": "2.0", "result": transaction, "id": index}
         index += 1
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    if 0 == len(missing_index):
+        return result
+
+    response = batch_call("blockchain.transaction.get", [{'tx_hash': txid_batch[index], 'verbose': verbose} for index in missing_index])
+    if verbose:
+        put_confirmed_transaction(cache, [one_response['result'] for one_response in response if 'result' in one_response])
+    for one_response in response:
+        index = missing_index[one_response['id']]
+        one_response['id'] = index
+        if 'result' not in one_response:
+            result[index] = one_response
+        elif verbose:
+            result[index] = one_response
+        else:
+            try:
+                one_response['result'] = raw_transaction.deserialize(one_response['result'])
+            except (ValueError, KeyError, TypeError):
+                logger.error("get_transaction_by_txid_list can not decode " + txid_batch[index])
+                one_response = {"jsonrpc": "2.0", "error": {'code': error_info.PARAM_ERROR, 'message': "invalid raw transaction"}, "id": index}
+            result[index] = one_response
+    return result
+
+def get_transaction_by_txid(txid):
+    one_response = get_transaction_by_txid_list([txid])[0]
+    if one_response is None:
+        return electrumx_tcp.socket_error_response()
+    one_response['id'] = 1
+    return one_response
+
+def get_transaction_by_txid_batch(txid_batch):
+    return [one_response for one_response in get_transaction_by_txid_list(txid_batch) if one_response is not None]
+
+def get_raw_transaction_by_txid_batch(txid_batch):
+    ''' compact raw hex over the wire, decoded locally; for callers that only need vin/vout '''
+    return [one_response for one_response in get_transaction_by_txid_list(txid_batch, False) if one_response is not None]
 
 def get_address_unspent(address):
-    one_request = {"jsonrpc": "2.0", "method": "blockchain.scripthash.listunspent", "params": {'scripthash': address}, "id": 2}
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    return call("blockchain.scripthash.listunspent", {'scripthash': address}, 2)
 
 def get_address_unspent_batch(address_batch):
-    one_request = []
-    index = 0
-    for one_address in address_batch:
-        one_request.append({"jsonrpc": "2.0", "method": "blockchain.scripthash.listunspent", "params": {'scripthash': one_address}, "id": index})
-        index += 1
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    return get_scripthash_batch("blockchain.scripthash.listunspent", address_batch)
 
 def get_fee_with_number(number):
-    one_request = {"jsonrpc": "2.0", "method": "blockchain.estimatefee", "params": {'number': number}, "id": 2}
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    return call("blockchain.estimatefee", {'number': number}, 2)
+
+def get_scripthash_batch(method, address_batch):
+    ''' per scripthash results, answered from the subscription cache while electrumx reports no status change '''
+    def fetch(missing):
+        return batch_call(method, [{'scripthash': one_address} for one_address in missing])
+    return address_cache.get_cache().get_batch(method, address_batch, fetch)
 
 def get_address_balance(address):
-    one_request = {"jsonrpc": "2.0", "method": "blockchain.scripthash.get_balance", "params": {'scripthash': address}, "id": 2}
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    return call("blockchain.scripthash.get_balance", {'scripthash': address}, 2)
 
 def get_address_balance_batch(address_batch):
-    one_request = []
-    index = 0
-    for one_address in address_batch:
-        one_request.append({"jsonrpc": "2.0", "method": "blockchain.scripthash.get_balance", "params": {'scripthash': one_address}, "id": index})
-        index += 1
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    return get_scripthash_batch("blockchain.scripthash.get_balance", address_batch)
 
 def get_address_history(address):
-    one_request = {"jsonrpc": "2.0", "method": "blockchain.scripthash.get_history", "params": {'scripthash': address}, "id": 2}
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    return call("blockchain.scripthash.get_history", {'scripthash': address}, 2)
 
 def get_address_history_batch(address_batch):
-    one_request = []
-    index = 0
-    for one_address in address_batch:
-        one_request.append({"jsonrpc": "2.0", "method": "blockchain.scripthash.get_history", "params": {'scripthash': one_address}, "id": index})
-        index += 1
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    return get_scripthash_batch("blockchain.scripthash.get_history", address_batch)
+
+def get_block_header(height):
+    return call("blockchain.block.header", {'height': height}, 2)
 
 def get_address_used_batch(address_batch):
-    one_request = []
-    index = 0
-    for one_address in address_batch:
-        one_request.append({"jsonrpc": "2.0", "method": "blockchain.scripthash.has_used", "params": {'scripthash': one_address}, "id": index})
-        index += 1
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    return get_scripthash_batch("blockchain.scripthash.has_used", address_batch)
 
 def broadcast_transaction(hex_transaction):
-    one_request = {"jsonrpc": "2.0", "method": "blockchain.transaction.broadcast", "params": {'raw_tx': hex_transaction}, "id": 2}
-    result = electrumx_tcp.tcp_call(json.dumps(one_request, ensure_ascii=False))
-    return  json.loads(result)
+    return call("blockchain.transaction.broadcast", {'raw_tx': hex_transaction}, 2)
 
 
 def get_transaction_by_txid_from_node(txid):
@@ -96,5 +223,3 @@ def get_transaction_by_txid_from_node(txid):
         return {}
     return one_response['result']
 
-async def get_transaction_by_txid_from_node_async(txid):
-    return get_transaction_by_txid_from_node(txid)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import os
+import socket
+import gevent
+from gevent.event import Event
+from .log import logger
+from .address import double_sha256
+from . import config
+from . import electrumx_tcp
+
+
+SUBSCRIBE_METHOD = "blockchain.headers.subscribe"
+
+
+def get_header_hash(header_hex):
+    return double_sha256(bytes.fromhex(header_hex))[::-1].hex()
+
+
+class TipTracker:
+    ''' keeps a headers subscription open, so the tip is known without asking; hooks run on every new tip '''
+
+    def __init__(self, host, port, timeout, recv_buffer_size, ping_interval, retry_interval):
+        self.pid = os.getpid()
+        self.height = 0
+        self.hash = ''
+        self.live = False
+        self.closed = Event()
+        self.hooks = []
+        self.ping_interval = ping_interval
+        self.retry_interval = retry_interval
+        self.connection = electrumx_tcp.ElectrumxConnection(host, port, timeout, recv_buffer_size,
+                                                            self.on_notification, self.on_close)
+        gevent.spawn(self.run)
+
+    def add_hook(self, hook):
+        ''' hook(height, block hash) is called in its own greenlet for every new tip, a reorg included '''
+        self.hooks.append(hook)
+
+    def update(self, header):
+        block_hash = get_header_hash(header['hex'])
+        if block_hash == self.hash:
+            return
+        self.height = header['height']
+        self.hash = block_hash
+        logger.info("tip tracker new tip " + str(self.height) + " " + block_hash)
+        for hook in self.hooks:
+            gevent.spawn(hook, self.height, block_hash)
+
+    def on_notification(self, method, params):
+        if SUBSCRIBE_METHOD == method and 0 != len(params):
+            self.update(params[0])
+
+    def on_close(self):
+        self.live = False
+        self.closed.set()
+
+    def subscribe(self):
+        try:
+            self.connection.connect()
+        except socket.error:
+            logger.error("tip tracker connect failed " + self.connection.host + ":" + str(self.connection.port))
+            return
+        one_response = self.connection.call({"jsonrpc": "2.0", "method": SUBSCRIBE_METHOD, "params": {}, "id": 1})
+        if one_response is None or 'error' in one_response:
+            logger.error("tip tracker subscribe failed")
+            return
+        self.update(one_response['result'])
+        self.closed.clear()
+        self.live = True
+
+    def run(self):
+        while True:
+            if not self.live:
+                self.subscribe()
+                if not self.live:
+                    gevent.sleep(self.retry_interval)
+                continue
+            # a closed socket wakes the loop up at once
+            self.closed.wait(self.ping_interval if self.ping_interval > 0 else None)
+            if not self.live or self.ping_interval <= 0:
+                continue
+            one_response = self.connection.call({"jsonrpc": "2.0", "method": "server.ping", "params": [], "id": 0})
+            if one_response is None or 'error' in one_response:
+                logger.error("tip tracker keepalive failed, reconnect")
+                electrumx_socket = self.connection.electrumx_socket
+                if electrumx_socket is not None:
+                    self.connection.close(electrumx_socket)
+
+
+tracker = None
+
+def get_tracker():
+    ''' started lazily so every forked process subscribes on its own socket '''
+    global tracker
+    if tracker is None or tracker.pid != os.getpid():
+        tracker = TipTracker(config.config['host_electrumx'],
+                             config.config['port_electrumx'],
+                             config.config['electrumx_timeout'],
+                             config.config['electrumx_recv_buffer_size'],
+                             config.config['electrumx_ping_interval'],
+                             config.config['tip_tracker_retry_interval'])
+    return tracker
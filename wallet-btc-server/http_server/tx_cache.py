@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import sqlite3
+from collections import OrderedDict
+from .log import logger
+from . import config
+from . import electrumx_tcp
+from . import tip_tracker
+
+
+class TransactionCache:
+    ''' transactions deep enough in the chain never change: a memory lru with a byte budget in front of a sqlite store keyed by txid;
+        a reorg drops everything in the last reorg_depth blocks '''
+
+    def __init__(self, memory_bytes, disk_file, reorg_depth):
+        self.pid = os.getpid()
+        self.reorg_depth = reorg_depth
+        self.memory = OrderedDict()
+        self.memory_bytes = memory_bytes
+        self.used_bytes = 0
+        self.disk = None
+        if disk_file:
+            try:
+                self.disk = sqlite3.connect(disk_file, isolation_level=None, check_same_thread=False)
+                self.disk.execute("PRAGMA journal_mode=WAL")
+                self.disk.execute("CREATE TABLE IF NOT EXISTS confirmed_tx (txid TEXT PRIMARY KEY, height INTEGER, body TEXT)")
+                self.disk.execute("CREATE INDEX IF NOT EXISTS confirmed_tx_height ON confirmed_tx (height)")
+            except sqlite3.Error as e:
+                logger.error("transaction cache open " + disk_file + " failed: " + str(e))
+                self.disk = None
+        self.counter = {'memory_hit': 0, 'disk_hit': 0, 'miss': 0, 'store': 0, 'eviction': 0, 'reorg_drop': 0}
+        tracker = tip_tracker.get_tracker()
+        self.tip_height, self.tip_hash = tracker.height, tracker.hash
+        tracker.add_hook(self.on_new_block)
+
+    def put_memory(self, txid, height, body):
+        if txid in self.memory:
+            self.memory.move_to_end(txid)
+            return
+        self.memory[txid] = (height, body)
+        self.used_bytes += len(body)
+        while self.used_bytes > self.memory_bytes and self.memory:
+            _, (_, old_body) = self.memory.popitem(last=False)
+            self.used_bytes -= len(old_body)
+            self.counter['eviction'] += 1
+
+    def get(self, txid, tip_height):
+        ''' cached transaction with confirmations computed against tip_height, or None; an unknown tip skips the cache '''
+        if tip_height <= 0:
+            return None
+        if txid in self.memory:
+            self.memory.move_to_end(txid)
+            height, body = self.memory[txid]
+            self.counter['memory_hit'] += 1
+        else:
+            row = None
+            if self.disk is not None:
+                try:
+                    row = self.disk.execute("SELECT height, body FROM confirmed_tx WHERE txid = ?", (txid,)).fetchone()
+                except sqlite3.Error as e:
+                    logger.error("transaction cache read failed: " + str(e))
+            if row is None:
+                self.counter['miss'] += 1
+                return None
+            height, body = row
+            self.put_memory(txid, height, body)
+            self.counter['disk_hit'] += 1
+
+        transaction = json.loads(body)
+        transaction['confirmations'] = max(1, tip_height - height + 1)
+        return transaction
+
+    def get_height(self, txid):
+        ''' block height of a transaction held in memory, None otherwise '''
+        if txid not in self.memory:
+            return None
+        return self.memory[txid][0]
+
+    def put(self, transaction, height):
+        ''' height is the verified height of the block holding the transaction, the caller decides it is deep enough '''
+        if 'txid' not in transaction or height <= 0:
+            return
+        txid = transaction['txid']
+        if txid in self.memory:
+            return
+        body = json.dumps(transaction, ensure_ascii=False)
+        self.put_memory(txid, height, body)
+        self.counter['store'] += 1
+        if self.disk is not None:
+            try:
+                self.disk.execute("INSERT OR IGNORE INTO confirmed_tx (txid, height, body) VALUES (?, ?, ?)", (txid, height, body))
+            except sqlite3.Error as e:
+                logger.error("transaction cache write failed: " + str(e))
+
+    def drop_above(self, height):
+        for txid in [txid for txid, (one_height, _) in self.memory.items() if one_height > height]:
+            _, body = self.memory.pop(txid)
+            self.used_bytes -= len(body)
+            self.counter['reorg_drop'] += 1
+        if self.disk is not None:
+            try:
+                self.counter['reorg_drop'] += self.disk.execute("DELETE FROM confirmed_tx WHERE height > ?", (height,)).rowcount
+            except sqlite3.Error as e:
+                logger.error("transaction cache reorg delete failed: " + str(e))
+
+    def on_new_block(self, height, block_hash):
+        ''' tip hook: unless the new tip extends the last one, the blocks below it may have changed '''
+        last_height, last_hash = self.tip_height, self.tip_hash
+        self.tip_height, self.tip_hash = height, block_hash
+        if not last_hash or block_hash == last_hash:
+            return
+        if height > last_height:
+            one_response = electrumx_tcp.request({"jsonrpc": "2.0", "method": "blockchain.block.header", "params": {'height': last_height}, "id": 1})
+            if 'result' in one_response and tip_tracker.get_header_hash(one_response['result']) == last_hash:
+                return
+        logger.info("transaction cache reorg at " + str(height) + " " + block_hash + ", dropping above " + str(min(height, last_height) - self.reorg_depth))
+        self.drop_above(min(height, last_height) - self.reorg_depth)
+
+    def get_counter(self):
+        result = dict(self.counter)
+        result['memory_entries'] = len(self.memory)
+        result['memory_bytes'] = self.used_bytes
+        return result
+
+
+cache = None
+
+def get_cache():
+    ''' created lazily so every forked process opens its own sqlite connection '''
+    global cache
+    if cache is None or cache.pid != os.getpid():
+        cache = TransactionCache(config.config['transaction_cache_memory_bytes'], config.config['transaction_cache_file'],
+                                 config.config['transaction_cache_reorg_depth'])
+    return cache
+
+
+decoded_cache = None
+
+def get_decoded_cache():
+    ''' decoded transactions for the http answers, memory only since they are rebuilt from the cache above '''
+    global decoded_cache
+    if decoded_cache is None or decoded_cache.pid != os.getpid():
+        decoded_cache = TransactionCache(config.config['decoded_cache_memory_bytes'], '', config.config['transaction_cache_reorg_depth'])
+    return decoded_cache
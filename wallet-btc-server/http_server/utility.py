@@ -1,25 +1,33 @@
 #!/usr/bin/env python3
 
-from hashlib import sha256
 from datetime import datetime
+from functools import lru_cache
 import json
-import asyncio
 from .log import logger
 from . import rpc_call
+from . import electrumx_tcp
+from . import prevout_index
+from . import tx_cache
+from . import config
+from . import address as address_util
 
 
-Base58Alphabet = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
-
 def get_index_output_address_value(transaction, index):
     one_output = transaction['vout'][index]
-    if 'addresses' not in one_output['scriptPubKey']:
+    if 'address' in one_output['scriptPubKey']:
+        addresses = [one_output['scriptPubKey']['address']]
+    elif 'addresses' in one_output['scriptPubKey']:
+        addresses = one_output['scriptPubKey']['addresses']
+    else:
         return '', 0
-    addresses = one_output['scriptPubKey']['addresses']
     result_address = ''
     if 0 != len(addresses):
         result_address = addresses[0]
+    if 'value_satoshi' in one_output:
+        return result_address, one_output['value_satoshi']
+    # a float btc amount is not exact, 0.29 * 100000000 is 28999999.999999996
     value = one_output['value']
-    result_value = int(value * 100000000)
+    result_value = int(round(value * 100000000))
     return result_address, result_value
 
 
@@ -42,330 +50,125 @@ def get_input_list_txid_vout(transaction):
     return result
 
 
-def base58decode(data):
-    result = 0
-    for d in data:
-        charIndex = Base58Alphabet.find(d)
-        result = result * len(Base58Alphabet)
-        result = result + charIndex
-    decoded = hex(result)
-    return decoded
-
-def check_address(address):
-    for d in address:
-        charIndex = Base58Alphabet.find(d)
-        if -1 == charIndex:
-            return False
+def check_txid(txid):
+    if not isinstance(txid, str) or 64 != len(txid):
+        return False
+    try:
+        bytes.fromhex(txid)
+    except ValueError:
+        return False
     return True
 
+
+@lru_cache(maxsize=config.config['scripthash_cache_size'])
 def get_script_hash(address):
-    hex_address = base58decode(address)
-    pub_key_hash = hex_address[2:len(hex_address) - 8]
-    
-    if 0 != len(pub_key_hash) % 2:
-        pub_key_hash = '0' + pub_key_hash
+    script = address_util.address_to_script(address)
+    if script is None:
+        return None
+    return address_util.get_script_hash(script)
 
-    script = "76a914" + pub_key_hash + "88ac"
-    temp = sha256(bytes.fromhex(script)).digest().hex()
-    result = ''
-    index = 0
-    lenght = len(temp)
-    while index < lenght:
-        result = temp[index:index+2] + result
-        index += 2
-    return result
+
+def check_address(address):
+    ''' any standard address with its checksum verified, so a typo never reaches electrumx; shares the scripthash lru '''
+    return get_script_hash(address) is not None
+
+
+def get_script_hash_batch(address_batch):
+    ''' scripthash per address, None for an invalid one '''
+    return [get_script_hash(one_address) for one_address in address_batch]
 
 
 def get_address_list_and_dict_hash_list_by_address(address_batch):
     address_list = []
     address_dict = {}
 
-    for one_address in address_batch:
-        one_address_hash = get_script_hash(one_address)
+    for one_address, one_address_hash in zip(address_batch, get_script_hash_batch(address_batch)):
+        if one_address_hash is None:
+            continue
         address_list.append(one_address_hash)
         address_dict[one_address_hash] = one_address
     return address_list, address_dict
 
-def get_transaction_by_txid(txid):
-    one_response = rpc_call.get_transaction_by_txid(txid)
-    if 'error' in one_response:
-        return False, {}
-    transaction = one_response['result']
-
-    # input ingo
-    input = []
-    input_value_sum = 0
-    input_txid_vout = get_input_list_txid_vout(transaction)
-    for one_txid_vout in input_txid_vout:
-        one_txid_response = rpc_call.get_transaction_by_txid(one_txid_vout['txid'])
-        if 'error' in one_txid_response:
-            continue
-        one_address, one_value = get_index_output_address_value(one_txid_response['result'], one_txid_vout['vout'])
-        input.append({"from_address": one_address, "from_txid":one_txid_vout['txid'], "vin_index":one_txid_vout['vout'], "value": one_value})
-        input_value_sum += one_value
- 
-    # output info
-    output = []
-    output_value_sum = 0
-    output_length = len(transaction['vout'])
-    index = 0
-    while index < output_length:
-        one_address, one_value = get_index_output_address_value(transaction, index)
-        output.append({'to_address': one_address, 'vout_index': index, 'value': one_value, 'type': transaction['vout'][index]['scriptPubKey']['type'], 'asm': transaction['vout'][index]['scriptPubKey']['asm']})
-        output_value_sum += one_value
-        index += 1
-
-    utc_time = ""
-    if 'blocktime' in transaction:
-        utc_time = datetime.utcfromtimestamp(transaction['blocktime']).isoformat() + '+0000'
-    
-    block_hash = ''
-    if 'blockhash' in transaction:
-        block_hash = transaction['blockhash']
-
-    confirmations = -1
-    if 'confirmations' in transaction:
-        confirmations = transaction['confirmations']
+def put_output_prevout(transaction, index):
+    one_address, one_value = get_index_output_address_value(transaction, index)
+    one_type = transaction['vout'][index]['scriptPubKey']['type']
+    prevout_index.get_index().put(transaction['txid'], index, one_type, one_address, one_value)
+    return prevout_index.Prevout(one_type, one_address, one_value)
 
-    return True, {
-                    'txid': transaction['txid'],
-                    'blockhash': block_hash,
-                    'iscoinbase': is_transaction_coinbase(transaction),
-                    'fee': input_value_sum - output_value_sum,
-                    'inputs': input,
-                    'outputs': output,
-                    'confirmations': confirmations,
-                    'blocktime': utc_time
-                }
 
-def get_transaction_by_txid_batch(txid_batch):
-    response = rpc_call.get_transaction_by_txid_batch(txid_batch)
-    result_transaction_dict = {}
-    for one_response in response:
+def get_transaction_dict(txid_list, get_batch):
+    ''' txid -> transaction and txid -> error '''
+    transaction_dict = {}
+    error_dict = {}
+    for one_response in get_batch(txid_list):
+        txid = txid_list[one_response['id']]
         if 'error' in one_response:
-            logger.error("get_transaction_by_txid_batch get_transaction_by_txid_batch one error: " + json.dumps(one_response, ensure_ascii=False))
+            logger.error("get_transaction_dict one error: " + json.dumps(one_response, ensure_ascii=False))
+            error_dict[txid] = one_response['error']
             continue
-        result_transaction_dict[one_response['id']] = one_response['result']
+        transaction_dict[txid] = one_response['result']
+    return transaction_dict, error_dict
 
-    result_transaction = []
-    index = 0
-    txid_lenght = len(txid_batch)
-    while index < txid_lenght:
-        if index in result_transaction_dict:
-            result_transaction.append(result_transaction_dict[index])
-        index = index + 1
-
-    input_txid = []
-    for one_result_transaction in result_transaction:
-        input_txid_vout = get_input_list_txid_vout(one_result_transaction)
-        for one_txid_vout in input_txid_vout:
-            input_txid.append(one_txid_vout['txid'])
-    real_input_txid = list(set(input_txid))
-    
 
-    input_transaction_dict = {}
-    real_input_txid_length = len(real_input_txid)
-    page_length = 20
-    page_num = real_input_txid_length // page_length
-    page_other = real_input_txid_length % page_length
-    page_index = 0
-    while page_index < page_num:
-        input_response = rpc_call.get_transaction_by_txid_batch(real_input_txid[page_length*page_index:page_length*(page_index+1)])
-        for one_input_response in input_response:
-            if 'error' in one_input_response:
-                logger.error("get_transaction_by_txid_batch get_transaction_by_txid_batch one error: " + json.dumps(one_input_response, ensure_ascii=False))
-                continue
-            input_transaction_dict[one_input_response['result']['txid']] = one_input_response['result']
-        page_index = page_index + 1
-
-    if page_other != 0:
-        input_response = rpc_call.get_transaction_by_txid_batch(real_input_txid[page_length*page_index:])
-        for one_input_response in input_response:
-            if 'error' in one_input_response:
-                logger.error("get_transaction_by_txid_batch get_transaction_by_txid_batch one error: " + json.dumps(one_input_response, ensure_ascii=False))
-                continue
-            input_transaction_dict[one_input_response['result']['txid']] = one_input_response['result']
-
-    result = []
-    for one_result_transaction in result_transaction:
-        # input info
-        input = []
-        input_value_sum = 0
-        input_txid_vout = get_input_list_txid_vout(one_result_transaction)
+def get_input_prevout_dict(transaction_batch):
+    ''' (txid, vout) -> Prevout for all inputs, from the prevout index first; previous transactions still missing are deduplicated and fetched in bounded chunks running in parallel '''
+    one_index = prevout_index.get_index()
+    input_prevout_dict = {}
+    missing_txid_vout = set()
+    for one_transaction in transaction_batch:
+        input_txid_vout = get_input_list_txid_vout(one_transaction)
         for one_txid_vout in input_txid_vout:
-            if one_txid_vout['txid'] in input_transaction_dict:
-                one_address, one_value = get_index_output_address_value(input_transaction_dict[one_txid_vout['txid']], one_txid_vout['vout'])
-                input.append({"from_address": one_address, "from_txid":one_txid_vout['txid'], "vin_index":one_txid_vout['vout'], "value": one_value})
-                input_value_sum += one_value
+            key = (one_txid_vout['txid'], one_txid_vout['vout'])
+            if key in input_prevout_dict or key in missing_txid_vout:
+                continue
+            one_prevout = one_index.get(one_txid_vout['txid'], one_txid_vout['vout'])
+            if one_prevout is None:
+                missing_txid_vout.add(key)
             else:
-                input.append({"from_address": "", "from_txid":one_txid_vout['txid'], "vin_index":one_txid_vout['vout'], "value": 0})
-                input_value_sum += 0
-       
-        # output info
-        output = []
-        output_value_sum = 0
-        output_length = len(one_result_transaction['vout'])
-        index = 0
-        while index < output_length:
-            one_address, one_value = get_index_output_address_value(one_result_transaction, index)
-            output.append({'to_address': one_address, 'vout_index': index, 'value': one_value, 'type': one_result_transaction['vout'][index]['scriptPubKey']['type'], 'asm': one_result_transaction['vout'][index]['scriptPubKey']['asm']})
-            output_value_sum += one_value
-            index += 1
-
-        utc_time = ""
-        if 'blocktime' in one_result_transaction:
-            utc_time = datetime.utcfromtimestamp(one_result_transaction['blocktime']).isoformat() + '+0000'
-    
-        block_hash = ''
-        if 'blockhash' in one_result_transaction:
-            block_hash = one_result_transaction['blockhash']
-
-        confirmations = -1
-        if 'confirmations' in one_result_transaction:
-            confirmations = one_result_transaction['confirmations']
-
-        result.append({
-                    'txid': one_result_transaction['txid'],
-                    'blockhash': block_hash,
-                    'iscoinbase': is_transaction_coinbase(one_result_transaction),
-                    'fee': input_value_sum - output_value_sum,
-                    'inputs': input,
-                    'outputs': output,
-                    'confirmations': confirmations,
-                    'blocktime': utc_time
-                })
-    return result
-
-def get_transaction_without_input_address_by_txid_batch_async(txid_batch):
-    new_loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(new_loop)
-    loop = asyncio.get_event_loop()
-    tasks = []
-    for txid in txid_batch:
-        tasks.append(asyncio.ensure_future(rpc_call.get_transaction_by_txid_from_node_async(txid)))
-    loop.run_until_complete(asyncio.wait(tasks))
+                input_prevout_dict[key] = one_prevout
+    real_input_txid = list(set([one_txid for one_txid, _ in missing_txid_vout]))
+    input_transaction_dict, _ = get_transaction_dict(real_input_txid, rpc_call.get_raw_transaction_by_txid_batch)
 
-    result = []
-    for task in tasks:
-        result.append(task.result())
-
-    return result
-
-# slow
-def get_transaction_by_txid_batch_async(txid_batch):
-    # get transaction info
-    result_transaction = get_transaction_without_input_address_by_txid_batch_async(txid_batch)
- 
-    # get input txid
-    input_txid = []
-    for one_result_transaction in result_transaction:
-        input_txid_vout = get_input_list_txid_vout(one_result_transaction)
-        for one_txid_vout in input_txid_vout:
-            input_txid.append(one_txid_vout['txid'])
-    real_input_txid = list(set(input_txid))
-
-    input_transaction_dict = {}
-    all_input_transaction = get_transaction_without_input_address_by_txid_batch_async(real_input_txid)
-    for one_input_transaction in all_input_transaction:
-        input_transaction_dict[one_input_transaction['txid']] = one_input_transaction
-
-    result = []
-    for one_result_transaction in result_transaction:
-        # input info
-        input = []
-        input_value_sum = 0
-        input_txid_vout = get_input_list_txid_vout(one_result_transaction)
-        for one_txid_vout in input_txid_vout:
-            if one_txid_vout['txid'] in input_transaction_dict:
-                one_address, one_value = get_index_output_address_value(input_transaction_dict[one_txid_vout['txid']], one_txid_vout['vout'])
-                input.append({"from_address": one_address, "from_txid":one_txid_vout['txid'], "vin_index":one_txid_vout['vout'], "value": one_value})
-                input_value_sum += one_value
-            else:
-                input.append({"from_address": "", "from_txid":one_txid_vout['txid'], "vin_index":one_txid_vout['vout'], "value": 0})
-                input_value_sum += 0
-       
-        # output info
-        output = []
-        output_value_sum = 0
-        output_length = len(one_result_transaction['vout'])
+    # keep every output of a fetched transaction, its other outputs are likely to be spent later
+    for one_txid, one_transaction in input_transaction_dict.items():
         index = 0
-        while index < output_length:
-            one_address, one_value = get_index_output_address_value(one_result_transaction, index)
-            output.append({'to_address': one_address, 'vout_index': index, 'value': one_value, 'type': one_result_transaction['vout'][index]['scriptPubKey']['type'], 'asm': one_result_transaction['vout'][index]['scriptPubKey']['asm']})
-            output_value_sum += one_value
+        for _ in one_transaction['vout']:
+            one_prevout = put_output_prevout(one_transaction, index)
+            if (one_txid, index) in missing_txid_vout:
+                input_prevout_dict[(one_txid, index)] = one_prevout
             index += 1
+    return input_prevout_dict
 
-        utc_time = ""
-        if 'blocktime' in one_result_transaction:
-            utc_time = datetime.utcfromtimestamp(one_result_transaction['blocktime']).isoformat() + '+0000'
-    
-        block_hash = ''
-        if 'blockhash' in one_result_transaction:
-            block_hash = one_result_transaction['blockhash']
-
-        confirmations = -1
-        if 'confirmations' in one_result_transaction:
-            confirmations = one_result_transaction['confirmations']
-
-        result.append({
-                    'txid': one_result_transaction['txid'],
-                    'blockhash': block_hash,
-                    'iscoinbase': is_transaction_coinbase(one_result_transaction),
-                    'fee': input_value_sum - output_value_sum,
-                    'inputs': input,
-                    'outputs': output,
-                    'confirmations': confirmations,
-                    'blocktime': utc_time
-                })
-    return result
 
-# async 
-async def get_transaction_by_txid_async(txid):
-    transaction = rpc_call.get_transaction_by_txid_from_node(txid)
-    if not transaction:
-        return {}
-    
+def get_transaction_info(transaction, input_prevout_dict):
     # input info
     input = []
     input_value_sum = 0
     input_txid_vout = get_input_list_txid_vout(transaction)
-    all_txid_vout_txid = []
-    for one_txid_vout in input_txid_vout:
-        all_txid_vout_txid.append(one_txid_vout['txid'])
-
-    all_txid_vout_transaction = get_transaction_without_input_address_by_txid_batch_async(all_txid_vout_txid)
-
     for one_txid_vout in input_txid_vout:
-        one_txid_transaction = {}
-        bool_find = False
-        for one_transaction in all_txid_vout_transaction:
-            if one_transaction['txid'] == one_txid_vout['txid']:
-                one_txid_transaction = one_transaction
-                bool_find = True
-                break
-
-        if not bool_find:
-            continue
+        key = (one_txid_vout['txid'], one_txid_vout['vout'])
+        if key in input_prevout_dict:
+            one_prevout = input_prevout_dict[key]
+            input.append({"from_address": one_prevout.address, "from_txid":one_txid_vout['txid'], "vin_index":one_txid_vout['vout'], "value": one_prevout.value})
+            input_value_sum += one_prevout.value
+        else:
+            input.append({"from_address": "", "from_txid":one_txid_vout['txid'], "vin_index":one_txid_vout['vout'], "value": 0})
 
-        one_address, one_value = get_index_output_address_value(one_txid_transaction, one_txid_vout['vout'])
-        input.append({"from_address": one_address, "from_txid": one_txid_vout['txid'], "vin_index": one_txid_vout['vout'], "value": one_value})
-        input_value_sum += one_value
- 
     # output info
     output = []
     output_value_sum = 0
     output_length = len(transaction['vout'])
     index = 0
     while index < output_length:
-        one_address, one_value = get_index_output_address_value(transaction, index)
-        output.append({'to_address': one_address, 'vout_index': index, 'value': one_value, 'type': transaction['vout'][index]['scriptPubKey']['type'], 'asm': transaction['vout'][index]['scriptPubKey']['asm']})
-        output_value_sum += one_value
+        one_prevout = put_output_prevout(transaction, index)
+        output.append({'to_address': one_prevout.address, 'vout_index': index, 'value': one_prevout.value, 'type': one_prevout.type, 'asm': transaction['vout'][index]['scriptPubKey']['asm']})
+        output_value_sum += one_prevout.value
         index += 1
 
     utc_time = ""
     if 'blocktime' in transaction:
         utc_time = datetime.utcfromtimestamp(transaction['blocktime']).isoformat() + '+0000'
-    
+
     block_hash = ''
     if 'blockhash' in transaction:
         block_hash = transaction['blockhash']
@@ -375,14 +178,80 @@ async def get_transaction_by_txid_async(txid):
         confirmations = transaction['confirmations']
 
     return {
-                    'txid': transaction['txid'],
-                    'blockhash': block_hash,
-                    'iscoinbase': is_transaction_coinbase(transaction),
-                    'fee': input_value_sum - output_value_sum,
-                    'inputs': input,
-                    'outputs': output,
-                    'confirmations': confirmations,
-                    'blocktime': utc_time
-                }
+                'txid': transaction['txid'],
+                'blockhash': block_hash,
+                'iscoinbase': is_transaction_coinbase(transaction),
+                'fee': input_value_sum - output_value_sum,
+                'inputs': input,
+                'outputs': output,
+                'confirmations': confirmations,
+                'blocktime': utc_time
+            }
+
+
+def is_input_complete(transaction, input_prevout_dict):
+    for one_txid_vout in get_input_list_txid_vout(transaction):
+        if (one_txid_vout['txid'], one_txid_vout['vout']) not in input_prevout_dict:
+            return False
+    return True
 
 
+def get_transaction_info_batch(transaction_batch):
+    ''' transactions already deserialized, e.g. pushed by bitcoind over zmq -> info; one prevout stage for the whole batch '''
+    input_prevout_dict = get_input_prevout_dict(transaction_batch)
+    return [get_transaction_info(one_transaction, input_prevout_dict) for one_transaction in transaction_batch]
+
+
+def decode_transaction_batch(txid_batch):
+    ''' the one transaction decoding pipeline: decoded cache, deduplicated primary fetch, then one prevout stage for the whole batch;
+        returns one {'result': info} or {'error': error} per txid, in order '''
+    # electrumx answers with lowercase txids, an uppercase one asked for must still find its result
+    txid_batch = [txid.lower() for txid in txid_batch]
+    tip_height = rpc_call.get_tip_height()
+    decoded_cache = tx_cache.get_decoded_cache()
+    info_dict = {}
+    real_txid = []
+    for txid in dict.fromkeys(txid_batch):
+        one_info = decoded_cache.get(txid, tip_height)
+        if one_info is None:
+            real_txid.append(txid)
+        else:
+            info_dict[txid] = one_info
+    transaction_dict, error_dict = get_transaction_dict(real_txid, rpc_call.get_transaction_by_txid_batch)
+
+    transaction_batch = [transaction_dict[txid] for txid in real_txid if txid in transaction_dict]
+    input_prevout_dict = get_input_prevout_dict(transaction_batch)
+    transaction_cache = tx_cache.get_cache()
+    for one_transaction in transaction_batch:
+        one_info = get_transaction_info(one_transaction, input_prevout_dict)
+        info_dict[one_info['txid']] = one_info
+        # a transaction deep enough with every input resolved never changes, except for its confirmations;
+        # its height is the one the transaction cache verified against the block header, a stale tip never enters
+        height = transaction_cache.get_height(one_info['txid'])
+        if height is not None and is_input_complete(one_transaction, input_prevout_dict):
+            decoded_cache.put(one_info, height)
+
+    result = []
+    for txid in txid_batch:
+        if txid in info_dict:
+            result.append({'result': info_dict[txid]})
+        elif txid in error_dict:
+            result.append({'error': error_dict[txid]})
+        else:
+            result.append(electrumx_tcp.socket_error_response())
+    return result
+
+
+def get_transaction_by_txid(txid):
+    one_response = decode_transaction_batch([txid])[0]
+    if 'error' in one_response:
+        return False, {}
+    return True, one_response['result']
+
+
+def get_transaction_by_txid_batch(txid_batch):
+    result = []
+    for one_response in decode_transaction_batch(txid_batch):
+        if 'result' in one_response:
+            result.append(one_response['result'])
+    return result
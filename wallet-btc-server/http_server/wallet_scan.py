@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import json
+import gevent
+from .log import logger
+from . import config
+from . import rpc_call
+from . import hd_wallet
+
+
+def get_window(one_chain, start, size):
+    ''' [(index, address, scripthash, used)] of one window, None when electrumx failed '''
+    pairs = one_chain.get_range(start, start + size)
+    response = rpc_call.get_address_used_batch([one_script_hash for _, one_script_hash in pairs])
+    if len(response) != len(pairs):
+        return None
+    result = []
+    for one_response in response:
+        if 'error' in one_response:
+            logger.error("get_window one response has error, " + json.dumps(one_response))
+            return None
+        one_address, one_script_hash = pairs[one_response['id']]
+        result.append((start + one_response['id'], one_address, one_script_hash, one_response['result']))
+    return result
+
+
+def scan_chain(one_chain, gap_limit, max_addresses):
+    ''' used (index, address, scripthash) of one chain, stopping after gap_limit unused in a row;
+        the next window is already asked for while the current one is checked. None when electrumx failed '''
+    used = []
+    last_used = -1
+    start = 0
+    pending = gevent.spawn(get_window, one_chain, start, gap_limit)
+    while True:
+        next_pending = gevent.spawn(get_window, one_chain, start + gap_limit, gap_limit)
+        window = pending.get()
+        if window is None:
+            return None
+        for index, one_address, one_script_hash, one_used in window:
+            if one_used:
+                used.append((index, one_address, one_script_hash))
+                last_used = index
+        start += gap_limit
+        if start - 1 - last_used >= gap_limit or start >= max_addresses:
+            # a speculative window nobody needs is left to finish, it only warms the address cache
+            return used
+        pending = next_pending
+
+
+def scan(descriptor, gap_limit):
+    ''' gap limit discovery over every chain of an xpub or descriptor, then balances and unspents of the used addresses;
+        None when electrumx failed, ValueError for a descriptor that can not be used '''
+    script_type, xpub, chains = hd_wallet.parse_descriptor(descriptor)
+    cache = hd_wallet.get_cache()
+    max_addresses = config.config['hd_max_addresses']
+    jobs = [gevent.spawn(scan_chain, cache.get(script_type, xpub, path), gap_limit, max_addresses) for _, path in chains]
+    gevent.joinall(jobs, raise_error=True)
+    if any([one_job.value is None for one_job in jobs]):
+        return None
+
+    used = []
+    next_index = {}
+    for (chain_name, _), one_job in zip(chains, jobs):
+        for index, one_address, one_script_hash in one_job.value:
+            used.append((chain_name + '/' + str(index) if chain_name else str(index), one_address, one_script_hash))
+        next_index[chain_name] = one_job.value[-1][0] + 1 if one_job.value else 0
+
+    script_hash_list = [one_script_hash for _, _, one_script_hash in used]
+    balance_job = gevent.spawn(rpc_call.get_address_balance_batch, script_hash_list)
+    unspent_job = gevent.spawn(rpc_call.get_address_unspent_batch, script_hash_list)
+    gevent.joinall([balance_job, unspent_job], raise_error=True)
+
+    info = [{'address': one_address, 'path': path, 'balance': 0, 'unspents': []} for path, one_address, _ in used]
+    for one_response in balance_job.value:
+        if 'error' in one_response:
+            logger.error("scan get_address_balance_batch one response has error, " + json.dumps(one_response))
+            return None
+        one_balance = one_response['result']
+        info[one_response['id']]['balance'] = float(one_balance['confirmed']) + float(one_balance['unconfirmed'])
+    for one_response in unspent_job.value:
+        if 'error' in one_response:
+            logger.error("scan get_address_unspent_batch one response has error, " + json.dumps(one_response))
+            return None
+        for one_unspent in one_response['result']:
+            info[one_response['id']]['unspents'].append({'txid': one_unspent['tx_hash'], 'vout_index': one_unspent['tx_pos'], 'value': one_unspent['value']})
+    return {'type': script_type, 'addresses': info, 'next_index': next_index}
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+
+
+class WatchList:
+    ''' address -> subscribers from the notify hub, so matching a transaction costs one lookup per input and output '''
+
+    def __init__(self):
+        self.index = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def rebuild(self, subscription_list):
+        index = {}
+        for one_subscription in subscription_list:
+            index.setdefault(one_subscription['name'], []).append(one_subscription)
+        # swapped in at once, a match running meanwhile sees either the old or the new list
+        self.index = index
+        self.size = len(subscription_list)
+
+    def get(self, address):
+        return self.index.get(address, [])
@@ -1,23 +1,33 @@
 #!/usr/bin/env python3
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 
 # Import the fixer
 from werkzeug.contrib.fixers import ProxyFix
 
-from datetime import datetime
 from flask_cors import CORS
 
 import requests
 import time
 import json
-from operator import itemgetter
+import socket
+import signal
+import gevent
+from gevent.pywsgi import WSGIServer
+from gevent.pool import Pool
 
 from .log import logger
 from . import rpc_call
 from . import utility
 from . import error_info
 from . import config
+from . import tx_cache
+from . import prevout_index
+from . import history_index
+from . import address_sync
+from . import address_cache
+from . import hd_wallet
+from . import wallet_scan
 
 
 app = Flask(__name__)
@@ -28,6 +38,26 @@ app.wsgi_app = ProxyFix(app.wsgi_app)
 # cors handle
 CORS(app, supports_credentials=True)
 
+
+def is_stream_request():
+    ''' opt in with ?stream=1 or an Accept of application/x-ndjson '''
+    return '1' == request.args.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', '')
+
+
+def stream_response(address_list, address_dict, get_batch, get_info):
+    ''' ndjson, one line per result in address order, written as every upstream chunk completes;
+        at most electrumx_batch_parallel chunks are held at a time '''
+    chunk_size = config.config['electrumx_batch_size']
+    parallel = config.config['electrumx_batch_parallel']
+    chunks = [address_list[index:index + chunk_size] for index in range(0, len(address_list), chunk_size)]
+
+    def generate():
+        for chunk, response in zip(chunks, Pool(parallel).imap(get_batch, chunks, maxsize=parallel)):
+            lines = [json.dumps(one_info, ensure_ascii=False) + '\n' for one_info in get_info(chunk, address_dict, response)]
+            yield ''.join(lines)
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @app.route('/btc_price')
 def get_btc_price():
     url = 'https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&&vs_currencies=usd'
@@ -45,62 +75,62 @@ def get_btc_price():
  
 @app.route('/transaction/<txid>')
 def get_transaction(txid):
-    logger.info("get_transaction txid:" + txid)
-    one_response = rpc_call.get_transaction_by_txid(txid)
+    start_time = time.time()
+    one_response = utility.decode_transaction_batch([txid])[0]
     if 'error' in one_response:
         return jsonify(errno=one_response['error']['code'],
                    errmsg=one_response['error']['message'],
                    data={})
-    transaction = one_response['result']
-
-    # input info
-    input = []
-    input_value_sum = 0
-    input_txid_vout = utility.get_input_list_txid_vout(transaction)
-    for one_txid_vout in input_txid_vout:
-        one_txid_response = rpc_call.get_transaction_by_txid(one_txid_vout['txid'])
-        if 'error' in one_txid_response:
-            logger.error("get_transaction_by_txid response has error, " + json.dumps(one_txid_response))
-            continue
-        one_address, one_value = utility.get_index_output_address_value(one_txid_response['result'], one_txid_vout['vout'])
-        input.append({"from_address": one_address, "from_txid":one_txid_vout['txid'], "vin_index":one_txid_vout['vout'], "value": one_value})
-        input_value_sum += one_value
- 
-    # output info
-    output = []
-    output_value_sum = 0
-    output_length = len(transaction['vout'])
-    index = 0
-    while index < output_length:
-        one_address, one_value = utility.get_index_output_address_value(transaction, index)
-        output.append({'to_address': one_address, 'vout_index': index, 'value': one_value, 'type': transaction['vout'][index]['scriptPubKey']['type'], 'asm': transaction['vout'][index]['scriptPubKey']['asm']})
-        output_value_sum += one_value
-        index += 1
-
-    utc_time = ""
-    if 'blocktime' in transaction:
-        utc_time = datetime.utcfromtimestamp(transaction['blocktime']).isoformat() + '+0000'
-    
-    block_hash = ''
-    if 'blockhash' in transaction:
-        block_hash = transaction['blockhash']
+    info = one_response['result']
+    logger.info("get_transaction txid:" + txid + " inputs:" + str(len(info['inputs'])) + " cost:" + str(round(time.time() - start_time, 3)))
+
+    return jsonify(errno=error_info.SUCCESS,
+                   errmsg=error_info.error_message[error_info.SUCCESS],
+                   data=info)
+
+
+@app.route('/transactions', methods=['POST'])
+def get_transactions():
+    txid_batch = json.loads(request.get_data())
+    if not isinstance(txid_batch, list):
+        return jsonify(errno=error_info.PARAM_ERROR,
+                   errmsg=error_info.error_message[error_info.PARAM_ERROR],
+                   data=[])
+    if len(txid_batch) > config.config['transaction_batch_max_size']:
+        return jsonify(errno=error_info.RANGE_ERROR,
+                   errmsg=error_info.error_message[error_info.RANGE_ERROR],
+                   data=[])
 
-    confirmations = -1
-    if 'confirmations' in transaction:
-        confirmations = transaction['confirmations'] 
+    # a malformed txid is answered inline and never sent upstream
+    real_txid = [one_txid for one_txid in txid_batch if utility.check_txid(one_txid)]
+    start_time = time.time()
+    response = dict(zip(real_txid, utility.decode_transaction_batch(real_txid)))
+    logger.info("get_transactions transactions:" + str(len(real_txid)) + " cost:" + str(round(time.time() - start_time, 3)))
+
+    info = []
+    for one_txid in txid_batch:
+        one_response = response.get(one_txid) if isinstance(one_txid, str) else None
+        if one_response is None:
+            info.append({'txid': one_txid, 'errno': error_info.PARAM_ERROR, 'errmsg': error_info.error_message[error_info.PARAM_ERROR], 'data': {}})
+        elif 'error' in one_response:
+            info.append({'txid': one_txid, 'errno': one_response['error']['code'], 'errmsg': one_response['error']['message'], 'data': {}})
+        else:
+            info.append({'txid': one_txid, 'errno': error_info.SUCCESS, 'errmsg': error_info.error_message[error_info.SUCCESS], 'data': one_response['result']})
 
     return jsonify(errno=error_info.SUCCESS,
                    errmsg=error_info.error_message[error_info.SUCCESS],
-                   data={
-                       'txid': transaction['txid'],
-                       'blockhash': block_hash,
-                       'iscoinbase': utility.is_transaction_coinbase(transaction),
-                       'fee': input_value_sum - output_value_sum,
-                       'inputs': input,
-                       'outputs': output,
-                       'confirmations': confirmations,
-                       'blocktime': utc_time
-                   })
+                   data=info)
+
+
+def get_unspent_info(address_list, address_dict, response):
+    info = []
+    for one_response in response:
+        if 'error' in one_response:
+            logger.error("get_address_unspent_batch one response has error, " + json.dumps(one_response))
+            continue
+        for one_unspent in one_response['result']:
+            info.append({'address': address_dict[address_list[one_response['id']]], 'txid': one_unspent['tx_hash'], 'vout_index': one_unspent['tx_pos'], 'value': one_unspent['value']})
+    return info
 
 
 @app.route('/address/unspents', methods=['GET', 'POST'])
@@ -118,21 +148,11 @@ def get_unspents():
 
     # get unspents
     address_list, address_dict= utility.get_address_list_and_dict_hash_list_by_address(address)
-    info_temp = [None]*len(address_list)
+    if is_stream_request():
+        return stream_response(address_list, address_dict, rpc_call.get_address_unspent_batch, get_unspent_info)
     response = rpc_call.get_address_unspent_batch(address_list)
-    for one_response in response:
-        if 'error' in one_response:
-            logger.error("get_address_unspent_batch one response has error, " + json.dumps(one_response))
-            continue
-        for one_unspent in one_response['result']:
-            info_temp[one_response['id']] = {'address': address_dict[address_list[one_response['id']]], 'txid': one_unspent['tx_hash'], 'vout_index': one_unspent['tx_pos'], 'value': one_unspent['value']}
-    
-    # get real unspent
-    info = []
-    for one_info in info_temp:
-        if one_info is not None:
-            info.append(one_info)
-    
+    info = get_unspent_info(address_list, address_dict, response)
+
     return jsonify(errno=error_info.SUCCESS,
                    errmsg=error_info.error_message[error_info.SUCCESS],
                    data=info
@@ -166,6 +186,17 @@ def get_fee_rate():
     )
 
 
+def get_balance_info(address_list, address_dict, response):
+    info = [None]*len(address_list)
+    for one_response in response:
+        if 'error' in one_response:
+            logger.error("get_address_balance_batch one response has error, " + json.dumps(one_response))
+            continue
+        one_balance = one_response['result']
+        info[one_response['id']] = {'address': address_dict[address_list[one_response['id']]], 'balance': float(one_balance['confirmed']) + float(one_balance['unconfirmed'])} 
+    return info
+
+
 @app.route('/address/balance', methods=['GET', 'POST'])
 def get_balance():
     # check address
@@ -181,15 +212,10 @@ def get_balance():
 
     # get balance
     address_list, address_dict= utility.get_address_list_and_dict_hash_list_by_address(address)
+    if is_stream_request():
+        return stream_response(address_list, address_dict, rpc_call.get_address_balance_batch, get_balance_info)
     response = rpc_call.get_address_balance_batch(address_list)
-    info = [None]*len(address_list)
-
-    for one_response in response:
-        if 'error' in one_response:
-            logger.error("get_address_balance_batch one response has error, " + json.dumps(one_response))
-            continue
-        one_balance = one_response['result']
-        info[one_response['id']] = {'address': address_dict[address_list[one_response['id']]], 'balance': float(one_balance['confirmed']) + float(one_balance['unconfirmed'])} 
+    info = get_balance_info(address_list, address_dict, response)
 
     return jsonify(errno=error_info.SUCCESS,
                    errmsg=error_info.error_message[error_info.SUCCESS],
@@ -199,7 +225,7 @@ def get_balance():
 @app.route('/address/transactions', methods=['GET', 'POST'])
 def get_address_transactions():
     one_request = json.loads(request.get_data())
-    if one_request['size'] < 0 or one_request['page'] <= 0:
+    if one_request['size'] < 0 or one_request.get('page', 1) <= 0:
         return jsonify(errno=error_info.PARAM_ERROR,
                    errmsg=error_info.error_message[error_info.PARAM_ERROR],
                    data={}
@@ -216,65 +242,90 @@ def get_address_transactions():
                    errmsg=error_info.error_message[error_info.SUCCESS],
                    data={})
 
-    # get all transactions
-    all_transactions = []
+    # cached history of the whole address set, newest first
     address_list, address_dict= utility.get_address_list_and_dict_hash_list_by_address(address)
-    response = rpc_call.get_address_history_batch(address_list)
-    for one_response in response:
-        if 'error' in one_response:
-            continue
-        all_transactions = all_transactions + one_response['result']
-
-    if 0 == len(all_transactions):
-        return jsonify(errno=error_info.SUCCESS,
-                   errmsg=error_info.error_message[error_info.SUCCESS],
-                   data={}
-        )
-
-    # sort transaction
-    all_transactions.sort(key=itemgetter('height'), reverse=True)
-
-    index = len(all_transactions) - 1
-    while index >= 0 and all_transactions[index]['height'] == 0:
-        index = index - 1
-
-    if index >= 0:
-        all_transactions = all_transactions[index+1:] + all_transactions[0:index+1]
-
-    if one_request['size'] * (one_request['page'] -1) >= len(all_transactions):
+    history = history_index.get_index().get(address_list)
+
+    # an opaque cursor from the previous page wins over page
+    use_cursor = 'cursor' in one_request and one_request['cursor']
+    if use_cursor:
+        one_cursor = history_index.decode_cursor(one_request['cursor'])
+        if one_cursor is None or one_cursor[0] != history.key:
+            return jsonify(errno=error_info.PARAM_ERROR,
+                       errmsg=error_info.error_message[error_info.PARAM_ERROR],
+                       data={}
+            )
+        start = history.get_offset(one_cursor[1], one_cursor[2])
+    else:
+        start = one_request['size'] * (one_request.get('page', 1) - 1)
+
+    real_transaction, more = history.get_page(start, one_request['size'])
+    if 0 == len(real_transaction) and not use_cursor:
+        if 0 == start:
+            return jsonify(errno=error_info.SUCCESS,
+                       errmsg=error_info.error_message[error_info.SUCCESS],
+                       data={}
+            )
         return jsonify(errno=error_info.RANGE_ERROR,
                    errmsg=error_info.error_message[error_info.RANGE_ERROR],
                    data={}
         )
-   
-    real_transaction = []
-    if one_request['size'] * one_request['page'] > len(all_transactions):
-        real_transaction = all_transactions[one_request['size'] * (one_request['page'] - 1):]
-    else:
-        real_transaction = all_transactions[one_request['size'] * (one_request['page'] - 1):one_request['size'] * one_request['page'] - 1]
-    
+
     real_txid = []
     for one_transaction in real_transaction:
         real_txid.append(one_transaction['tx_hash'])
 
+    next_cursor = ''
+    if more:
+        next_cursor = history_index.encode_cursor(history.key, start + len(real_txid), real_txid[-1])
+
+    start_time = time.time()
     info_temp = utility.get_transaction_by_txid_batch(real_txid)
+    logger.info("get_address_transactions transactions:" + str(len(info_temp)) + " inputs:" + str(sum(len(one_info['inputs']) for one_info in info_temp)) + " cost:" + str(round(time.time() - start_time, 3)))
 
     # sort result
-    info = []
-    for one_txid in real_txid:
-        for one_info in info_temp:
-            if one_txid == one_info['txid']:
-                info.append(one_info)
+    info_dict = {}
+    for one_info in info_temp:
+        info_dict[one_info['txid']] = one_info
+    info = [info_dict[one_txid] for one_txid in real_txid if one_txid in info_dict]
 
     return jsonify(errno=error_info.SUCCESS,
                    errmsg=error_info.error_message[error_info.SUCCESS],
                    data={
-                       "pagination": {"page": one_request['page'], 'size': one_request['size']},
+                       "pagination": {"page": one_request.get('page', 1), 'size': one_request['size'], 'cursor': next_cursor},
                        "list":info
                    }
     )
 
 
+@app.route('/address/sync', methods=['GET', 'POST'])
+def get_address_sync():
+    one_request = json.loads(request.get_data())
+
+    # check address
+    address_temp = one_request['addresses']
+    address = []
+    for one_temp_address in address_temp:
+        if utility.check_address(one_temp_address):
+            address.append(one_temp_address)
+    if 0 == len(address):
+        return jsonify(errno=error_info.SUCCESS,
+                   errmsg=error_info.error_message[error_info.SUCCESS],
+                   data={})
+
+    address_list, address_dict= utility.get_address_list_and_dict_hash_list_by_address(address)
+    info = address_sync.get_sync(address_list, address_dict, one_request.get('token', ''))
+    if info is None:
+        return jsonify(errno=error_info.SOCKET_ERROR,
+                   errmsg=error_info.error_message[error_info.SOCKET_ERROR],
+                   data={})
+
+    return jsonify(errno=error_info.SUCCESS,
+                   errmsg=error_info.error_message[error_info.SUCCESS],
+                   data=info
+    )
+
+
 @app.route('/send_raw_transaction', methods=['GET', 'POST'])
 def send_raw_transaction():
     one_request = json.loads(request.get_data())
@@ -289,6 +340,17 @@ def send_raw_transaction():
     )
 
 
+def get_used_info(address_list, address_dict, response):
+    info = [None]*len(address_list)
+    for one_response in response:
+        if 'error' in one_response:
+            logger.error("get_address_used_batch one response has error, " + json.dumps(one_response))
+            info[one_response['id']] = {'address': address_dict[address_list[one_response['id']]], 'used': False}
+            continue
+        info[one_response['id']] = {'address': address_dict[address_list[one_response['id']]], 'used': one_response['result']}
+    return info
+
+
 @app.route('/address', methods=['GET', 'POST'])
 def get_address_used():
     # check address
@@ -304,15 +366,40 @@ def get_address_used():
 
     # get address used           
     address_list, address_dict= utility.get_address_list_and_dict_hash_list_by_address(address)
+    if is_stream_request():
+        return stream_response(address_list, address_dict, rpc_call.get_address_used_batch, get_used_info)
     response = rpc_call.get_address_used_batch(address_list)
-    info = [None]*len(address_list)
+    info = get_used_info(address_list, address_dict, response)
+
+    return jsonify(errno=error_info.SUCCESS,
+                   errmsg=error_info.error_message[error_info.SUCCESS],
+                   data=info
+    )
 
-    for one_response in response:
-        if 'error' in one_response:
-            logger.error("get_address_used_batch one response has error, " + json.dumps(one_response))
-            info.append({'address': address_dict[address_list[one_response['id']]], 'used': False})
-            continue
-        info[one_response['id']] = {'address': address_dict[address_list[one_response['id']]], 'used': one_response['result']}
+
+@app.route('/wallet/scan', methods=['GET', 'POST'])
+def get_wallet_scan():
+    one_request = json.loads(request.get_data())
+    gap_limit = one_request.get('gap_limit', config.config['hd_gap_limit'])
+    descriptor = one_request.get('descriptor', one_request.get('xpub', ''))
+    if not isinstance(gap_limit, int) or gap_limit <= 0 or gap_limit > config.config['hd_max_gap_limit'] or not descriptor:
+        return jsonify(errno=error_info.PARAM_ERROR,
+                   errmsg=error_info.error_message[error_info.PARAM_ERROR],
+                   data={})
+
+    start_time = time.time()
+    try:
+        info = wallet_scan.scan(descriptor, gap_limit)
+    except ValueError as e:
+        logger.error("get_wallet_scan invalid descriptor: " + str(e))
+        return jsonify(errno=error_info.PARAM_ERROR,
+                   errmsg=error_info.error_message[error_info.PARAM_ERROR],
+                   data={})
+    if info is None:
+        return jsonify(errno=error_info.SOCKET_ERROR,
+                   errmsg=error_info.error_message[error_info.SOCKET_ERROR],
+                   data={})
+    logger.info("get_wallet_scan used:" + str(len(info['addresses'])) + " cost:" + str(round(time.time() - start_time, 3)))
 
     return jsonify(errno=error_info.SUCCESS,
                    errmsg=error_info.error_message[error_info.SUCCESS],
@@ -320,9 +407,52 @@ def get_address_used():
     )
 
 
+@app.route('/stats')
+def get_stats():
+    return jsonify(errno=error_info.SUCCESS,
+                   errmsg=error_info.error_message[error_info.SUCCESS],
+                   data={'transaction_cache': tx_cache.get_cache().get_counter(),
+                         'decoded_cache': tx_cache.get_decoded_cache().get_counter(),
+                         'prevout_index': prevout_index.get_index().get_counter(),
+                         'history_index': history_index.get_index().get_counter(),
+                         'address_cache': address_cache.get_cache().get_counter(),
+                         'scripthash_cache': utility.get_script_hash.cache_info()._asdict(),
+                         'derivation_cache': hd_wallet.get_cache().get_counter(),
+                         'single_flight': rpc_call.single_flight_counter}
+    )
+
+
 def http_task():
     global app
     app.run(host = '0.0.0.0', port=config.config['listen_port'], debug = True)
 
+
+def create_listener():
+    ''' one listen socket created by the supervisor and shared by every forked worker '''
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('0.0.0.0', config.config['listen_port']))
+    listener.listen(config.config['http_backlog'])
+    return listener
+
+
+def http_worker_task(listener):
+    ''' production worker: gevent wsgi server on the shared socket, recycled after http_worker_max_requests '''
+    served = {'count': 0}
+    max_requests = config.config['http_worker_max_requests']
+
+    def recycle_app(environ, start_response):
+        served['count'] += 1
+        if served['count'] == max_requests:
+            logger.info("http worker served " + str(max_requests) + " requests, recycle")
+            gevent.spawn(server.stop, config.config['http_graceful_timeout'])
+        return app(environ, start_response)
+
+    server = WSGIServer(listener, recycle_app, log=None)
+    server.start()
+    # SIGTERM from the supervisor: stop accepting, let running requests finish
+    signal.signal(signal.SIGTERM, lambda signum, frame: gevent.spawn(server.stop, config.config['http_graceful_timeout']))
+    server.serve_forever()
+
 if __name__ == '__main__':
     http_task()
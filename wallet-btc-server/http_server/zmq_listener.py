@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import struct
+import gevent
+from .log import logger
+
+# pyzmq is optional, without it the notifier only polls
+try:
+    import zmq.green as zmq
+except ImportError:
+    zmq = None
+
+
+class ZmqListener:
+    ''' bitcoind zmq publisher -> handler(topic, body) per message; on_gap() whenever messages were lost,
+        i.e. a sequence number was skipped or the listener just (re)started '''
+
+    def __init__(self, address, handlers, on_gap):
+        self.address = address
+        self.handlers = handlers
+        self.on_gap = on_gap
+        self.sequence = {}
+
+    def is_gap(self, topic, sequence_frame):
+        if 4 != len(sequence_frame):
+            return False
+        sequence = struct.unpack('<I', sequence_frame)[0]
+        last_sequence = self.sequence.get(topic)
+        self.sequence[topic] = sequence
+        return last_sequence is not None and sequence != (last_sequence + 1) & 0xffffffff
+
+    def run(self):
+        context = zmq.Context.instance()
+        subscriber = context.socket(zmq.SUB)
+        for topic in self.handlers:
+            subscriber.setsockopt(zmq.SUBSCRIBE, topic.encode())
+        # zmq reconnects by itself, a message lost meanwhile shows up as a sequence gap
+        subscriber.connect(self.address)
+        logger.info("zmq listener connected " + self.address + ", topics: " + ','.join(self.handlers))
+        gevent.spawn(self.on_gap)
+        while True:
+            frames = subscriber.recv_multipart()
+            if len(frames) < 2:
+                continue
+            topic = frames[0].decode(errors='replace')
+            handler = self.handlers.get(topic)
+            if handler is None:
+                continue
+            if 3 <= len(frames) and self.is_gap(topic, frames[2]):
+                logger.error("zmq listener " + topic + " sequence gap")
+                gevent.spawn(self.on_gap)
+            try:
+                handler(topic, frames[1])
+            except Exception as e:
+                logger.error("zmq listener " + topic + " handler failed: " + str(e))
+
+
+def start(address, handlers, on_gap):
+    ''' the listener greenlet, None when pyzmq is missing '''
+    if zmq is None:
+        logger.error("zmq_address is set but pyzmq is not installed, only polling is used")
+        return None
+    return gevent.spawn(ZmqListener(address, handlers, on_gap).run)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import unittest
+from http_server import address
+
+
+# bip173 / bip350 valid mainnet addresses -> output script
+VALID_SEGWIT = [
+    ('BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4', '0014751e76e8199196d454941c45d1b3a323f1433bd6'),
+    ('bc1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3qccfmv3', '00201863143c14c5166804bd19203356da136c985678cd4d27a1b8c6329604903262'),
+    ('bc1pw508d6qejxtdg4y5r3zarvary0c5xw7kw508d6qejxtdg4y5r3zarvary0c5xw7kt5nd6y',
+     '5128751e76e8199196d454941c45d1b3a323f1433bd6751e76e8199196d454941c45d1b3a323f1433bd6'),
+    ('BC1SW50QGDZ25J', '6002751e'),
+    ('bc1zw508d6qejxtdg4y5r3zarvaryvaxxpcs', '5210751e76e8199196d454941c45d1b3a323'),
+    ('bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0', '512079be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'),
+]
+
+# bip173 / bip350 invalid addresses
+INVALID_SEGWIT = [
+    # testnet
+    'tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sl5k7',
+    'tb1pqqqqp399et2xygdj5xreqhjjvcmzhxw4aywxecjdzew6hylgvsesf3hn0c',
+    # bech32 checksum on witness v1 and later
+    'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqh2y7hd',
+    'BC1S0XLXVLHEMJA6C4DQV22UAPCTQUPFHLXM9H8Z3K2E72Q4K9HCZ7VQ54WELL',
+    # bech32m checksum on witness v0
+    'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kemeawh',
+    # invalid character
+    'bc1p38j9r5y49hruaue7wxjce0updqjuyyx0kh56v8s25huc6995vvpql3jow4',
+    # witness version 17
+    'BC130XLXVLHEMJA6C4DQV22UAPCTQUPFHLXM9H8Z3K2E72Q4K9HCZ7VQ7ZWS8R',
+    # program of 1 and 41 bytes
+    'bc1pw5dgrnzv',
+    'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7v8n0nx0muaewav253zgeav',
+    # witness v0 program of 16 bytes
+    'BC1QR508D6QEJXTDG4Y5R3ZARVARYV98GJ9P',
+    # mixed case
+    'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vq47Zagq',
+    # more than 4 padding bits, non zero padding
+    'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7v07qwwzcrf',
+    'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vpggkg4j',
+    # empty data section
+    'bc1gmk9yu',
+]
+
+VALID_BASE58 = [
+    ('1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2', '76a91477bff20c60e522dfaa3350c39b030a5d004e839a88ac'),
+    ('3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy', 'a914b472a266d0bd89c13706a4132ccfb16f7c3b9fcb87'),
+]
+
+INVALID_BASE58 = [
+    # checksum
+    '1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN3',
+    '3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLz',
+    # character outside the alphabet
+    '1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN0',
+    # testnet version
+    'mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn',
+    '',
+]
+
+
+class TestAddress(unittest.TestCase):
+
+    def test_valid_segwit(self):
+        for one_address, script_hex in VALID_SEGWIT:
+            self.assertEqual(address.address_to_script(one_address), bytes.fromhex(script_hex), one_address)
+
+    def test_invalid_segwit(self):
+        for one_address in INVALID_SEGWIT:
+            self.assertIsNone(address.address_to_script(one_address), one_address)
+
+    def test_valid_base58(self):
+        for one_address, script_hex in VALID_BASE58:
+            self.assertEqual(address.address_to_script(one_address), bytes.fromhex(script_hex), one_address)
+
+    def test_invalid_base58(self):
+        for one_address in INVALID_BASE58:
+            self.assertIsNone(address.address_to_script(one_address), one_address)
+
+    def test_script_to_address(self):
+        # the encoder writes lowercase, every type maps back to its address
+        for one_address, script_hex in VALID_BASE58 + VALID_SEGWIT:
+            _, addresses = address.script_to_address(bytes.fromhex(script_hex))
+            expected = one_address.lower() if one_address.lower().startswith('bc1') else one_address
+            self.assertEqual(addresses, [expected], script_hex)
+
+    def test_script_type(self):
+        expected = ['pubkeyhash', 'scripthash', 'witness_v0_keyhash', 'witness_v0_scripthash', 'witness_unknown',
+                    'witness_unknown', 'witness_unknown', 'witness_v1_taproot']
+        scripts = [script_hex for _, script_hex in VALID_BASE58 + VALID_SEGWIT]
+        self.assertEqual([address.script_to_address(bytes.fromhex(script_hex))[0] for script_hex in scripts], expected)
+
+    def test_script_hash(self):
+        # electrumx protocol documentation example
+        script = address.address_to_script('1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa')
+        self.assertEqual(script.hex(), '76a91462e907b15cbf27d5425399ebf6f0fb50ebb88f1888ac')
+        self.assertEqual(address.get_script_hash(script), '8b01df4e368ea28f8dc0423bcf7a4923e3a12d307c875e47a0cfbf90b5c39161')
+
+
+if __name__ == '__main__':
+    unittest.main()
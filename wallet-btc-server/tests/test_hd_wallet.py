@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+from http_server import hd_wallet
+from http_server import wallet_scan
+
+
+# bip32 test vector 2, every public step: (parent, child index, child)
+BIP32_VECTOR_2 = [
+    ('xpub661MyMwAqRbcFW31YEwpkMuc5THy2PSt5bDMsktWQcFF8syAmRUapSCGu8ED9W6oDMSgv6Zz8idoc4a6mr8BDzTJY47LJhkJ8UB7WEGuduB', 0,
+     'xpub69H7F5d8KSRgmmdJg2KhpAK8SR3DjMwAdkxj3ZuxV27CprR9LgpeyGmXUbC6wb7ERfvrnKZjXoUmmDznezpbZb7ap6r1D3tgFxHmwMkQTPH'),
+    ('xpub6ASAVgeehLbnwdqV6UKMHVzgqAG8Gr6riv3Fxxpj8ksbH9ebxaEyBLZ85ySDhKiLDBrQSARLq1uNRts8RuJiHjaDMBU4Zn9h8LZNnBC5y4a', 1,
+     'xpub6DF8uhdarytz3FWdA8TvFSvvAh8dP3283MY7p2V4SeE2wyWmG5mg5EwVvmdMVCQcoNJxGoWaU9DCWh89LojfZ537wTfunKau47EL2dhHKon'),
+    ('xpub6ERApfZwUNrhLCkDtcHTcxd75RbzS1ed54G1LkBUHQVHQKqhMkhgbmJbZRkrgZw4koxb5JaHWkY4ALHY2grBGRjaDMzQLcgJvLJuZZvRcEL', 2,
+     'xpub6FnCn6nSzZAw5Tw7cgR9bi15UV96gLZhjDstkXXxvCLsUXBGXPdSnLFbdpq8p9HmGsApME5hQTZ3emM2rnY5agb9rXpVGyy3bdW6EEgAtqt'),
+]
+
+# account keys of the "abandon ... about" mnemonic from bip44 / bip49 / bip84 / bip86 -> first receive address
+BIP44_XPUB = 'xpub6BosfCnifzxcFwrSzQiqu2DBVTshkCXacvNsWGYJVVhhawA7d4R5WSWGFNbi8Aw6ZRc1brxMyWMzG3DSSSSoekkudhUd9yLb6qx39T9nMdj'
+BIP49_YPUB = 'ypub6Ww3ibxVfGzLrAH1PNcjyAWenMTbbAosGNB6VvmSEgytSER9azLDWCxoJwW7Ke7icmizBMXrzBx9979FfaHxHcrArf3zbeJJJUZPf663zsP'
+BIP84_ZPUB = 'zpub6rFR7y4Q2AijBEqTUquhVz398htDFrtymD9xYYfG1m4wAcvPhXNfE3EfH1r1ADqtfSdVCToUG868RvUUkgDKf31mGDtKsAYz2oz2AGutZYs'
+# the bip84 account key above with the xpub version, as descriptors carry it
+BIP84_XPUB = 'xpub6CatWdiZiodmUeTDp8LT5or8nmbKNcuyvz7WyksVFkKB4RHwCD3XyuvPEbvqAQY3rAPshWcMLoP2fMFMKHPJ4ZeZXYVUhLv1VMrjPC7PW6V'
+BIP86_XPUB = 'xpub6BgBgsespWvERF3LHQu6CnqdvfEvtMcQjYrcRzx53QJjSxarj2afYWcLteoGVky7D3UKDP9QyrLprQ3VCECoY49yfdDEHGCtMMj92pReUsQ'
+FIRST_ADDRESS = [
+    ('pkh', BIP44_XPUB, '1LqBGSKuX5yYUonjxT5qGfpUsXKYYWeabA'),
+    ('sh-wpkh', BIP49_YPUB, '37VucYSaXLCAsxYyAPfbSi9eh4iEcbShgf'),
+    ('wpkh', BIP84_ZPUB, 'bc1qcr8te4kr609gcawutmrza0j4xv80jy8z306fyu'),
+    ('tr', BIP86_XPUB, 'bc1p5cyxnuxmeuwuvkwfem96lqzszd02n6xdcjrs20cac6yqjjwudpxqkedrcr'),
+]
+
+
+class TestDerivation(unittest.TestCase):
+
+    def test_bip32_vector_2(self):
+        for parent, index, child in BIP32_VECTOR_2:
+            derived = hd_wallet.parse_xpub(parent)[1].child(index)
+            expected = hd_wallet.parse_xpub(child)[1]
+            self.assertEqual((derived.point, derived.chain_code), (expected.point, expected.chain_code), child)
+
+    def test_hardened_child(self):
+        node = hd_wallet.parse_xpub(BIP32_VECTOR_2[0][0])[1]
+        with self.assertRaises(ValueError):
+            node.child(0x80000000)
+
+    def test_first_receive_address(self):
+        for script_type, xpub, expected in FIRST_ADDRESS:
+            one_chain = hd_wallet.DerivedChain(script_type, hd_wallet.parse_xpub(xpub)[1].child(0))
+            self.assertEqual(one_chain.get_range(0, 1)[0][0], expected, script_type)
+
+    def test_cache(self):
+        cache = hd_wallet.DerivationCache(2, 100)
+        one_chain = cache.get('wpkh', BIP84_ZPUB, [0])
+        self.assertIs(cache.get('wpkh', BIP84_ZPUB, [0]), one_chain)
+        self.assertEqual(one_chain.get_range(0, 1)[0][0], FIRST_ADDRESS[2][2])
+        cache.get('wpkh', BIP84_ZPUB, [1])
+        cache.get('pkh', BIP44_XPUB, [0])
+        self.assertEqual(cache.get_counter()['entries'], 2)
+        self.assertEqual(cache.get_counter()['eviction'], 1)
+
+
+class TestDescriptor(unittest.TestCase):
+
+    def test_extended_public_key(self):
+        self.assertEqual(hd_wallet.parse_descriptor(BIP84_ZPUB), ('wpkh', BIP84_ZPUB, [('0', [0]), ('1', [1])]))
+        self.assertEqual(hd_wallet.parse_descriptor(' ' + BIP49_YPUB + '\n')[0], 'sh-wpkh')
+        self.assertEqual(hd_wallet.parse_descriptor(BIP44_XPUB)[0], 'pkh')
+
+    def test_descriptor(self):
+        text = 'wpkh([73c5da0a/84h/0h/0h]' + BIP84_XPUB + '/<0;1>/*)'
+        expected = ('wpkh', BIP84_XPUB, [('0', [0]), ('1', [1])])
+        self.assertEqual(hd_wallet.parse_descriptor(text), expected)
+        self.assertEqual(hd_wallet.parse_descriptor(text + '#' + hd_wallet.get_descriptor_checksum(text)), expected)
+        self.assertEqual(hd_wallet.parse_descriptor('sh(wpkh(' + BIP49_YPUB + '/0/*))'), ('sh-wpkh', BIP49_YPUB, [('0', [0])]))
+        self.assertEqual(hd_wallet.parse_descriptor('tr(' + BIP86_XPUB + '/1/*)'), ('tr', BIP86_XPUB, [('1', [1])]))
+
+    def test_descriptor_checksum(self):
+        # bip380 examples
+        self.assertEqual(hd_wallet.get_descriptor_checksum('raw(deadbeef)'), '89f8spxm')
+        self.assertEqual(hd_wallet.get_descriptor_checksum('addr(mkmZxiEcEd8ZqjQWVZuC6so5dFMKEFpN2j)'), '02wpgw69')
+        self.assertIsNone(hd_wallet.get_descriptor_checksum('wpkh(é)'))
+
+    def test_invalid(self):
+        text = 'pkh(' + BIP44_XPUB + '/<0;1>/*)'
+        checksum = hd_wallet.get_descriptor_checksum(text)
+        invalid = [
+            # descriptor checksum
+            text + '#' + checksum[:-1] + ('q' if checksum[-1] != 'q' else 'p'),
+            text + '#' + checksum[:-1],
+            # base58 checksum of the key
+            BIP84_ZPUB[:-1] + ('1' if BIP84_ZPUB[-1] != '1' else '2'),
+            'pkh(' + BIP44_XPUB[:-1] + '1/0/*)',
+            # hardened steps after the key
+            'wpkh(' + BIP84_XPUB + '/0h/*)',
+            'wpkh(' + BIP84_XPUB + "/0'/*)",
+            'wpkh(' + BIP84_XPUB + '/0/*h)',
+            # unsupported or unbalanced
+            'sh(wpkh(' + BIP49_YPUB + '/0/*)',
+            'wsh(' + BIP84_XPUB + '/0/*)',
+            '',
+        ]
+        for one_text in invalid:
+            with self.assertRaises(ValueError, msg=one_text):
+                hd_wallet.parse_descriptor(one_text)
+
+
+class TestScan(unittest.TestCase):
+    ''' gap limit discovery against a stand-in for the electrumx has_used batch '''
+
+    def setUp(self):
+        self.chain = hd_wallet.DerivedChain('wpkh', hd_wallet.parse_xpub(BIP84_ZPUB)[1].child(0))
+        self.script_hash = [one_script_hash for _, one_script_hash in self.chain.get_range(0, 40)]
+        self.used = set()
+        self.requested = []
+        patcher = mock.patch.object(wallet_scan.rpc_call, 'get_address_used_batch', self.get_address_used_batch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_address_used_batch(self, script_hash_batch):
+        self.requested.extend(script_hash_batch)
+        return [{'id': index, 'result': one_script_hash in self.used} for index, one_script_hash in enumerate(script_hash_batch)]
+
+    def test_gap_limit(self):
+        self.used = set([self.script_hash[index] for index in (0, 3, 9)])
+        used = wallet_scan.scan_chain(self.chain, 5, 1000)
+        self.assertEqual([index for index, _, _ in used], [0, 3, 9])
+        self.assertEqual([one_script_hash for _, _, one_script_hash in used], [self.script_hash[index] for index in (0, 3, 9)])
+        # 10..14 were unused, at most the speculative window 15..19 was asked for beyond them
+        self.assertLessEqual(set(self.script_hash[:15]), set(self.requested))
+        self.assertLessEqual(set(self.requested), set(self.script_hash[:20]))
+
+    def test_nothing_used(self):
+        self.assertEqual(wallet_scan.scan_chain(self.chain, 5, 1000), [])
+
+    def test_max_addresses(self):
+        self.used = set(self.script_hash)
+        used = wallet_scan.scan_chain(self.chain, 5, 10)
+        self.assertEqual([index for index, _, _ in used], list(range(10)))
+
+    def test_electrumx_error(self):
+        with mock.patch.object(wallet_scan.rpc_call, 'get_address_used_batch',
+                               lambda script_hash_batch: [{'id': 0, 'error': {'code': -1, 'message': 'stand-in'}}]):
+            self.assertIsNone(wallet_scan.scan_chain(self.chain, 5, 1000))
+
+    def test_scan(self):
+        self.used = set([self.script_hash[2]])
+        balance = lambda script_hash_batch: [{'id': index, 'result': {'confirmed': 1000, 'unconfirmed': 5}}
+                                             for index in range(len(script_hash_batch))]
+        unspent = lambda script_hash_batch: [{'id': index, 'result': [{'tx_hash': 'ab' * 32, 'tx_pos': 1, 'value': 1005}]}
+                                             for index in range(len(script_hash_batch))]
+        with mock.patch.object(wallet_scan.rpc_call, 'get_address_balance_batch', balance), \
+             mock.patch.object(wallet_scan.rpc_call, 'get_address_unspent_batch', unspent):
+            info = wallet_scan.scan(BIP84_ZPUB, 5)
+        self.assertEqual(info['type'], 'wpkh')
+        self.assertEqual(info['next_index'], {'0': 3, '1': 0})
+        self.assertEqual(info['addresses'], [{'address': self.chain.get_range(2, 3)[0][0], 'path': '0/2', 'balance': 1005.0,
+                                              'unspents': [{'txid': 'ab' * 32, 'vout_index': 1, 'value': 1005}]}])
+
+
+if __name__ == '__main__':
+    unittest.main()
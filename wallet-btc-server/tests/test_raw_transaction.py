@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import struct
+import unittest
+from http_server import address
+from http_server import raw_transaction
+
+
+# block 170, the first transaction spending a coinbase; two pay to pubkey outputs
+LEGACY_HEX = ('0100000001c997a5e56e104102fa209c6a852dd90660a20b2d9c352423edce25857fcd3704000000004847304402204e45e16932b8af51'
+              '4961a1d3a1a25fdf3f4f7732e9d624c6c61548ab5fb8cd410220181522ec8eca07de4860a4acdd12909d831cc56cbbac4622082221a8'
+              '768d1d0901ffffffff0200ca9a3b00000000434104ae1a62fe09c5f51b13905f07f06b99a2f7159b2225f374cd378d71302fa28414e7'
+              'aab37397f554a7df5f142c21c1b7303b8a0626f1baded5c72a704f7e6cd84cac00286bee0000000043410411db93e1dcdb8a016b4984'
+              '0f8c53bc1eb68a382e97b1482ecad7b148a6909a5cb2e0eaddfb84ccf9744464f82e160bfa9b8b64f9d4c03f999b8643f656b412a3ac'
+              '00000000')
+
+# bip143 native p2wpkh example: a legacy p2pk input, a segwit input, two p2pkh outputs
+SEGWIT_HEX = ('01000000000102fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f00000000494830450221008b9d1dc2'
+              '6ba6a9cb62127b02742fa9d754cd3bebf337f7a55d114c8e5cdd30be022040529b194ba3f9281a99f2b1c0a19c0489bc22ede944ccf4'
+              'ecbab4cc618ef3ed01eeffffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff'
+              '02202cb206000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4d'
+              'be6a21b2d50ce2f0167faa815988ac000247304402203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366d7f01cc44a'
+              '0220573a954c4518331561406f90300e8f3358f51928d43c212a8caed02de67eebee0121025476c2e83188368da1ff3e292e7acafcdb'
+              '3566bb0ad253f62fc70f07aeee635711000000')
+
+# the same transaction without marker, flag and witness, which is what its txid covers
+SEGWIT_STRIPPED_HEX = SEGWIT_HEX[:8] + SEGWIT_HEX[12:SEGWIT_HEX.index('88ac000247') + 4] + SEGWIT_HEX[-8:]
+
+# address -> output script, one of every type
+OUTPUT_SCRIPTS = [
+    ('1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2', 'pubkeyhash', '76a91477bff20c60e522dfaa3350c39b030a5d004e839a88ac'),
+    ('3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy', 'scripthash', 'a914b472a266d0bd89c13706a4132ccfb16f7c3b9fcb87'),
+    ('bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4', 'witness_v0_keyhash', '0014751e76e8199196d454941c45d1b3a323f1433bd6'),
+    ('bc1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3qccfmv3', 'witness_v0_scripthash',
+     '00201863143c14c5166804bd19203356da136c985678cd4d27a1b8c6329604903262'),
+    ('bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0', 'witness_v1_taproot',
+     '512079be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'),
+]
+
+
+def get_output_transaction():
+    ''' one input, one output per script type, valued 1000, 1001, ... satoshi '''
+    raw = struct.pack('<I', 2) + b'\x01' + bytes(range(32)) + struct.pack('<I', 3) + b'\x00' + struct.pack('<I', 0xfffffffd)
+    raw += bytes([len(OUTPUT_SCRIPTS)])
+    for index, (_, _, script_hex) in enumerate(OUTPUT_SCRIPTS):
+        raw += struct.pack('<Q', 1000 + index) + bytes([len(script_hex) // 2]) + bytes.fromhex(script_hex)
+    return (raw + struct.pack('<I', 0)).hex()
+
+
+class TestRawTransaction(unittest.TestCase):
+
+    def test_legacy(self):
+        transaction = raw_transaction.deserialize(LEGACY_HEX)
+        self.assertEqual(transaction['txid'], 'f4184fc596403b9d638783cf57adfe4c75c605f6356fbc91338530e9831e9e16')
+        self.assertEqual(transaction['hash'], transaction['txid'])
+        self.assertEqual((transaction['version'], transaction['locktime'], transaction['size'], transaction['vsize']), (1, 0, 275, 275))
+
+        self.assertEqual(len(transaction['vin']), 1)
+        one_input = transaction['vin'][0]
+        self.assertEqual((one_input['txid'], one_input['vout'], one_input['sequence']),
+                         ('0437cd7f8525ceed2324359c2d0ba26006d92d856a9c20fa0241106ee5a597c9', 0, 0xffffffff))
+        self.assertEqual(one_input['scriptSig']['asm'], LEGACY_HEX[86:228])
+        self.assertNotIn('txinwitness', one_input)
+
+        self.assertEqual([one_output['n'] for one_output in transaction['vout']], [0, 1])
+        self.assertEqual([one_output['value_satoshi'] for one_output in transaction['vout']], [1000000000, 4000000000])
+        self.assertEqual([one_output['value'] for one_output in transaction['vout']], [10, 40])
+        self.assertEqual([one_output['scriptPubKey']['type'] for one_output in transaction['vout']], ['pubkey', 'pubkey'])
+        self.assertEqual([one_output['scriptPubKey']['addresses'] for one_output in transaction['vout']],
+                         [['1Q2TWHE3GMdB6BZKafqwxXtWAWgFt5Jvm3'], ['12cbQLTFMXRnSzktFkuoG3eHoMeFtpTu3S']])
+
+    def test_segwit(self):
+        transaction = raw_transaction.deserialize(SEGWIT_HEX)
+        self.assertEqual(transaction['txid'], address.double_sha256(bytes.fromhex(SEGWIT_STRIPPED_HEX))[::-1].hex())
+        self.assertEqual(transaction['txid'], 'e8151a2af31c368a35053ddd4bdb285a8595c769a3ad83e0fa02314a602d4609')
+        self.assertEqual(transaction['hash'], address.double_sha256(bytes.fromhex(SEGWIT_HEX))[::-1].hex())
+        # 233 bytes without the witness, 343 with it
+        self.assertEqual((transaction['version'], transaction['locktime'], transaction['size'], transaction['vsize']), (1, 17, 343, 261))
+
+        self.assertEqual([(one_input['txid'], one_input['vout'], one_input['sequence']) for one_input in transaction['vin']],
+                         [('9f96ade4b41d5433f4eda31e1738ec2b36f6e7d1420d94a6af99801a88f7f7ff', 0, 0xffffffee),
+                          ('8ac60eb9575db5b2d987e29f301b5b819ea83a5c6579d282d189cc04b8e151ef', 1, 0xffffffff)])
+        self.assertEqual(transaction['vin'][0]['txinwitness'], [])
+        self.assertEqual(transaction['vin'][1]['scriptSig'], {'asm': '', 'hex': ''})
+        self.assertEqual([len(one_item) // 2 for one_item in transaction['vin'][1]['txinwitness']], [71, 33])
+
+        self.assertEqual([one_output['value_satoshi'] for one_output in transaction['vout']], [112340000, 223450000])
+        self.assertEqual([one_output['scriptPubKey']['type'] for one_output in transaction['vout']], ['pubkeyhash', 'pubkeyhash'])
+        self.assertEqual([one_output['scriptPubKey']['asm'] for one_output in transaction['vout']],
+                         ['OP_DUP OP_HASH160 8280b37df378db99f66f85c95a783a76ac7a6d59 OP_EQUALVERIFY OP_CHECKSIG',
+                          'OP_DUP OP_HASH160 3bde42dbee7e4dbe6a21b2d50ce2f0167faa8159 OP_EQUALVERIFY OP_CHECKSIG'])
+        self.assertEqual([one_output['scriptPubKey']['addresses'] for one_output in transaction['vout']],
+                         [['1Cu32FVupVCgHkMMRJdYJugxwo2Aprgk7H'], ['16TZ8J6Q5iZKBWizWzFAYnrsaox5Z5aBRV']])
+
+    def test_output_types(self):
+        transaction = raw_transaction.deserialize(get_output_transaction())
+        self.assertEqual(transaction['vin'][0]['txid'], bytes(range(32))[::-1].hex())
+        self.assertEqual([one_output['value_satoshi'] for one_output in transaction['vout']],
+                         [1000 + index for index in range(len(OUTPUT_SCRIPTS))])
+        self.assertEqual([(one_output['scriptPubKey']['addresses'][0], one_output['scriptPubKey']['type'], one_output['scriptPubKey']['hex'])
+                          for one_output in transaction['vout']], OUTPUT_SCRIPTS)
+
+    def test_invalid(self):
+        invalid = [
+            '',
+            'zz',
+            # truncated inside the version, an input, an output and the locktime
+            LEGACY_HEX[:6],
+            LEGACY_HEX[:100],
+            LEGACY_HEX[:300],
+            LEGACY_HEX[:-2],
+            # truncated inside the witness
+            SEGWIT_HEX[:-40],
+            # trailing data
+            LEGACY_HEX + '00',
+            SEGWIT_HEX + 'ff',
+            # an input count far beyond the data
+            '01000000fd00ff',
+        ]
+        for raw_hex in invalid:
+            with self.assertRaises(ValueError, msg=raw_hex[:20]):
+                raw_transaction.deserialize(raw_hex)
+
+
+if __name__ == '__main__':
+    unittest.main()
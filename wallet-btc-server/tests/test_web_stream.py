@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import struct
+import unittest
+from unittest import mock
+import gevent
+from http_server import config
+from http_server import address
+
+# flask and werkzeug as pinned in requirements.txt
+try:
+    from http_server import web
+except ImportError:
+    web = None
+
+
+def get_address(index):
+    return address.script_to_address(b'\x76\xa9\x14' + struct.pack('>I', index) * 5 + b'\x88\xac')[1][0]
+
+
+@unittest.skipIf(web is None, "flask or werkzeug of requirements.txt is not installed")
+class TestStream(unittest.TestCase):
+    ''' ndjson against a stand-in upstream that takes a while for every chunk '''
+
+    CHUNK_SIZE = 5
+    CHUNK_COUNT = 20
+    CHUNK_TIME = 0.05
+
+    def setUp(self):
+        self.address_list = [get_address(index) for index in range(self.CHUNK_SIZE * self.CHUNK_COUNT)]
+        self.resolved = []
+        patcher = mock.patch.dict(config.config, {'electrumx_batch_size': self.CHUNK_SIZE, 'electrumx_batch_parallel': 2})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = web.app.test_client()
+
+    def get_balance_batch(self, script_hash_batch):
+        gevent.sleep(self.CHUNK_TIME)
+        self.resolved.extend(script_hash_batch)
+        return [{'id': index, 'result': {'confirmed': 100, 'unconfirmed': 1}} for index in range(len(script_hash_batch))]
+
+    def read_stream(self, url, get_batch_name):
+        ''' -> (seconds to the first line, seconds to the end, results resolved at the first line, lines) '''
+        start_time = time.time()
+        with mock.patch.object(web.rpc_call, get_batch_name, self.get_balance_batch):
+            response = self.client.post(url, data=json.dumps(self.address_list), buffered=False)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            first_time = None
+            resolved_at_first = None
+            body = b''
+            for one_chunk in response.iter_encoded():
+                if first_time is None and one_chunk:
+                    first_time = time.time() - start_time
+                    resolved_at_first = len(self.resolved)
+                body += one_chunk
+            response.close()
+        return first_time, time.time() - start_time, resolved_at_first, body.decode().splitlines()
+
+    def test_time_to_first_byte(self):
+        first_time, total_time, resolved_at_first, lines = self.read_stream('/address/balance?stream=1', 'get_address_balance_batch')
+        # the first line leaves while most of the upstream chunks are still outstanding
+        self.assertLess(resolved_at_first, len(self.address_list))
+        self.assertLess(first_time, total_time / 2)
+        self.assertEqual([json.loads(one_line) for one_line in lines],
+                         [{'address': one_address, 'balance': 101.0} for one_address in self.address_list])
+
+    def test_accept_header(self):
+        start_time = time.time()
+        with mock.patch.object(web.rpc_call, 'get_address_balance_batch', self.get_balance_batch):
+            response = self.client.post('/address/balance', data=json.dumps(self.address_list[:3]),
+                                        headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(one_line)['address'] for one_line in response.get_data(as_text=True).splitlines()],
+                         self.address_list[:3])
+        self.assertLess(time.time() - start_time, 1)
+
+    def test_buffered(self):
+        with mock.patch.object(web.rpc_call, 'get_address_balance_batch', self.get_balance_batch):
+            response = self.client.post('/address/balance', data=json.dumps(self.address_list))
+        self.assertEqual(len(self.resolved), len(self.address_list))
+        self.assertEqual([one_info['address'] for one_info in response.get_json()['data']], self.address_list)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import struct
+import unittest
+from unittest import mock
+import gevent
+from gevent.pywsgi import WSGIServer
+from http_server import config
+from http_server import log
+from http_server import zmq_listener
+
+WATCH_OUTPUT = '1BoatSLRHtKNngkdXEeobR76b53LETtpyT'
+WATCH_INPUT = '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa'
+
+
+def get_subscription(name):
+    return {'name': name, 'cid': 'c1', 'chain_type': 'BTC', 'chain_id': 'mainnet', 'language': 'en', 'platform': 'ios'}
+
+
+@unittest.skipIf(zmq_listener.zmq is None, "pyzmq is not installed")
+class TestZmqNotify(unittest.TestCase):
+    ''' the notifier against a local zmq publisher, a bitcoind rpc and a notify hub stand-in '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.state = {'mempool': [], 'poll': 0, 'push': [], 'known_at_poll': set()}
+        cls.server = WSGIServer(('127.0.0.1', 0), cls.application, log=None)
+        cls.server.start()
+        cls.publisher = zmq_listener.zmq.Context.instance().socket(zmq_listener.zmq.PUB)
+        port = cls.publisher.bind_to_random_port('tcp://127.0.0.1')
+        cls.sequence = {}
+
+        # every prevout is indexed, nothing may reach a real electrumx; nothing is written to disk
+        cls.config_patch = mock.patch.dict(config.config, {
+            'notify_server_address': 'http://127.0.0.1:' + str(cls.server.server_port),
+            'rpcaddress': '127.0.0.1',
+            'rpcport': cls.server.server_port,
+            'mempool_snapshot_file': '',
+            'transaction_cache_file': '',
+            'zmq_address': 'tcp://127.0.0.1:' + str(port),
+            'host_electrumx': '127.0.0.1',
+            'port_electrumx': 1})
+        cls.config_patch.start()
+        log.logger.removeHandler(log.file_handle)
+        from http_server import notify, address, prevout_index
+        cls.notify = notify
+        cls.output_script = address.address_to_script(WATCH_OUTPUT)
+        cls.previous_txid = os.urandom(32).hex()
+        prevout_index.get_index().put(cls.previous_txid, 0, 'pubkeyhash', WATCH_INPUT, 100000)
+
+        assert notify.start_zmq()
+        # a slow joiner misses what is published before the subscription is in place
+        gevent.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.publisher.close()
+        cls.config_patch.stop()
+        log.logger.addHandler(log.file_handle)
+
+    @classmethod
+    def application(cls, environ, start_response):
+        if '/v1/cids' == environ['PATH_INFO']:
+            body = {'errno': 0, 'errmsg': '', 'data': {'addresses': [get_subscription(WATCH_OUTPUT), get_subscription(WATCH_INPUT)]}}
+        elif '/v1/push' == environ['PATH_INFO']:
+            cls.state['push'].append(json.loads(environ['wsgi.input'].read())['push_list'])
+            body = {'errno': 0, 'errmsg': ''}
+        else:
+            cls.state['poll'] += 1
+            cls.state['known_at_poll'] = set(cls.notify.all_unconfirmed_transaction.txids)
+            body = {'result': cls.state['mempool'], 'error': None}
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [json.dumps(body).encode()]
+
+    def make_transaction(self, value):
+        ''' raw transaction spending the watched input to the watched output '''
+        return (struct.pack('<I', 1) + b'\x01' + bytes.fromhex(self.previous_txid)[::-1] + struct.pack('<I', 0) + b'\x00' + b'\xff' * 4
+                + b'\x01' + struct.pack('<Q', value) + bytes([len(self.output_script)]) + self.output_script + b'\x00' * 4)
+
+    def get_txid(self, raw):
+        return self.notify.raw_transaction.deserialize(raw.hex())['txid']
+
+    def publish(self, topic, body, skip=0):
+        sequence = self.sequence.get(topic, 0) + skip
+        self.sequence[topic] = sequence + 1
+        self.publisher.send_multipart([topic, body, struct.pack('<I', sequence)])
+
+    def publish_mempool_transaction(self, raw, skip=0):
+        ''' what bitcoind publishes when it accepts a transaction into its mempool '''
+        self.publish(b'rawtx', raw, skip)
+        self.publish(b'sequence', bytes.fromhex(self.get_txid(raw)) + b'A' + struct.pack('<Q', 1))
+
+    def publish_block(self, raw_list):
+        ''' what bitcoind publishes when it connects a block: rawtx for every transaction, then the block itself '''
+        for raw in raw_list:
+            self.publish(b'rawtx', raw)
+        self.publish(b'sequence', os.urandom(32) + b'C')
+
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            gevent.sleep(0.01)
+        return condition()
+
+    def test_transaction_pushed_once(self):
+        raw = self.make_transaction(1000)
+        push_count = len(self.state['push'])
+        self.publish_mempool_transaction(raw)
+        self.assertTrue(self.wait_for(lambda: len(self.state['push']) == push_count + 1))
+        self.assertEqual(sorted([(one_push['msg_type'], one_push['name']) for one_push in self.state['push'][-1]]),
+                         [(1, WATCH_OUTPUT), (2, WATCH_INPUT)])
+
+        # the same transaction again, then a poll that lists it: both are known to the mempool set
+        self.publish_mempool_transaction(raw)
+        gevent.sleep(0.3)
+        self.state['mempool'] = [self.get_txid(raw)]
+        self.notify.reconcile_unconfirmed_transaction()
+        gevent.sleep(0.3)
+        self.assertEqual(len(self.state['push']), push_count + 1)
+
+    def test_sequence_gap_reconciles(self):
+        push_count = len(self.state['push'])
+        self.publish_mempool_transaction(self.make_transaction(2000))
+        self.assertTrue(self.wait_for(lambda: len(self.state['push']) == push_count + 1))
+        poll_count = self.state['poll']
+        self.publish_mempool_transaction(self.make_transaction(3000), skip=3)
+        self.assertTrue(self.wait_for(lambda: self.state['poll'] > poll_count))
+        # the transaction after the gap is still matched
+        self.assertTrue(self.wait_for(lambda: len(self.state['push']) == push_count + 2))
+
+    def test_new_block_reconciles(self):
+        poll_count = self.state['poll']
+        self.publish_block([])
+        self.assertTrue(self.wait_for(lambda: self.state['poll'] > poll_count))
+
+    def test_block_transaction_after_reconcile(self):
+        raw = self.make_transaction(4000)
+        mined_raw = self.make_transaction(5000)
+        push_count = len(self.state['push'])
+        poll_count = self.state['poll']
+        self.state['mempool'] = []
+        # the block follows right behind the acceptance, its reconcile must see the transaction already
+        self.publish_mempool_transaction(raw)
+        self.publish_block([raw, mined_raw])
+        self.assertTrue(self.wait_for(lambda: self.state['poll'] > poll_count))
+        self.assertIn(bytes.fromhex(self.get_txid(raw)), self.state['known_at_poll'])
+        self.assertTrue(self.wait_for(lambda: len(self.state['push']) == push_count + 1))
+
+        # the reconcile took the transaction out of the mempool set; rawtx for the block, even late, is no news
+        self.assertNotIn(bytes.fromhex(self.get_txid(raw)), self.notify.all_unconfirmed_transaction.txids)
+        self.publish(b'rawtx', raw)
+        self.publish(b'rawtx', mined_raw)
+        gevent.sleep(0.3)
+        self.assertEqual(len(self.state['push']), push_count + 1)
+
+    def test_burst_is_one_batch(self):
+        push_count = len(self.state['push'])
+        # what the listener receives without yielding is taken by the matcher as one batch
+        for index in range(50):
+            raw = self.make_transaction(10000 + index)
+            self.notify.on_zmq_message('rawtx', raw)
+            self.notify.on_zmq_message('sequence', bytes.fromhex(self.get_txid(raw)) + b'A' + struct.pack('<Q', index))
+        self.assertTrue(self.wait_for(lambda: len(self.state['push']) > push_count))
+        gevent.sleep(0.3)
+        self.assertEqual(len(self.state['push']), push_count + 1)
+        self.assertEqual(len(self.state['push'][-1]), 100)
+
+
+class TestSequenceGap(unittest.TestCase):
+
+    def test_is_gap(self):
+        listener = zmq_listener.ZmqListener('', {}, None)
+        self.assertFalse(listener.is_gap('rawtx', struct.pack('<I', 7)))
+        self.assertFalse(listener.is_gap('rawtx', struct.pack('<I', 8)))
+        self.assertTrue(listener.is_gap('rawtx', struct.pack('<I', 10)))
+        # every topic counts on its own, and the counter wraps
+        self.assertFalse(listener.is_gap('sequence', struct.pack('<I', 0xffffffff)))
+        self.assertFalse(listener.is_gap('sequence', struct.pack('<I', 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
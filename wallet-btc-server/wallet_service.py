@@ -2,11 +2,30 @@
 
 from http_server import web
 from http_server import notify
-from multiprocessing import Process
+from http_server import config
+from http_server.log import logger
+import multiprocessing
+import signal
+import time
 
-def main():
-    son_process_http = Process(target=web.http_task)
-    son_process_timer= Process(target=notify.timer_task)
+# workers inherit the listen socket, so they have to be forked
+context = multiprocessing.get_context('fork')
+
+def run_process(target, *args):
+    # a forked child must not keep the supervisor's signal handlers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    target(*args)
+
+def start_process(target, *args):
+    one_process = context.Process(target=run_process, args=(target,) + args)
+    one_process.start()
+    return one_process
+
+def debug_main():
+    son_process_http = context.Process(target=web.http_task)
+    son_process_timer= context.Process(target=notify.timer_task)
 
     # start
     son_process_http.start()
@@ -16,5 +35,52 @@ def main():
     son_process_http.join()
     son_process_timer.join()
 
+def main():
+    if 'debug' == config.config['http_mode']:
+        debug_main()
+        return
+
+    listener = web.create_listener()
+    workers = [start_process(web.http_worker_task, listener) for _ in range(config.config['http_workers'])]
+    son_process_timer = start_process(notify.timer_task)
+
+    # SIGHUP: graceful restart of the http workers, SIGTERM/SIGINT: stop everything
+    state = {'restart': False, 'stop': False}
+    signal.signal(signal.SIGHUP, lambda signum, frame: state.update(restart=True))
+    signal.signal(signal.SIGTERM, lambda signum, frame: state.update(stop=True))
+    signal.signal(signal.SIGINT, lambda signum, frame: state.update(stop=True))
+
+    while not state['stop']:
+        time.sleep(1)
+
+        # recycled or crashed workers are replaced
+        index = 0
+        while index < len(workers):
+            if not workers[index].is_alive():
+                logger.info("http worker " + str(workers[index].pid) + " exit code " + str(workers[index].exitcode) + ", start a new one")
+                workers[index] = start_process(web.http_worker_task, listener)
+            index += 1
+
+        if not son_process_timer.is_alive():
+            logger.error("notify process exit code " + str(son_process_timer.exitcode) + ", start a new one")
+            son_process_timer = start_process(notify.timer_task)
+
+        # one worker at a time, the new one is serving before the old one drains
+        if state['restart']:
+            state['restart'] = False
+            index = 0
+            while index < len(workers):
+                old_worker = workers[index]
+                workers[index] = start_process(web.http_worker_task, listener)
+                old_worker.terminate()
+                old_worker.join()
+                index += 1
+            logger.info("http workers restarted")
+
+    for one_process in workers + [son_process_timer]:
+        one_process.terminate()
+    for one_process in workers + [son_process_timer]:
+        one_process.join()
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()